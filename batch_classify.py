@@ -0,0 +1,260 @@
+"""
+Batch mode: the ChatGPT requests of a crawl are collected into a JSONL file and answered offline (e.g. by the OpenAI
+Batch API, at a lower price and without the rate limits of the chat endpoint) instead of one by one while the pages
+are loaded.
+
+A run has rounds. In every round the remaining apps are crawled by run_batch with llm_batch_dir, which sets
+config['llm_batch_dir'] in its worker processes: a ChatGPT request whose answer was already ingested gets it, any
+other request is written to a request file and its app is deferred (see chatgpt_utils.LLMRequestDeferred). The
+requests of the round are sent to a batch backend and its answers are ingested, then the deferred apps are crawled
+again. An app may need several rounds, e.g. when its page links to the policy, whose page is classified only once the
+anchor to follow is known. Apps that are not deferred are saved as usual. Pages are loaded again in every round, which
+costs less than the ChatGPT calls the batch saves.
+
+Batch backends:
+    OpenAIBatchBackend: the OpenAI Batch API (/v1/batches)
+    ChatBackend: sends the requests of a batch concurrently to the chat endpoint, e.g. of a mock or compatible server
+    StubBatchBackend: answers with a function, for tests and offline benchmarks
+All of them write the answers in the output format of the OpenAI Batch API.
+
+Usage:
+    python batch_classify.py --batch-dir llm_batch --backend openai
+"""
+import os
+import glob
+import json
+import time
+import argparse
+import openai
+from chatgpt_utils import ask_chatgpt_many, get_batch_answers
+from batch_runner import run_batch
+from get_websites import iter_website_list
+from config import config
+
+
+def _output_line(custom_id, answer=None, error=None):
+    # a line of a batch output file, with a chat completion in the format of the chat endpoint
+    if error is not None:
+        return {'id': f'batch_req_{custom_id[:16]}', 'custom_id': custom_id, 'response': None,
+                'error': {'code': 'request_failed', 'message': error}}
+    body = {'object': 'chat.completion', 'model': config['chatgpt_model'],
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': answer}, 'finish_reason': 'stop'}]}
+    return {'id': f'batch_req_{custom_id[:16]}', 'custom_id': custom_id,
+            'response': {'status_code': 200, 'body': body}, 'error': None}
+
+
+def _read_jsonl(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class OpenAIBatchBackend:
+    """
+    Submits request files to the OpenAI Batch API, whose batches finish within completion_window.
+    """
+
+    def __init__(self, completion_window='24h'):
+        self.completion_window = completion_window
+
+    def _requestor(self):
+        return openai.api_requestor.APIRequestor(key=openai.api_key, api_base=config['openai_api_base'])
+
+    def submit(self, requests_path):
+        """
+        Upload a request file, create a batch of it and return the batch id.
+        """
+        with open(requests_path, 'rb') as f:
+            input_file = openai.File.create(file=f, purpose='batch', api_base=config['openai_api_base'])
+        response, _, _ = self._requestor().request('post', '/batches', params={
+            'input_file_id': input_file['id'], 'endpoint': '/v1/chat/completions',
+            'completion_window': self.completion_window})
+        return response.data['id']
+
+    def retrieve(self, batch_id, output_path):
+        """
+        Return False if the batch is still running. Otherwise write its output file (with the failed requests as
+        errors) to output_path and return True.
+        """
+        response, _, _ = self._requestor().request('get', f'/batches/{batch_id}')
+        batch = response.data
+        if batch['status'] not in ('completed', 'failed', 'expired', 'cancelled'):
+            return False
+        with open(output_path, 'wb') as f:
+            for file_id in (batch.get('output_file_id'), batch.get('error_file_id')):
+                if file_id:
+                    f.write(openai.File.download(file_id, api_base=config['openai_api_base']))
+        return True
+
+
+class ChatBackend:
+    """
+    Answers a request file right away with concurrent calls to the chat endpoint (within the limits in config), for
+    servers without the Batch API.
+    """
+
+    def __init__(self):
+        self._outputs = {}  # batch id -> output lines
+        self._submitted = 0
+
+    def answer(self, messages_list):
+        return ask_chatgpt_many(messages_list)
+
+    def submit(self, requests_path):
+        requests = _read_jsonl(requests_path)
+        answers = self.answer([request['body']['messages'] for request in requests])
+        self._submitted += 1
+        batch_id = f'batch_{self._submitted}'
+        self._outputs[batch_id] = [
+            _output_line(request['custom_id'], error='ChatGPT API Error') if answer == 'ChatGPT API Error'
+            else _output_line(request['custom_id'], answer)
+            for request, answer in zip(requests, answers)
+        ]
+        return batch_id
+
+    def retrieve(self, batch_id, output_path):
+        with open(output_path, 'w', encoding='utf-8') as f:
+            for line in self._outputs.pop(batch_id):
+                f.write(json.dumps(line, ensure_ascii=False) + '\n')
+        return True
+
+
+class StubBatchBackend(ChatBackend):
+    """
+    Answers every request with responder, a function receiving the list of messages of a request and returning the
+    answer text (like the responders of mock_openai). The requests are recorded in requests.
+    """
+
+    def __init__(self, responder):
+        super().__init__()
+        self.responder = responder
+        self.requests = []
+
+    def answer(self, messages_list):
+        self.requests.extend(messages_list)
+        return [self.responder(messages) for messages in messages_list]
+
+
+BATCH_BACKENDS = {'openai': OpenAIBatchBackend, 'chat': ChatBackend}
+
+
+def collect(app_list, batch_dir, **kwargs):
+    """
+    Crawl app_list with run_batch (kwargs are passed to it) in batch mode: the ChatGPT requests without an ingested
+    answer are written to the request files in batch_dir and their apps have the key deferred set to True.
+    """
+    os.makedirs(batch_dir, exist_ok=True)
+    yield from run_batch(app_list, llm_batch_dir=batch_dir, **kwargs)
+
+
+def prepare_requests(batch_dir, name):
+    """
+    Merge the request files written by the worker processes into one request file, <name>.jsonl in batch_dir, without
+    duplicates and without the requests whose answer was ingested meanwhile. Return its path and number of requests.
+    """
+    answers = get_batch_answers(batch_dir)
+    requests_path = os.path.join(batch_dir, f'{name}.jsonl')
+    seen = set()
+    with open(requests_path, 'w', encoding='utf-8') as output:
+        for path in sorted(glob.glob(os.path.join(batch_dir, 'requests-*.jsonl'))):
+            for request in _read_jsonl(path):
+                if request['custom_id'] in seen or answers.get(request['custom_id']) is not None:
+                    continue
+                seen.add(request['custom_id'])
+                output.write(json.dumps(request, ensure_ascii=False) + '\n')
+            os.remove(path)
+    return requests_path, len(seen)
+
+
+def ingest(output_path, batch_dir):
+    """
+    Store the answers of a batch output file in the answer store of batch_dir. Return the number of answers and of
+    failed requests (which are requested again in the next round).
+    """
+    answers = get_batch_answers(batch_dir)
+    answered, failed = 0, 0
+    for line in _read_jsonl(output_path):
+        response = line.get('response')
+        if line.get('error') is not None or response is None or response['status_code'] != 200:
+            failed += 1
+            continue
+        answers.set(line['custom_id'], {'answer': response['body']['choices'][0]['message']['content']})
+        answered += 1
+    return answered, failed
+
+
+def _write_apps(path, apps):
+    with open(path, 'w', encoding='utf-8') as f:
+        for app in apps:
+            f.write(json.dumps(list(app)) + '\n')
+
+
+def run(app_list, batch_dir, backend, max_rounds=None, poll_interval=None, **kwargs):
+    """
+    Crawl app_list in batch rounds (see the module docstring) until no app is deferred, for at most max_rounds
+    (default config['llm_batch_max_rounds']). backend answers the requests of every round; its batches are polled
+    every poll_interval seconds (default config['llm_batch_poll_interval']). kwargs are passed to run_batch.
+
+    Return a generator of the results of run_batch of the apps that finished, round by round. Apps still deferred
+    after the last round are generated at the end with an error.
+    """
+    max_rounds = max_rounds or config['llm_batch_max_rounds']
+    poll_interval = config['llm_batch_poll_interval'] if poll_interval is None else poll_interval
+    deferred = []
+    for round_number in range(1, max_rounds + 1):
+        deferred = []
+        for result in collect(app_list, batch_dir, **kwargs):
+            if result.get('deferred'):
+                deferred.append((result['url'], result['app_id'], result['app_name']))
+            else:
+                yield result
+        if not deferred:
+            return
+        # the apps of the next round, so that an interrupted run can be continued from the files in batch_dir
+        app_list = deferred
+        _write_apps(os.path.join(batch_dir, f'deferred-{round_number}.jsonl'), deferred)
+        requests_path, count = prepare_requests(batch_dir, f'batch-{round_number}')
+        print(f'Batch round {round_number}: {len(deferred)} apps wait for {count} ChatGPT requests')
+        if count == 0:
+            continue
+        batch_id = backend.submit(requests_path)
+        output_path = os.path.join(batch_dir, f'batch-{round_number}-output.jsonl')
+        while not backend.retrieve(batch_id, output_path):
+            time.sleep(poll_interval)
+        answered, failed = ingest(output_path, batch_dir)
+        print(f'Batch round {round_number}: {answered} answers ingested, {failed} requests failed')
+
+    for index, (url, app_id, app_name) in enumerate(deferred):
+        yield {'index': index, 'url': url, 'app_id': app_id, 'app_name': app_name, 'is_policy_page': None,
+               'error': f'no ChatGPT answers after {max_rounds} batch rounds', 'elapsed_time': 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch-dir', default='llm_batch', help='folder of the request, output and answer files')
+    parser.add_argument('--backend', choices=sorted(BATCH_BACKENDS), default='openai')
+    parser.add_argument('--apps', default=None,
+                        help='JSONL file of [url, app_id] or [url, app_id, app_name] lines to crawl instead of '
+                             'config["link_csv_path"], e.g. a deferred-<round>.jsonl file of an interrupted run')
+    args = parser.parse_args()
+
+    openai.api_key = config['openai_api_key']
+    if args.apps:
+        app_list = [tuple(app) for app in _read_jsonl(args.apps)]
+    else:
+        app_list = iter_website_list(csv_file_path=config['link_csv_path'], policy_col_name=config['policy_col_name'],
+                                     appid_col_name=config['app_id_col_name'],
+                                     appname_col_name=config['app_name_col_name'])
+    start_time = time.time()
+    counts = {'policy': 0, 'not policy': 0, 'error': 0}
+    for result in run(app_list, args.batch_dir, BATCH_BACKENDS[args.backend](), workers=config['batch_workers'],
+                      results_path=config['results_path']):
+        if result['error'] is not None:
+            print(f'Error occurred when processing document {result["app_id"]}: {result["error"]}')
+            counts['error'] += 1
+        else:
+            counts['policy' if result['is_policy_page'] else 'not policy'] += 1
+    print(f'Total time: {time.time() - start_time:.1f} seconds, {counts}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+import json
+import time
+import multiprocessing
+import multiprocessing.util
+import concurrent.futures
+from urllib.parse import urlparse
+import openai
+from download_text_genai import download_text_save
+from chatgpt_utils import LLMRequestDeferred, set_rate_limit_share
+from driver_pool import DriverPool
+from fetcher import set_domain_limiter
+from policy_resolver import SearchDeferred, get_policy_resolver
+import pre_classifier
+import prompt_builder
+from tracing import start_trace
+from config import config
+
+
+class DomainRateLimiter:
+    """
+    Politeness limit shared by all worker processes: two requests to the same domain are started at least
+    min_interval seconds apart. Each caller reserves the next free time slot of the domain under a lock and then
+    sleeps until its slot outside of the lock, so workers crawling other domains are never blocked.
+    """
+
+    def __init__(self, min_interval, manager):
+        self.min_interval = min_interval
+        self._next_slot = manager.dict()  # domain -> earliest time the next request may start
+        self._lock = manager.Lock()
+
+    def wait(self, url):
+        domain = urlparse(url).netloc.lower()
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._next_slot.get(domain, 0))
+            self._next_slot[domain] = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+# state of a worker process, set up once by _init_worker
+_worker_pool = None
+
+
+def _init_worker(limiter, api_key, workers, llm_batch_dir=None):
+    global _worker_pool
+    openai.api_key = api_key
+    config['llm_batch_dir'] = llm_batch_dir  # passed explicitly, the workers may be spawned instead of forked
+    set_rate_limit_share(workers)  # the workers share the ChatGPT budget instead of each using all of it
+    set_domain_limiter(limiter)  # every page a job loads waits for it, not only the first one
+    _worker_pool = DriverPool(size=1)
+    # atexit handlers do not run in pool workers, multiprocessing finalizers do
+    multiprocessing.util.Finalize(None, _worker_pool.close, exitpriority=10)
+
+
+def _run_job(index, url, app_id, output_path_policy, output_path_nonpolicy, app_name, defer_search=False):
+    result = {'index': index, 'url': url, 'app_id': app_id, 'app_name': app_name, 'is_policy_page': None, 'error': None}
+    start_time = time.time()
+    llm_calls_avoided = pre_classifier.get_stats()['llm_calls_avoided']
+    prompt_tokens_saved = prompt_builder.get_stats()['tokens_saved']
+    report = {}
+    get_policy_resolver().defer_searches = defer_search
+    with start_trace(str(app_id), url=url) as trace:
+        try:
+            _, is_policy_page = download_text_save(url, app_id, output_path_policy, output_path_nonpolicy, app_name,
+                                                   pool=_worker_pool, report=report)
+            result['is_policy_page'] = is_policy_page
+        except LLMRequestDeferred:
+            result['deferred'] = True  # batch mode, see batch_classify.py
+        except SearchDeferred:
+            result['search_deferred'] = True  # run_batch searches for the app and runs it again
+        except Exception as e:
+            result['error'] = repr(e)
+    result['elapsed_time'] = time.time() - start_time
+    result['llm_calls_avoided'] = pre_classifier.get_stats()['llm_calls_avoided'] - llm_calls_avoided
+    result['prompt_tokens_saved'] = prompt_builder.get_stats()['tokens_saved'] - prompt_tokens_saved
+    result['tiers'] = report.get('tiers', [])
+    result['final_url'] = report.get('final_url')
+    result['classification'] = report.get('classification')
+    result['output_path'] = report.get('output_path')
+    result['policy_change'] = report.get('policy_change')
+    if trace is not None:
+        result['trace'] = trace.to_record()
+    return result
+
+
+def run_batch(app_list, workers=None, output_path_policy=None, output_path_nonpolicy=None, results_path=None,
+              on_result=None, journal=None, llm_batch_dir=None):
+    """
+    Run download_text_save for every app of app_list in a pool of worker processes, each holding its own Chrome
+    driver.
+
+    Arguments:
+        app_list: an iterable of (url, app_id) or (url, app_id, app_name) tuples, e.g. from iter_website_list. It is
+        consumed lazily. The app name is used to search for the policy if the URL fails or is a 404 page (see
+        policy_resolver). These searches are made together, config['search_workers'] at a time
+        (PolicyResolver.resolve_many), and the apps are then run again, finding their search result in the cache.
+        workers: number of worker processes (default: config['batch_workers'])
+        output_path_policy, output_path_nonpolicy: output folders (default: the ones in config)
+        results_path: if given, every result is appended to this JSONL file as soon as it finishes
+        on_result: if given, called with every result as soon as it finishes (in completion order)
+        journal: if given, a CrawlJournal. Apps it records as done are skipped, every other app is recorded as
+        pending when it is submitted and as done or failed when it finishes, so an interrupted run can be resumed.
+        llm_batch_dir: the folder of the batch mode in the worker processes (default: config['llm_batch_dir']), see
+        batch_classify.py
+    Return:
+        A generator of result dicts in the order of app_list (without the skipped apps; index counts the apps that
+        were run). Each result has the keys index, url, app_id, app_name, is_policy_page (None if an error occurred),
+        error, elapsed_time, llm_calls_avoided (by the local pre-classifier), prompt_tokens_saved (see
+        prompt_builder), tiers, final_url, classification, output_path and policy_change (see download_text and
+        download_text_save), and trace (see tracing.Trace.to_record) if config['tracing_enabled'] is True. In batch
+        mode (see batch_classify.py), an app whose ChatGPT answers are not there yet has the key deferred set to
+        True.
+    """
+    workers = workers or config['batch_workers']
+    output_path_policy = output_path_policy or config['output_path_policy']
+    output_path_nonpolicy = output_path_nonpolicy or config['output_path_nonpolicy']
+    llm_batch_dir = llm_batch_dir or config['llm_batch_dir']
+    max_in_flight = workers * 2  # keep workers busy without reading the whole app list up front
+    max_waiting = workers * 16  # finished results held back behind a slow app; no app is submitted beyond it
+    if journal is not None:
+        app_list = (app for app in app_list if not journal.is_done(app[1]))
+
+    with multiprocessing.Manager() as manager:
+        limiter = DomainRateLimiter(config['domain_min_interval'], manager)
+        resolver = get_policy_resolver()
+        results_file = open(results_path, 'a', encoding='utf-8') if results_path else None
+        try:
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=workers, initializer=_init_worker,
+                    initargs=(limiter, openai.api_key, workers, llm_batch_dir)) as executor:
+                apps = enumerate(app_list)
+                in_flight = set()
+                finished = {}  # index -> result, waiting for earlier results
+                searches = {}  # index -> result of a job waiting for the search of its app name
+                searched = {}  # index -> result of the first run of a job that runs again after its search
+                next_index = 0
+                exhausted = False
+
+                while True:
+                    while not exhausted and len(in_flight) < max_in_flight and len(finished) < max_waiting:
+                        try:
+                            index, app = next(apps)
+                        except StopIteration:
+                            exhausted = True
+                            break
+                        url, app_id, app_name = (*app, '')[:3]
+                        if journal is not None:
+                            journal.mark_pending(app_id, url)
+                        in_flight.add(executor.submit(_run_job, index, url, app_id, output_path_policy,
+                                                      output_path_nonpolicy, app_name, True))
+                    if searches and (len(searches) >= config['search_workers'] or len(in_flight) < max_in_flight):
+                        resolver.resolve_many(result['app_name'] for result in searches.values())
+                        for index, result in searches.items():
+                            in_flight.add(executor.submit(_run_job, index, result['url'], result['app_id'],
+                                                          output_path_policy, output_path_nonpolicy,
+                                                          result['app_name']))
+                        searched.update(searches)
+                        searches = {}
+                    if not in_flight:
+                        break
+
+                    done, in_flight = concurrent.futures.wait(in_flight,
+                                                              return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        result = future.result()
+                        if result.get('search_deferred'):
+                            searches[result['index']] = result
+                            continue
+                        first_run = searched.pop(result['index'], None)
+                        if first_run is not None:
+                            # both runs count towards the app
+                            for key in ('elapsed_time', 'llm_calls_avoided', 'prompt_tokens_saved'):
+                                result[key] += first_run[key]
+                            result['tiers'] = first_run['tiers'] + result['tiers']
+                        if journal is not None:
+                            journal.record_result(result)
+                        if results_file:
+                            results_file.write(json.dumps(result, default=str) + '\n')
+                            results_file.flush()
+                        if on_result:
+                            on_result(result)
+                        finished[result['index']] = result
+
+                    while next_index in finished:
+                        yield finished.pop(next_index)
+                        next_index += 1
+        finally:
+            if results_file:
+                results_file.close()
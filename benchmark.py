@@ -0,0 +1,327 @@
+"""
+Benchmarks of the scraper against a local fixture server. Run `python benchmark.py <benchmark> --help` for the options
+of each benchmark.
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import statistics
+import openai
+from fixture_server import FixtureServer, add_sample_pages, add_heavy_pages, add_app_fixtures
+from mock_openai import MockOpenAIServer
+from config import config
+
+
+def summarize(name, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f'{name}: {len(latencies)} URLs, total {sum(latencies):.2f}s, mean {statistics.mean(latencies):.3f}s, '
+          f'median {statistics.median(latencies):.3f}s, p95 {p95:.3f}s per URL')
+
+
+def bench_driver_pool(args):
+    """
+    Compare the per-URL latency of loading a page with a fresh Chrome instance per URL (the behavior of download_text
+    without a pool) against checking drivers out of a DriverPool.
+    """
+    from driver_pool import DriverPool, new_driver
+
+    with FixtureServer() as server:
+        paths = add_sample_pages(server, 'sample_outputs/saved_policies', '/policy', limit=args.urls)
+        urls = [server.url(path) for path in paths]
+
+        fresh_latencies = []
+        for url in urls:
+            start = time.perf_counter()
+            driver = new_driver()
+            try:
+                driver.get(url)
+                driver.page_source
+            finally:
+                driver.quit()
+            fresh_latencies.append(time.perf_counter() - start)
+
+        pool_latencies = []
+        with DriverPool(size=1) as pool:
+            for url in urls:
+                start = time.perf_counter()
+                with pool.checkout() as driver:
+                    driver.get(url)
+                    driver.page_source
+                pool_latencies.append(time.perf_counter() - start)
+
+    summarize('fresh driver per URL', fresh_latencies)
+    summarize('driver pool', pool_latencies)
+    print(f'speedup: {sum(fresh_latencies) / sum(pool_latencies):.1f}x')
+
+
+def bench_lean_browser(args):
+    """
+    Compare loading pages with images, fonts, a video and a tracker (see fixture_server.add_heavy_pages) in Chrome with
+    the full profile against the lean profile (config['lean_browser']): bytes transferred and time until the page is
+    ready, per page, and whether the text of the pages is the same.
+    """
+    from driver_pool import new_driver
+    from page_readiness import wait_until_ready
+
+    with FixtureServer() as server:
+        urls = [server.url(path) for path in add_heavy_pages(server, 'sample_outputs/saved_policies', '/policy',
+                                                             limit=args.urls)]
+        texts = {}
+        for lean in (False, True):
+            config['lean_browser'] = lean
+            name = 'lean profile' if lean else 'full profile'
+            driver = new_driver()
+            try:
+                latencies, page_bytes, texts[lean] = [], [], []
+                for url in urls:
+                    server.reset_counters()
+                    start = time.perf_counter()
+                    driver.get(url)
+                    wait_until_ready(driver, url)
+                    latencies.append(time.perf_counter() - start)
+                    page_bytes.append(server.bytes_sent)
+                    texts[lean].append(driver.execute_script('return document.body.innerText;'))
+            finally:
+                driver.quit()
+            summarize(name, latencies)
+            print(f'{name}: mean {statistics.mean(page_bytes) / 1024:.0f} KiB transferred per page')
+    same = sum(full == lean for full, lean in zip(texts[False], texts[True]))
+    print(f'same text with both profiles: {same}/{len(urls)} pages')
+
+
+def make_oracle_responder(apps):
+    """
+    Return a deterministic mock LLM responder for the app fixtures (see fixture_server.add_app_fixtures). It answers
+    like a perfect classifier, but only from what the prompt contains: a page is a policy if the prompt contains the
+    marker of a document annotated as a policy, so a page whose document was not collected is answered "No". Anchor
+    questions are answered with the first anchor text mentioning privacy.
+    """
+    labels = {app['marker']: app['is_policy'] for app in apps if app['marker'] and app['case'] != 'hub'}
+
+    def responder(messages):
+        prompt = messages[1]['content'] if len(messages) > 1 else messages[0]['content']
+        if config['analyze_anchor_text_prompt_ending'] in prompt:
+            anchors = [line for line in prompt.split('\n') if 'privacy' in line.lower()]
+            return anchors[0].strip() if anchors else 'NONE'
+
+        marker = re.search(r'Fixture document \S+?\.(?=\s|$)', prompt)
+        is_policy = labels.get(marker.group(0), False) if marker else False
+        is_404 = 'could not be found' in prompt
+        if config['structured_classification_prompt_ending'] in prompt:
+            return json.dumps({'is_privacy_policy': is_policy, 'is_404': is_404,
+                               'links_to_privacy_policy': not is_policy and not is_404})
+
+        answer = 'Yes' if (is_404 if config['if_404_prompt_ending'] in prompt else is_policy) else 'No'
+        if len(messages) > 2:
+            return answer  # the Chain of Thought call extracting the one-word answer
+        return f'{answer}. Evidence: the decision was made by the benchmark oracle.'
+
+    return responder
+
+
+def setup_offline_run(args, server):
+    """
+    Serve the app fixtures, start the mock LLM and point the scraper to it. Return (apps, mock).
+    """
+    apps = add_app_fixtures(server, limit=args.apps)
+    mock = MockOpenAIServer(responder=make_oracle_responder(apps), latency=args.llm_latency).start()
+    openai.api_key = 'benchmark'
+    config['openai_api_base'] = mock.api_base
+    config['llm_cache_path'] = None  # every run has to ask the mock
+    config['domain_min_interval'] = 0  # all fixtures are served by one host
+    config['classification_mode'] = args.classification_mode
+    config['preclassifier_enabled'] = not args.no_preclassifier
+    return apps, mock
+
+
+def report_offline_run(name, apps, outcomes, wall_time, mock, args):
+    """
+    Print throughput, latency, memory and accuracy of a run. outcomes maps app_id to a dict with is_policy_page,
+    text (None if an error occurred) and elapsed_time. Exit with status 1 if the accuracy is below args.min_accuracy.
+    """
+    correct = [app for app in apps if outcomes[app['app_id']]['is_policy_page'] == app['is_policy']]
+    # the text of other pages may rightly come from a link the scraper followed
+    with_marker = [app for app in apps if app['marker'] and (app['is_policy'] or app['case'] == 'hub')]
+    collected = [app for app in with_marker if app['marker'] in (outcomes[app['app_id']]['text'] or '')]
+    errors = [app for app in apps if outcomes[app['app_id']]['text'] is None]
+    accuracy = len(correct) / len(apps)
+
+    print(f'{name}: {len(apps)} apps in {wall_time:.2f}s, {len(apps) / wall_time:.2f} apps/s')
+    summarize('latency', [outcomes[app['app_id']]['elapsed_time'] for app in apps])
+    print(f'memory: max RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB (this process), '
+          f'{resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024:.0f} MB (largest worker)')
+    print(f'LLM requests: {mock.request_count}')
+    print(f'accuracy (is_policy_page vs. annotation): {accuracy:.1%}, policy text collected: '
+          f'{len(collected) / len(with_marker):.1%}, errors: {len(errors)}')
+    for case in sorted({app['case'] for app in apps}):
+        case_apps = [app for app in apps if app['case'] == case]
+        case_correct = [app for app in case_apps if app in correct]
+        print(f'  {case}: {len(case_correct)}/{len(case_apps)} correct')
+    if config['preclassifier_enabled']:
+        print('note: the pre-classifier was trained on the documents of these fixtures, so the accuracy is not '
+              'measured on held-out documents (--no-preclassifier measures it without the pre-classifier)')
+    wrong = [app['app_id'] for app in apps if app not in correct]
+    if wrong:
+        print(f'wrong: {wrong}')
+    missing = [app['app_id'] for app in with_marker if app not in collected]
+    if missing:
+        print(f'policy text not collected: {missing}')
+    if args.min_accuracy is not None and accuracy < args.min_accuracy:
+        print(f'accuracy below {args.min_accuracy:.1%}')
+        sys.exit(1)
+
+
+def bench_download_text(args):
+    """
+    Download the app fixtures one after another with download_text, against the mock LLM.
+    """
+    from download_text_genai import download_text
+    from driver_pool import DriverPool
+
+    with FixtureServer() as server, DriverPool(size=1) as pool:
+        apps, mock = setup_offline_run(args, server)
+        try:
+            outcomes = {}
+            start = time.perf_counter()
+            for app in apps:
+                app_start = time.perf_counter()
+                try:
+                    text, is_policy_page = download_text(app['url'], pool=pool)
+                except Exception as e:
+                    print(f'Error downloading {app["app_id"]}: {e!r}')
+                    text, is_policy_page = None, None
+                outcomes[app['app_id']] = {'is_policy_page': is_policy_page, 'text': text,
+                                           'elapsed_time': time.perf_counter() - app_start}
+            report_offline_run('download_text', apps, outcomes, time.perf_counter() - start, mock, args)
+        finally:
+            mock.stop()
+
+
+def bench_batch(args):
+    """
+    Download the app fixtures with run_batch (like main.py), against the mock LLM. With --recrawl, the apps are
+    downloaded twice in incremental mode and the second run, in which no page changed, is reported.
+    """
+    from batch_runner import run_batch
+    from output_store import read_text
+
+    with FixtureServer() as server, tempfile.TemporaryDirectory() as output_path:
+        apps, mock = setup_offline_run(args, server)
+        config['output_store'] = args.output_store
+        config['output_store_path'] = os.path.join(output_path, 'store')
+        if args.recrawl:
+            config['incremental_crawl'] = True
+            config['incremental_state_path'] = os.path.join(output_path, 'crawl_state.sqlite3')
+        try:
+            for run in range(2 if args.recrawl else 1):
+                mock.request_count = 0
+                server.reset_counters()
+                outcomes = {}
+                changes = {}
+                start = time.perf_counter()
+                for result in run_batch(((app['url'], app['app_id']) for app in apps), workers=args.workers,
+                                        output_path_policy=output_path, output_path_nonpolicy=output_path):
+                    text = None
+                    if result['error'] is None:
+                        text = read_text(result['output_path'])
+                    else:
+                        print(f'Error downloading {result["app_id"]}: {result["error"]}')
+                    outcomes[result['app_id']] = {'is_policy_page': result['is_policy_page'], 'text': text,
+                                                  'elapsed_time': result['elapsed_time']}
+                    changes[result['policy_change']] = changes.get(result['policy_change'], 0) + 1
+                wall_time = time.perf_counter() - start
+            name = f'run_batch ({args.workers} workers{", re-crawl" if args.recrawl else ""})'
+            report_offline_run(name, apps, outcomes, wall_time, mock, args)
+            print(f'fixture server: {server.request_count} requests, {server.bytes_sent / 1024:.0f} KiB sent')
+            if args.recrawl:
+                print(f'policy changes: {changes}')
+        finally:
+            mock.stop()
+
+
+def bench_distributed(args):
+    """
+    Download the app fixtures with a coordinator and worker nodes on this machine (see distributed.py), once for
+    every number of nodes in args.nodes, against the mock LLM.
+    """
+    from distributed import SQLiteWorkQueue, run_coordinator, start_local_workers
+    from output_store import read_text
+
+    with FixtureServer() as server, tempfile.TemporaryDirectory() as output_path:
+        apps, mock = setup_offline_run(args, server)
+        try:
+            for nodes in args.nodes:
+                mock.request_count = 0
+                queue = SQLiteWorkQueue(os.path.join(output_path, f'queue-{nodes}.sqlite3'))
+                queue.enqueue((app['url'], app['app_id']) for app in apps)
+                config['output_path_policy'] = config['output_path_nonpolicy'] = output_path
+                start = time.perf_counter()
+                processes = start_local_workers(queue, nodes, args.workers)
+                outcomes = {}
+                for result in run_coordinator([], queue):
+                    text = read_text(result['output_path']) if result['error'] is None else None
+                    outcomes[result['app_id']] = {'is_policy_page': result['is_policy_page'], 'text': text,
+                                                  'elapsed_time': result.get('elapsed_time', 0.0)}
+                wall_time = time.perf_counter() - start
+                for process in processes:
+                    process.join()
+                report_offline_run(f'{nodes} nodes x {args.workers} workers', apps, outcomes, wall_time, mock, args)
+                for stats in queue.worker_stats():
+                    print(f'  {stats}')
+        finally:
+            mock.stop()
+
+
+def add_offline_arguments(parser):
+    parser.add_argument('--apps', type=int, default=None, help='number of apps of popular_apps.csv (default: all)')
+    parser.add_argument('--llm-latency', type=float, default=0.2, help='seconds the mock LLM takes per request')
+    parser.add_argument('--classification-mode', choices=('cot', 'structured'), default=config['classification_mode'])
+    parser.add_argument('--no-preclassifier', action='store_true', help='ask the mock LLM about every page')
+    parser.add_argument('--min-accuracy', type=float, default=None,
+                        help='exit with status 1 if the accuracy is below this fraction, e.g. 0.95')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    pool_parser = subparsers.add_parser('driver-pool', help='fresh Chrome per URL vs. a DriverPool')
+    pool_parser.add_argument('--urls', type=int, default=20, help='number of fixture pages to load')
+    pool_parser.set_defaults(func=bench_driver_pool)
+
+    lean_parser = subparsers.add_parser('lean-browser', help='full vs. lean Chrome profile on pages with resources')
+    lean_parser.add_argument('--urls', type=int, default=20, help='number of fixture pages to load')
+    lean_parser.set_defaults(func=bench_lean_browser)
+
+    download_parser = subparsers.add_parser('download-text', help='download_text on the app fixtures with a mock LLM')
+    add_offline_arguments(download_parser)
+    download_parser.set_defaults(func=bench_download_text)
+
+    batch_parser = subparsers.add_parser('batch', help='run_batch on the app fixtures with a mock LLM')
+    add_offline_arguments(batch_parser)
+    batch_parser.add_argument('--workers', type=int, default=config['batch_workers'], help='worker processes')
+    batch_parser.add_argument('--output-store', choices=('text', 'sharded'), default=config['output_store'],
+                              help='where the texts are saved, see output_store.py')
+    batch_parser.add_argument('--recrawl', action='store_true',
+                              help='crawl twice in incremental mode and report the second crawl')
+    batch_parser.set_defaults(func=bench_batch)
+
+    distributed_parser = subparsers.add_parser('distributed', help='worker nodes on a shared work queue, mock LLM')
+    add_offline_arguments(distributed_parser)
+    distributed_parser.add_argument('--nodes', type=int, nargs='+', default=[1, 2],
+                                    help='numbers of worker nodes to compare')
+    distributed_parser.add_argument('--workers', type=int, default=2, help='worker processes per node')
+    distributed_parser.set_defaults(func=bench_distributed)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
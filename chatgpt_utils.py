@@ -1,259 +1,576 @@
-import urllib
-import io
-import os
-import openai
-import time
-from selenium import webdriver
-from bs4 import BeautifulSoup
-import re
-import chromedriver_binary
-import pdfminer.layout
-import pdfminer.high_level
-from config import config
-
-
-def reformat(text):
-    # remove zero width spaces, replace multiple whitespaces with one
-    result = text.replace('‍', '\n')
-    result = result.replace(' ', ' ')
-    result = re.sub(r'\n+', '\n', result)
-    result = re.sub(r'[ \t]+', ' ', result)
-    return result
-
-
-def ask_chatgpt(prompt='', messages=None, retries=config['chatgpt_api_retries']):
-    """
-    This method passes the given input to ChatGPT API. Input can either be a text prompt or a complete message with
-    history conversation context. If both prompt and messages are provided, argument "prompt" will be ignored.
-
-    Arguments:
-        prompt: text to be passed to ChatGPT API
-        messages: message object to be passed to ChatGPT API
-        retries: number of retries if a call to API times out
-    Return:
-        text answer from ChatGPT or "ChatGPT API Error"
-    """
-
-    is_success = False
-    while retries > 0:
-        try:
-            if messages is None:
-                response = openai.ChatCompletion.create(
-                    model=config['chatgpt_model'],
-                    request_timeout=config['chatgpt_api_timeout'],
-                    temperature=0,
-                    messages=[
-                        {"role": "system",
-                         "content": config['initial_prompt']},
-                        {"role": "user", "content": prompt},
-                    ]
-                )
-            else:
-                response = openai.ChatCompletion.create(
-                    model=config['chatgpt_model'],
-                    request_timeout=config['chatgpt_api_timeout'],
-                    temperature=0,
-                    messages=messages
-                )
-            retries = 0
-            is_success = True
-        except Exception as e:
-            print(e)
-            retries -= 1
-            time.sleep(5)
-
-    if is_success:
-        return response.choices[0].message.content
-    else:
-        return 'ChatGPT API Error'
-
-
-def get_link_with_anchor(links):
-    """
-    Given a bs4.element.ResultSet object containing links (obtained by calling find_all('a') to some BeautifulSoup
-    object), returns two lists: a list of links, and a list of anchor texts associated with the corresponding link.
-    """
-    links_list = []
-    anchor_texts_list = []
-    for link in links:
-        href = link.get('href')
-        text = link.get_text()
-        if href and text:
-            links_list.append(href)
-            anchor_texts_list.append(text.replace('\n', '').replace('\t', ''))
-    return links_list, anchor_texts_list
-
-
-def get_policy_page_anchor(page_source):
-    """
-    Given a page source from webdriver (driver.page_source), let GenAI to decide which link may lead to a privacy
-    policy page
-
-    Arguments:
-        page_source: a page source from webdriver
-    Return:
-        the answer from GenAI about which anchor text can lead to a privacy policy.
-        Common answers include: CORRECT ANCHOR TEXT (if there is such link),
-                                text "NONE" (if there is no such link),
-                                some text stating that there is no such anchor text (if there is no such link)
-    """
-    initial_prompt = config['analyze_anchor_text_prompt_beginning']
-    task_description = config['analyze_anchor_text_prompt_ending']
-
-    soup = BeautifulSoup(page_source, 'html.parser')
-    links = soup.find_all('a')
-    hrefs, anchor_texts = get_link_with_anchor(links)
-    anchor_text_str = '\n'.join(anchor_texts)
-
-    complete_prompt = initial_prompt + anchor_text_str + task_description
-    # print(complete_prompt)
-    return ask_chatgpt(prompt=complete_prompt)
-
-
-def collect_page_text(driver, url=''):
-    page_source = driver.page_source
-    soup = BeautifulSoup(page_source, 'html.parser')
-
-    # remove headers and footers (if any)
-    header = soup.find('header')
-    head = soup.find('head')
-    footer = soup.find('footer')
-    foot = soup.find('foot')
-
-    if header:
-        header.extract()
-    if head:
-        head.extract()
-    if footer:
-        footer.extract()
-    if foot:
-        foot.extract()
-
-    # blocklist = [
-    #     'style',
-    #     'script',
-    #     'option',
-    #     'label'
-    #     # text in these labels will not be collected
-    # ]
-    #
-    # text_elements = [t for t in soup.find_all(string=True) if t.parent.name not in blocklist]
-    # text = ''
-    # for t in text_elements:
-    #     element_text = t.get_text()
-    #     # replaces every newline that is not preceded by a period or column by a space for a better format
-    #     element_text = re.sub(r'(?<=[^.:])\n(?=.)', ' ', element_text)
-    #     text += element_text
-    text = reformat(soup.get_text())
-
-    # check iframe
-    text_iframe = ""
-    if len(text) < 1000:  # probably contains an iframe with additional contents
-        iframe = soup.find('iframe')
-        if iframe:
-            try:
-                iframe_url = iframe['src']
-                driver.get(iframe_url)
-                driver.implicitly_wait(5)
-                iframe_source = driver.page_source
-                soup_iframe = BeautifulSoup(iframe_source, 'html.parser')
-                text_iframe = soup_iframe.get_text()
-            except Exception:
-                print("Error checking iframe for doc with URL:", url)
-    text += text_iframe
-
-    # check pdf
-    if len(text) == 0:
-        text = get_pdf_text(url)
-
-    if len(text) > 15000:
-        text = text[:15000]
-
-    return text
-
-
-def is_policy_page_cot(driver, url=''):
-    """
-        Given a web driver, decides if the current page contains a privacy policy or a beginning of a privacy policy(in
-        case of the privacy policy is too long). It will remove page header and footer to diminish the influence of
-        irrelevant navigational links, which are very common contents of headers and footers.
-        It does not only consider all the plain text of the webpage. If the webpage contains too few content, it checks
-        if this webpage contains iframes and all contents in the iframes will also be considered when deciding.
-        It also checks if the webpage is a pdf document. If so, all contents in that pdf will be considered as well.
-
-        Arguments:
-            driver: a Selenium webdriver
-            url: current URL (for pdf checking)
-        Return:
-            the answer from GenAI describing if the webpage is a privacy policy.
-            Common answers include: Yes, yes, No, no
-    """
-    initial_prompt = config['if_policy_page_prompt_beginning']
-    task_description = config['if_policy_page_prompt_ending']
-
-    # Collecting the text of the website
-    text = collect_page_text(driver, url)
-
-    # Use Chain of Thought technique to decide if the content is a privacy policy
-    complete_prompt = initial_prompt + text + task_description  # first prompt, asking for evidence
-    initial_response = ask_chatgpt(prompt=complete_prompt)
-    cot_prompt = config['if_policy_page_prompt_extract_answer']  # prompt to extract answer
-
-    messages = [
-        {"role": "system",
-         "content": config['initial_prompt']},
-        {"role": "user", "content": complete_prompt},
-        {"role": "system", "content": initial_response},
-        {"role": "user", "content": cot_prompt}
-    ]
-
-    cot_response = ask_chatgpt(messages=messages).replace('.', '')
-    # print(cot_response)
-    return cot_response
-
-
-def is_404_cot(driver, url=''):
-    initial_prompt = config['if_404_prompt_beginning']
-    task_description = config['if_404_prompt_ending']
-
-    # Collecting the text of the website
-    text = collect_page_text(driver, url)
-
-    complete_prompt = initial_prompt + text + task_description  # first prompt, asking for evidence
-    initial_response = ask_chatgpt(prompt=complete_prompt)
-    cot_prompt = config['if_404_prompt_extract_answer']  # prompt to extract answer
-
-    messages = [
-        {"role": "system",
-         "content": config['initial_prompt']},
-        {"role": "user", "content": complete_prompt},
-        {"role": "system", "content": initial_response},
-        {"role": "user", "content": cot_prompt}
-    ]
-
-    cot_response = ask_chatgpt(messages=messages).replace('.', '')
-    return cot_response
-
-def get_pdf_text(url):
-    """
-    Given a URL to a pdf document, return all its text.
-
-    Arguments:
-        url: URL to the pdf document
-    Return:
-        All text in that pdf document
-    """
-    text = ''
-    try:
-        response = urllib.request.urlopen(url)
-        content = response.read()
-        # Then, extract the text from the PDF content
-        with io.BytesIO(content) as data, io.StringIO() as outfp:
-            laparams = pdfminer.layout.LAParams()
-            pdfminer.high_level.extract_text_to_fp(data, outfp, laparams=laparams)
-            text = outfp.getvalue()
-        if os.path.exists(url[url.rfind('/') + 1:]):
-            os.remove(url[url.rfind('/') + 1:])
-    except:
-        pass
-    return text
+import os
+import json
+import openai
+import time
+import random
+import asyncio
+import threading
+import collections
+import re
+from urllib.parse import urljoin
+from page_snapshot import PageSnapshot, reformat, get_link_with_anchor
+from fetcher import as_loader
+from llm_cache import LLMCache, get_llm_cache, make_cache_key
+from pre_classifier import pre_classify, record_llm_calls_avoided
+from tracing import span, current_trace, record_llm_call
+from prompt_builder import compact_anchors, compact_page_text
+from pdf_extract import extract_text, download_pdf, get_snapshot_pdf_text
+from config import config
+
+
+class ChatGPTRateLimiter:
+    """
+    Keeps calls to the ChatGPT API within the account budget: at most max_concurrency calls in flight, at most
+    rpm_limit requests and tpm_limit tokens per rolling minute. It must only be used from the event loop of the
+    ChatGPT client (see _get_client_loop).
+    """
+
+    def __init__(self, max_concurrency, rpm_limit, tpm_limit):
+        self.rpm_limit = rpm_limit
+        self.tpm_limit = tpm_limit
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._window = collections.deque()  # [start time, tokens] of the requests of the last minute
+
+    async def acquire(self, tokens):
+        """
+        Wait until a request of the given (estimated) number of tokens fits in the budget. Return the window entry of
+        the request, whose token count can be corrected once the actual usage is known.
+        """
+        await self._semaphore.acquire()
+        while True:
+            now = time.monotonic()
+            while self._window and self._window[0][0] <= now - 60:
+                self._window.popleft()
+            used_tokens = sum(entry[1] for entry in self._window)
+            # a single request larger than the whole budget is let through when the window is empty
+            if not self._window or (len(self._window) < self.rpm_limit and used_tokens + tokens <= self.tpm_limit):
+                entry = [now, tokens]
+                self._window.append(entry)
+                return entry
+            await asyncio.sleep(self._window[0][0] + 60 - now)
+
+    def release(self):
+        self._semaphore.release()
+
+
+# the ChatGPT client runs on its own event loop in a background thread, so that synchronous callers from any thread
+# and asynchronous callers from any event loop share the same rate limiter
+_client_loop = None
+_client_loop_pid = None
+_client_loop_lock = threading.Lock()
+_rate_limiter = None
+_rate_limit_share = 1  # number of processes the budget in config is split among, see set_rate_limit_share
+
+
+def _get_client_loop():
+    global _client_loop, _client_loop_pid, _rate_limiter
+    with _client_loop_lock:
+        # a forked worker process inherits the loop object but not the thread running it
+        if _client_loop is None or _client_loop_pid != os.getpid():
+            _client_loop = asyncio.new_event_loop()
+            _client_loop_pid = os.getpid()
+            _rate_limiter = None
+            threading.Thread(target=_client_loop.run_forever, name='chatgpt-client', daemon=True).start()
+    return _client_loop
+
+
+def _get_rate_limiter():
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = ChatGPTRateLimiter(config['chatgpt_max_concurrency'],
+                                           max(1, config['chatgpt_rpm_limit'] // _rate_limit_share),
+                                           max(1, config['chatgpt_tpm_limit'] // _rate_limit_share))
+    return _rate_limiter
+
+
+def set_rate_limit_share(processes):
+    """
+    Split the ChatGPT budget in config (chatgpt_rpm_limit and chatgpt_tpm_limit) evenly among processes processes
+    that call the API at the same time, e.g. the worker processes of batch_runner.run_batch. Every one of them has to
+    call it before its first ChatGPT call.
+    """
+    global _rate_limit_share, _rate_limiter
+    _rate_limit_share = max(1, processes)
+    _rate_limiter = None
+
+
+def estimate_tokens(messages):
+    """
+    Rough number of tokens of a list of messages (about 4 characters per token), used for rate limiting.
+    """
+    return sum(len(message['content']) for message in messages) // 4 + 4 * len(messages)
+
+
+def get_retry_delay(error, attempt):
+    """
+    Seconds to wait before retrying a failed ChatGPT API call: the Retry-After header of the response if the API sent
+    one, otherwise exponential backoff with full jitter.
+    """
+    headers = getattr(error, 'headers', None) or {}
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except ValueError:
+        pass  # Retry-After given as an HTTP date, fall back to backoff
+    backoff = min(config['chatgpt_backoff_max'], config['chatgpt_backoff_base'] * 2 ** attempt)
+    return random.uniform(0, backoff)
+
+
+class LLMRequestDeferred(Exception):
+    """
+    Raised instead of calling the ChatGPT API in batch mode (config['llm_batch_dir'] is set) when the answer to a
+    request has not been ingested yet. The request was written to the batch request files, see batch_classify.py.
+    """
+
+
+def make_batch_request(messages):
+    """
+    Return the line of a batch request file (the JSONL input format of the OpenAI Batch API) asking for messages. Its
+    custom_id is the content address of the request, so the same prompt is only asked once per batch.
+    """
+    body = {'model': config['chatgpt_model'], 'temperature': 0, 'messages': messages}
+    return {'custom_id': make_cache_key(config['chatgpt_model'], 'chat_request', messages), 'method': 'POST',
+            'url': '/v1/chat/completions', 'body': body}
+
+
+_batch_answers = None
+_batch_answers_key = None
+_batch_lock = threading.Lock()
+
+
+def get_batch_answers(batch_dir=None):
+    """
+    Return the store of the answers ingested in batch_dir (default config['llm_batch_dir']), an LLMCache without
+    limits keyed by the custom_id of the requests, opened by the current process.
+    """
+    global _batch_answers, _batch_answers_key
+    batch_dir = batch_dir or config['llm_batch_dir']
+    key = (os.getpid(), batch_dir)
+    if _batch_answers is None or _batch_answers_key != key:
+        _batch_answers = LLMCache(os.path.join(batch_dir, 'answers.sqlite3'))
+        _batch_answers_key = key
+    return _batch_answers
+
+
+def _get_batch_answer(messages):
+    # the ingested answer to messages, otherwise the request is written to the request file of this process
+    request = make_batch_request(messages)
+    answer = get_batch_answers().get(request['custom_id'])
+    if answer is not None:
+        return answer['answer']
+    with _batch_lock, open(os.path.join(config['llm_batch_dir'], f'requests-{os.getpid()}.jsonl'), 'a',
+                           encoding='utf-8') as f:
+        f.write(json.dumps(request, ensure_ascii=False) + '\n')
+    raise LLMRequestDeferred(request['custom_id'])
+
+
+async def _ask_chatgpt(prompt, messages, retries, stats=None):
+    # stats (optional): a dict that is filled with the number of attempts and the token usage of the call
+    if messages is None:
+        messages = [
+            {"role": "system",
+             "content": config['initial_prompt']},
+            {"role": "user", "content": prompt},
+        ]
+    if config['llm_batch_dir'] is not None:
+        return _get_batch_answer(messages)
+    limiter = _get_rate_limiter()
+
+    for attempt in range(retries):
+        if stats is not None:
+            stats['attempts'] = attempt + 1
+        window_entry = await limiter.acquire(estimate_tokens(messages))
+        try:
+            response = await openai.ChatCompletion.acreate(
+                model=config['chatgpt_model'],
+                request_timeout=config['chatgpt_api_timeout'],
+                api_base=config['openai_api_base'],
+                temperature=0,
+                messages=messages
+            )
+        except (openai.error.InvalidRequestError, openai.error.AuthenticationError,
+                openai.error.PermissionError) as e:
+            print(e)  # retrying will not help
+            break
+        except Exception as e:
+            print(e)
+            if attempt + 1 < retries:
+                await asyncio.sleep(get_retry_delay(e, attempt))
+            continue
+        finally:
+            limiter.release()
+
+        usage = response.get('usage')
+        if usage:
+            window_entry[1] = usage['total_tokens']
+            if stats is not None:
+                stats['prompt_tokens'] = usage.get('prompt_tokens')
+                stats['completion_tokens'] = usage.get('completion_tokens')
+        return response.choices[0].message.content
+
+    return 'ChatGPT API Error'
+
+
+async def ask_chatgpt_async(prompt='', messages=None, retries=config['chatgpt_api_retries']):
+    """
+    Asynchronous version of ask_chatgpt. Calls made concurrently are bounded by the concurrency, requests-per-minute
+    and tokens-per-minute limits in config, and failed calls are retried with exponential backoff (or after the delay
+    requested by the API when it rate limits us).
+    """
+    future = asyncio.run_coroutine_threadsafe(_ask_chatgpt(prompt, messages, retries), _get_client_loop())
+    return await asyncio.wrap_future(future)
+
+
+def ask_chatgpt(prompt='', messages=None, retries=config['chatgpt_api_retries'], purpose='chatgpt'):
+    """
+    This method passes the given input to ChatGPT API. Input can either be a text prompt or a complete message with
+    history conversation context. If both prompt and messages are provided, argument "prompt" will be ignored.
+
+    Arguments:
+        prompt: text to be passed to ChatGPT API
+        messages: message object to be passed to ChatGPT API
+        retries: maximum number of tries if a call to API fails
+        purpose (optional): what the call is for, recorded in the current trace (see tracing.py)
+    Return:
+        text answer from ChatGPT or "ChatGPT API Error"
+    """
+    if current_trace() is None:
+        future = asyncio.run_coroutine_threadsafe(_ask_chatgpt(prompt, messages, retries), _get_client_loop())
+        return future.result()
+
+    stats = {}
+    start_time = time.perf_counter()
+    with span('llm_call', purpose=purpose):
+        future = asyncio.run_coroutine_threadsafe(_ask_chatgpt(prompt, messages, retries, stats), _get_client_loop())
+        answer = future.result()
+    prompt_chars = sum(len(message['content']) for message in messages) if messages is not None else len(
+        config['initial_prompt'] + prompt)
+    record_llm_call(purpose, prompt_chars, stats.get('prompt_tokens'), stats.get('completion_tokens'),
+                    stats.get('attempts', 0), time.perf_counter() - start_time)
+    return answer
+
+
+def ask_chatgpt_many(inputs, retries=config['chatgpt_api_retries']):
+    """
+    Pass many inputs to ChatGPT API concurrently (within the limits in config) and return the answers in the same
+    order. Every input is either a text prompt or a complete message list, as for ask_chatgpt.
+    """
+    async def ask_all():
+        return await asyncio.gather(*[
+            _ask_chatgpt('', item, retries) if isinstance(item, list) else _ask_chatgpt(item, None, retries)
+            for item in inputs
+        ])
+
+    return asyncio.run_coroutine_threadsafe(ask_all(), _get_client_loop()).result()
+
+
+def get_policy_page_anchor(page_source):
+    """
+    Given a page source from webdriver (driver.page_source), let GenAI to decide which link may lead to a privacy
+    policy page
+
+    Arguments:
+        page_source: a page source from webdriver, or a PageSnapshot of the page
+    Return:
+        the answer from GenAI about which anchor text can lead to a privacy policy.
+        Common answers include: CORRECT ANCHOR TEXT (if there is such link),
+                                text "NONE" (if there is no such link),
+                                some text stating that there is no such anchor text (if there is no such link)
+    """
+    initial_prompt = config['analyze_anchor_text_prompt_beginning']
+    task_description = config['analyze_anchor_text_prompt_ending']
+
+    snapshot = page_source if isinstance(page_source, PageSnapshot) else PageSnapshot(page_source)
+    hrefs, anchor_texts = snapshot.anchors
+    anchor_text_str = '\n'.join(compact_anchors(anchor_texts))
+
+    cache = get_llm_cache()
+    cache_key = make_cache_key(config['chatgpt_model'], [config['initial_prompt'], initial_prompt, task_description],
+                               anchor_text_str)
+    cached = cache.get(cache_key) if cache else None
+    if cached is not None:
+        record_llm_call('anchor', len(anchor_text_str), cached=True)
+        return cached['answer']
+
+    complete_prompt = initial_prompt + anchor_text_str + task_description
+    # print(complete_prompt)
+    answer = ask_chatgpt(prompt=complete_prompt, purpose='anchor')
+    if cache and answer != 'ChatGPT API Error':
+        cache.set(cache_key, {'answer': answer})
+    return answer
+
+
+def get_iframe_text(driver, snapshot):
+    """
+    Return the text of the first iframe of a page (outside of its header and footer), or an empty string if there is
+    none or it cannot be loaded. The iframe is loaded at most once per snapshot, with the given webdriver or PageLoader,
+    and its PageSnapshot is memoized as 'iframe_snapshot'.
+    """
+    def load_iframe_text():
+        if snapshot.iframe_url is None:
+            return ''
+        try:
+            iframe_url = urljoin(snapshot.final_url, snapshot.iframe_url)
+            with span('iframe_load'):
+                iframe_snapshot = as_loader(driver).load(iframe_url)
+            snapshot.memo('iframe_snapshot', lambda: iframe_snapshot)
+            return iframe_snapshot.text
+        except Exception:
+            print("Error checking iframe for doc with URL:", snapshot.url)
+            return ''
+
+    return snapshot.memo('iframe_text', load_iframe_text)
+
+
+def collect_page_text(driver, url='', snapshot=None):
+    """
+    Return the text GenAI classifies a page by: its text without header and footer, plus the text of its first iframe
+    if the page has little text, or the text of the pdf document at url if the page has no text. The result is fitted
+    into config['page_text_token_budget'] tokens, see prompt_builder.compact_page_text.
+
+    Arguments:
+        driver: a Selenium webdriver on the page to collect, or the PageLoader that loaded snapshot
+        url: current URL (for pdf checking)
+        snapshot (optional): a PageSnapshot of the page, if the caller already has one
+    """
+    if snapshot is None:
+        snapshot = PageSnapshot.from_driver(driver, url)
+
+    def collect():
+        with span('collect_page_text'):
+            text = snapshot.content_text
+
+            # check iframe
+            if len(text) < 1000:  # probably contains an iframe with additional contents
+                text += get_iframe_text(driver, snapshot)
+
+            # check pdf
+            if len(text) == 0:
+                text = get_snapshot_pdf_text(snapshot, config['pdf_classification_chars'])
+
+        return compact_page_text(text)
+
+    return snapshot.memo('page_text', collect)
+
+
+def ask_chatgpt_cot(text, prompt_beginning, prompt_ending, extract_answer_prompt, purpose='cot'):
+    """
+    Ask a question about a text with the Chain of Thought technique: a first call asks for evidence, a second call
+    extracts a one-word answer from that evidence. Both answers are stored in the LLM cache (if enabled), so the same
+    question about the same text is only sent to ChatGPT once.
+
+    Arguments:
+        text: the text the question is about, e.g. the text of a webpage
+        prompt_beginning: the prompt before the text. It gives context.
+        prompt_ending: the prompt after the text. It describes the task.
+        extract_answer_prompt: the prompt extracting a one-word answer from the first response
+        purpose (optional): what the question is for, recorded in the current trace (see tracing.py)
+    Return:
+        the one-word answer from GenAI, without periods
+    """
+    cache = get_llm_cache()
+    cache_key = make_cache_key(config['chatgpt_model'],
+                               [config['initial_prompt'], prompt_beginning, prompt_ending, extract_answer_prompt], text)
+    cached = cache.get(cache_key) if cache else None
+    if cached is not None:
+        record_llm_call(purpose, len(text), cached=True)
+        return cached['answer']
+
+    complete_prompt = prompt_beginning + text + prompt_ending  # first prompt, asking for evidence
+    initial_response = ask_chatgpt(prompt=complete_prompt, purpose=purpose + '_evidence')
+
+    messages = [
+        {"role": "system",
+         "content": config['initial_prompt']},
+        {"role": "user", "content": complete_prompt},
+        {"role": "system", "content": initial_response},
+        {"role": "user", "content": extract_answer_prompt}
+    ]
+
+    answer = ask_chatgpt(messages=messages, purpose=purpose + '_answer')
+    if cache and 'ChatGPT API Error' not in (initial_response, answer):
+        cache.set(cache_key, {'evidence': initial_response, 'answer': answer.replace('.', '')})
+    return answer.replace('.', '')
+
+
+def is_policy_page_cot(driver, url='', snapshot=None):
+    """
+        Given a web driver, decides if the current page contains a privacy policy or a beginning of a privacy policy(in
+        case of the privacy policy is too long). It will remove page header and footer to diminish the influence of
+        irrelevant navigational links, which are very common contents of headers and footers.
+        It does not only consider all the plain text of the webpage. If the webpage contains too few content, it checks
+        if this webpage contains iframes and all contents in the iframes will also be considered when deciding.
+        It also checks if the webpage is a pdf document. If so, all contents in that pdf will be considered as well.
+
+        Arguments:
+            driver: a Selenium webdriver
+            url: current URL (for pdf checking)
+            snapshot (optional): a PageSnapshot of the page, if the caller already has one
+        Return:
+            the answer from GenAI describing if the webpage is a privacy policy.
+            Common answers include: Yes, yes, No, no
+    """
+    initial_prompt = config['if_policy_page_prompt_beginning']
+    task_description = config['if_policy_page_prompt_ending']
+
+    # Collecting the text of the website
+    text = collect_page_text(driver, url, snapshot)
+
+    # Use Chain of Thought technique to decide if the content is a privacy policy
+    return ask_chatgpt_cot(text, initial_prompt, task_description, config['if_policy_page_prompt_extract_answer'],
+                           purpose='is_policy')
+
+
+def is_404_cot(driver, url='', snapshot=None):
+    initial_prompt = config['if_404_prompt_beginning']
+    task_description = config['if_404_prompt_ending']
+
+    # Collecting the text of the website
+    text = collect_page_text(driver, url, snapshot)
+
+    return ask_chatgpt_cot(text, initial_prompt, task_description, config['if_404_prompt_extract_answer'],
+                           purpose='is_404')
+
+
+def parse_structured_classification(answer):
+    """
+    Strictly parse the answer to the structured classification prompt: a JSON object (optionally in a markdown code
+    block) with exactly the boolean keys is_privacy_policy, is_404 and links_to_privacy_policy. Raises ValueError for
+    any other answer.
+    """
+    answer = answer.strip()
+    if answer.startswith('```'):
+        answer = re.sub(r'^```(json)?|```$', '', answer).strip()
+    data = json.loads(answer)  # json.JSONDecodeError is a ValueError
+    keys = {'is_privacy_policy', 'is_404', 'links_to_privacy_policy'}
+    if not isinstance(data, dict) or set(data) != keys or not all(isinstance(data[key], bool) for key in keys):
+        raise ValueError(f'Unexpected structured classification: {answer}')
+    return {'is_policy': data['is_privacy_policy'], 'is_404': data['is_404'],
+            'is_link_hub': data['links_to_privacy_policy']}
+
+
+def classify_page_structured(text):
+    """
+    Classify a page text with a single ChatGPT call answered in JSON (see parse_structured_classification). The parsed
+    answer is stored in the LLM cache (if enabled). Raises ValueError if the answer cannot be parsed.
+    """
+    initial_prompt = config['structured_classification_prompt_beginning']
+    task_description = config['structured_classification_prompt_ending']
+
+    cache = get_llm_cache()
+    cache_key = make_cache_key(config['chatgpt_model'], [config['initial_prompt'], initial_prompt, task_description],
+                               text)
+    cached = cache.get(cache_key) if cache else None
+    if cached is not None:
+        record_llm_call('structured', len(text), cached=True)
+        return cached['classification']
+
+    answer = ask_chatgpt(prompt=initial_prompt + text + task_description, purpose='structured')
+    classification = parse_structured_classification(answer)
+    if cache:
+        cache.set(cache_key, {'classification': classification})
+    return classification
+
+
+def classify_page(driver, url='', snapshot=None, check_404=True):
+    """
+    Given a web driver, decides if the current page is a privacy policy, a 404 page, or a page with a link that may lead
+    to the privacy policy (link hub). How this is decided depends on config['classification_mode']:
+        'cot': Chain of Thought questions with is_policy_page_cot, then with is_404_cot if the page is not a policy.
+               Every page that is neither a policy nor a 404 page is treated as a link hub.
+        'structured': a single call answered in JSON. If the answer cannot be parsed, the 'cot' questions are asked.
+    If config['preclassifier_enabled'] is True, the local pre-classifier decides first and ChatGPT is only asked about
+    what it is not confident about.
+    With check_404 False, the 404 question is not asked (and a page the pre-classifier rejects is not sent to ChatGPT
+    at all): a page that is not a policy is treated as a link hub.
+
+    Arguments:
+        driver: a Selenium webdriver
+        url: current URL (for pdf checking)
+        snapshot (optional): a PageSnapshot of the page, if the caller already has one
+        check_404 (optional): False if only is_policy and is_link_hub are needed
+    Return:
+        a dict with the boolean keys is_policy, is_404 and is_link_hub
+    """
+    with span('classify'):
+        return _classify_page(driver, url, snapshot, check_404)
+
+
+def pre_classify_page(driver, url='', snapshot=None):
+    """
+    Return the decision of the local pre-classifier about a page (see pre_classifier.pre_classify), or None if
+    config['preclassifier_enabled'] is False. The decision is made at most once per snapshot, so that a page decided
+    before classify_page is not counted twice in the pre-classifier stats. The arguments are those of classify_page.
+    """
+    if not config['preclassifier_enabled']:
+        return None
+    if snapshot is None:
+        snapshot = PageSnapshot.from_driver(driver, url)
+
+    def decide():
+        text = collect_page_text(driver, url, snapshot)
+        with span('pre_classify'):
+            return pre_classify(text)
+
+    return snapshot.memo('pre_classification', decide)
+
+
+def _classify_page(driver, url, snapshot, check_404):
+    if snapshot is None:
+        snapshot = PageSnapshot.from_driver(driver, url)
+    text = collect_page_text(driver, url, snapshot)
+    structured = config['classification_mode'] == 'structured'
+
+    # skip ChatGPT for pages the local pre-classifier is confident about
+    decision = pre_classify_page(driver, url, snapshot)
+    if decision is True:
+        record_llm_calls_avoided(1 if structured else 2)
+        return {'is_policy': True, 'is_404': False, 'is_link_hub': False}
+    if decision is False and not check_404:
+        record_llm_calls_avoided(1 if structured else 2)
+        return {'is_policy': False, 'is_404': False, 'is_link_hub': True}
+
+    if structured:
+        try:
+            classification = classify_page_structured(text)
+            if decision is False:
+                classification['is_policy'] = False
+            return classification
+        except ValueError as e:
+            print(e)
+            print("Falling back to Chain of Thought classification for URL:", url)
+
+    if decision is None:
+        answer = ask_chatgpt_cot(text, config['if_policy_page_prompt_beginning'],
+                                 config['if_policy_page_prompt_ending'], config['if_policy_page_prompt_extract_answer'],
+                                 purpose='is_policy')
+        if 'Yes' in answer or 'yes' in answer:
+            return {'is_policy': True, 'is_404': False, 'is_link_hub': False}
+        if not check_404:
+            return {'is_policy': False, 'is_404': False, 'is_link_hub': True}
+    elif not structured:
+        record_llm_calls_avoided(2)
+    answer = ask_chatgpt_cot(text, config['if_404_prompt_beginning'], config['if_404_prompt_ending'],
+                             config['if_404_prompt_extract_answer'], purpose='is_404')
+    is_404_page = 'Yes' in answer or 'yes' in answer
+    return {'is_policy': False, 'is_404': is_404_page, 'is_link_hub': not is_404_page}
+
+
+def get_pdf_text(url):
+    """
+    Given a URL to a pdf document, return all its text.
+
+    Arguments:
+        url: URL to the pdf document
+    Return:
+        All text in that pdf document
+    """
+    path = download_pdf(url)
+    if path is None:
+        return ''
+    try:
+        return extract_text(path)[0]
+    finally:
+        os.remove(path)
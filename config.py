@@ -1,32 +1,128 @@
-config = {
-    'openai_api_key': '',
-    'link_csv_path': 'popular_apps.csv',
-    'policy_col_name': 'privacy_policy_url',
-    'app_id_col_name': 'app_id',
-    'chatgpt_model': 'gpt-3.5-turbo-1106',
-    'output_path_policy': 'new_crawler_result',
-    'output_path_nonpolicy': 'new_crawler_result',
-    'headless_driver': False,
-    'chatgpt_api_timeout': 30,
-    'chatgpt_api_retries': 5,
-    'initial_prompt': 'You are a software user and am interested in the privacy policy of a software you are using.',
-    'analyze_anchor_text_prompt_beginning': 'The following contents are anchor texts associated with links on a website:\n',
-    'analyze_anchor_text_prompt_ending': '\nAccording to the previous provided information, I want to navigate to a '
-                                         'website containing a company’s privacy policy, and now I am in a website '
-                                         'that may have a link to my destination. Please decide clicking which link '
-                                         'can take me to the company’s privacy policy page. If there is no possible '
-                                         'link, please output NONE. If there is a possible link, output the anchor '
-                                         'text only. If there are multiple possible links pointing to policies in '
-                                         'different languages, output the anchor text to the English policy only. Do '
-                                         'not use complete sentence when responding.',
-    'if_policy_page_prompt_beginning': 'The following webpage is the content in a webpage:\n',
-    'if_policy_page_prompt_ending': '\nPlease determine if the content of the webpage contains the beginning of a '
-                                    'privacy policy (Terms of uses are not privacy policies). If the webpage offers '
-                                    'links to the privacy policy, return \"No\" directly. This is the top priority. '
-                                    'After considering this, if it is a random webpage or the homepage of the '
-                                    'softawre, return \"No\". If it is a beginning of a privacy policy, '
-                                    'return \"Yes\". List up to 3 supporting evidence and briefly explain. Limit the '
-                                    'explanation of each evidence in 1 sentence. You must stand for either yes or no.',
-    'if_policy_page_prompt_extract_answer': 'In a word (Yes/No), the answer is'
-
-}
+config = {
+    'openai_api_key': '',
+    'link_csv_path': 'popular_apps.csv',
+    'policy_col_name': 'privacy_policy_url',
+    'app_id_col_name': 'app_id',
+    'app_name_col_name': None,
+    'chatgpt_model': 'gpt-3.5-turbo-1106',
+    'output_path_policy': 'new_crawler_result',
+    'output_path_nonpolicy': 'new_crawler_result',
+    'output_store': 'text',
+    'output_store_path': 'crawler_output_store',
+    'output_shard_max_bytes': 256 * 1024 * 1024,
+    'headless_driver': False,
+    'lean_browser': True,
+    'lean_browser_blocked_urls': ['*.png*', '*.jpg*', '*.jpeg*', '*.gif*', '*.webp*', '*.avif*', '*.svg*', '*.ico*',
+                                  '*.woff*', '*.ttf*', '*.otf*', '*.eot*', '*.mp4*', '*.webm*', '*.mp3*', '*.m4a*',
+                                  '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*',
+                                  '*googlesyndication.com*', '*connect.facebook.net*', '*hotjar.com*',
+                                  '*segment.io*', '*segment.com/analytics*', '*mixpanel.com*', '*amplitude.com*',
+                                  '*scorecardresearch.com*', '*quantserve.com*', '*adsrvr.org*', '*criteo.com*',
+                                  '*taboola.com*', '*outbrain.com*'],
+    'fetch_mode': 'tiered',
+    'http_timeout': 20,
+    'http_user_agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 '
+                       'Safari/537.36',
+    'fetch_min_text_length': 200,
+    'parallel_fetch_workers': 8,
+    'appendix_timeout': 15,
+    'link_follow_top_k': 3,
+    'link_follow_depth': 2,
+    'link_min_score': 4,
+    'link_confident_score': 10,
+    'link_match_cutoff': 0.6,
+    'search_backends': ['http', 'browser'],
+    'search_http_url': 'https://html.duckduckgo.com/html/?q={query}',
+    'search_http_result_selector': 'a.result__a',
+    'search_workers': 8,
+    'search_stub_results': {},
+    'search_cache_path': 'search_cache.sqlite3',
+    'search_cache_ttl': 30 * 24 * 3600,
+    'html_parser': 'auto',
+    'pdf_backend': 'auto',
+    'pdf_workers': 1,
+    'pdf_timeout': 60,
+    'pdf_max_pages': 200,
+    'pdf_classification_chars': 20000,
+    'page_ready_timeout': 8,
+    'page_ready_min_timeout': 2,
+    'page_ready_max_timeout': 30,
+    'page_ready_stable_time': 0.3,
+    'page_ready_poll_interval': 0.1,
+    'driver_pool_size': 1,
+    'driver_max_uses': 50,
+    'batch_workers': 4,
+    'domain_min_interval': 1.0,
+    'results_path': 'results.jsonl',
+    'journal_path': None,
+    'dedupe_urls': True,
+    'dedupe_resolve_redirects': True,
+    'tracing_enabled': False,
+    'trace_path': 'traces.jsonl',
+    'incremental_crawl': False,
+    'incremental_state_path': 'crawl_state.sqlite3',
+    'change_report_path': 'policy_changes.csv',
+    'distributed_queue': 'sqlite',
+    'distributed_queue_path': 'work_queue.sqlite3',
+    'distributed_lease_seconds': 600,
+    'distributed_heartbeat_interval': 30,
+    'distributed_max_attempts': 3,
+    'distributed_poll_interval': 2,
+    'chatgpt_api_timeout': 30,
+    'chatgpt_api_retries': 5,
+    'openai_api_base': None,
+    'chatgpt_max_concurrency': 8,
+    'chatgpt_rpm_limit': 3500,
+    'chatgpt_tpm_limit': 90000,
+    'chatgpt_backoff_base': 1,
+    'chatgpt_backoff_max': 60,
+    'llm_cache_path': 'llm_cache.sqlite3',
+    'llm_cache_max_entries': 100000,
+    'llm_cache_ttl': None,
+    'llm_batch_dir': None,
+    'llm_batch_poll_interval': 60,
+    'llm_batch_max_rounds': 8,
+    'page_text_token_budget': 3750,
+    'page_text_beginning_share': 0.4,
+    'anchor_token_budget': 1500,
+    'initial_prompt': 'You are a software user and am interested in the privacy policy of a software you are using.',
+    'analyze_anchor_text_prompt_beginning': 'The following contents are anchor texts associated with links on a website:\n',
+    'analyze_anchor_text_prompt_ending': '\nAccording to the previous provided information, I want to navigate to a '
+                                         'website containing a company’s privacy policy, and now I am in a website '
+                                         'that may have a link to my destination. Please decide clicking which link '
+                                         'can take me to the company’s privacy policy page. If there is no possible '
+                                         'link, please output NONE. If there is a possible link, output the anchor '
+                                         'text only. If there are multiple possible links pointing to policies in '
+                                         'different languages, output the anchor text to the English policy only. Do '
+                                         'not use complete sentence when responding.',
+    'if_policy_page_prompt_beginning': 'The following webpage is the content in a webpage:\n',
+    'if_policy_page_prompt_ending': '\nPlease determine if the content of the webpage contains the beginning of a '
+                                    'privacy policy (Terms of uses are not privacy policies). If the webpage offers '
+                                    'links to the privacy policy, return \"No\" directly. This is the top priority. '
+                                    'After considering this, if it is a random webpage or the homepage of the '
+                                    'softawre, return \"No\". If it is a beginning of a privacy policy, '
+                                    'return \"Yes\". List up to 3 supporting evidence and briefly explain. Limit the '
+                                    'explanation of each evidence in 1 sentence. You must stand for either yes or no.',
+    'if_policy_page_prompt_extract_answer': 'In a word (Yes/No), the answer is',
+    'if_404_prompt_beginning': 'The following webpage is the content in a webpage:\n',
+    'if_404_prompt_ending': '\nPlease determine if the webpage is an error page, e.g. a 404 page saying that the '
+                            'requested page does not exist or has been moved. Briefly explain your reasoning in up to '
+                            '2 sentences. You must stand for either yes or no.',
+    'if_404_prompt_extract_answer': 'In a word (Yes/No), the answer is',
+    'classification_mode': 'cot',
+    'preclassifier_enabled': True,
+    'preclassifier_model_path': 'preclassifier_model.json',
+    'preclassifier_policy_threshold': 0.93,
+    'preclassifier_non_policy_threshold': 0.05,
+    'structured_classification_prompt_beginning': 'The following webpage is the content in a webpage:\n',
+    'structured_classification_prompt_ending': '\nAnswer three questions about this webpage. '
+                                               '"is_privacy_policy": does the content contain the beginning of a '
+                                               'privacy policy? Terms of uses are not privacy policies, and a webpage '
+                                               'that only offers links to the privacy policy is not a privacy policy. '
+                                               '"is_404": is it an error page saying that the requested page does not '
+                                               'exist? "links_to_privacy_policy": does the webpage offer a link that '
+                                               'probably leads to the privacy policy? Respond with a JSON object with '
+                                               'exactly these three keys and true or false as values, and nothing '
+                                               'else.'
+
+}
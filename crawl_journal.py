@@ -0,0 +1,67 @@
+import json
+import time
+import sqlite3
+import threading
+
+
+class CrawlJournal:
+    """
+    Durable record of a batch crawl, stored in a SQLite database, so that a run that dies halfway can be restarted
+    without crawling the finished apps again. Every app has one row with its status:
+        pending: submitted to a worker, but no result was recorded (e.g. the run crashed)
+        done: downloaded and saved
+        failed: an error occurred, the error is recorded
+        deferred: waiting for the answers of a ChatGPT batch (see batch_classify.py)
+    Restarting a run skips the apps that are done and retries the others.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                                 'app_id TEXT PRIMARY KEY, url TEXT, status TEXT, attempts INTEGER DEFAULT 0, '
+                                 'final_url TEXT, is_policy_page INTEGER, classification TEXT, started_at REAL, '
+                                 'finished_at REAL, elapsed_time REAL, error TEXT, output_path TEXT)')
+
+    def is_done(self, app_id):
+        with self._lock:
+            row = self._connection.execute('SELECT status FROM jobs WHERE app_id = ?', (str(app_id),)).fetchone()
+        return row is not None and row[0] == 'done'
+
+    def mark_pending(self, app_id, url):
+        with self._lock, self._connection:
+            self._connection.execute('INSERT INTO jobs (app_id, url, status, attempts, started_at) '
+                                     'VALUES (?, ?, \'pending\', 1, ?) '
+                                     'ON CONFLICT (app_id) DO UPDATE SET url = excluded.url, status = \'pending\', '
+                                     'attempts = attempts + 1, started_at = excluded.started_at',
+                                     (str(app_id), url, time.time()))
+
+    def record_result(self, result):
+        """
+        Record a result of batch_runner.run_batch.
+        """
+        if result.get('deferred'):
+            status = 'deferred'
+        else:
+            status = 'failed' if result['error'] is not None else 'done'
+        is_policy_page = None if result['is_policy_page'] is None else int(result['is_policy_page'])
+        classification = json.dumps(result['classification']) if result.get('classification') else None
+        with self._lock, self._connection:
+            self._connection.execute('UPDATE jobs SET status = ?, final_url = ?, is_policy_page = ?, '
+                                     'classification = ?, finished_at = ?, elapsed_time = ?, error = ?, '
+                                     'output_path = ? WHERE app_id = ?',
+                                     (status, result.get('final_url'), is_policy_page, classification, time.time(),
+                                      result.get('elapsed_time'), result['error'], result.get('output_path'),
+                                      str(result['app_id'])))
+
+    def status_counts(self):
+        """
+        Return a dict with the number of apps per status.
+        """
+        with self._lock:
+            return dict(self._connection.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+
+    def close(self):
+        self._connection.close()
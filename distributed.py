@@ -0,0 +1,445 @@
+"""
+Distributed crawls: a coordinator puts the apps to crawl into a shared work queue, and workers on any number of
+machines take jobs from it and run download_text_save, each with a pool of worker processes like run_batch.
+
+Jobs are leased: a worker that takes a job owns it for config['distributed_lease_seconds'] and extends the lease with
+heartbeats while it runs. If a worker dies, its leases expire and the jobs are given to another worker, up to
+config['distributed_max_attempts'] times. If only a worker process of a node dies, the node gives the jobs of its
+pool back to the queue right away and starts a new pool. Results (with the metrics of run_batch) are reported back
+through the queue, and the per-domain rate limit (config['domain_min_interval']) is kept in the queue as well, so it
+holds across all machines.
+
+Queue backends (config['distributed_queue']):
+    sqlite: SQLiteWorkQueue, a SQLite database at config['distributed_queue_path']. All workers have to reach the
+    file, so it is meant for one machine (or a few on a shared file system) and for testing. Backends for other
+    stores implement the same methods.
+
+Usage:
+    python distributed.py coordinator           # enqueue the apps of config['link_csv_path'] and print the results
+    python distributed.py worker --workers 4    # on every node
+    python distributed.py local --nodes 2       # coordinator and two worker nodes on this machine
+"""
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+import argparse
+import contextlib
+import multiprocessing
+import concurrent.futures
+from urllib.parse import urlparse
+import openai
+from batch_runner import _init_worker, _run_job
+from get_websites import iter_website_list
+from config import config
+
+
+class SQLiteWorkQueue:
+    """
+    Work queue in a SQLite database with the tables
+        jobs: every app with its status (queued, leased, done or failed), attempts and the lease of its worker
+        results: the results of finished jobs, in the order they were reported
+        workers: heartbeat and metrics of every worker
+        domains: the next free request slot of every domain, for the global rate limit
+
+    A queue can be pickled (e.g. to worker processes); every process and thread opens its own connection.
+    """
+
+    def __init__(self, path, lease_seconds=None, max_attempts=None):
+        self.path = path
+        self.lease_seconds = lease_seconds or config['distributed_lease_seconds']
+        self.max_attempts = max_attempts or config['distributed_max_attempts']
+        self._local = threading.local()  # connection and the pid it was opened in, per thread
+        with self._transaction() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                               'app_id TEXT PRIMARY KEY, url TEXT, app_name TEXT, status TEXT, attempts INTEGER, '
+                               'worker_id TEXT, lease_expires REAL, enqueued_at REAL, finished_at REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_expires)')
+            connection.execute('CREATE TABLE IF NOT EXISTS results ('
+                               'seq INTEGER PRIMARY KEY AUTOINCREMENT, app_id TEXT, result TEXT)')
+            connection.execute('CREATE TABLE IF NOT EXISTS workers ('
+                               'worker_id TEXT PRIMARY KEY, started_at REAL, heartbeat_at REAL, jobs_done INTEGER, '
+                               'jobs_failed INTEGER, busy_seconds REAL)')
+            connection.execute('CREATE TABLE IF NOT EXISTS domains (domain TEXT PRIMARY KEY, next_slot REAL)')
+
+    def __getstate__(self):
+        return {'path': self.path, 'lease_seconds': self.lease_seconds, 'max_attempts': self.max_attempts}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state, _local=threading.local())
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # a write transaction, so that reading and updating a row is atomic across processes
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            self._local.connection.execute('PRAGMA journal_mode=WAL')
+            self._local.pid = os.getpid()
+        connection = self._local.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def enqueue(self, app_list):
+        """
+        Add the (url, app_id) or (url, app_id, app_name) tuples of app_list as jobs. Apps that are already queued,
+        leased or done are kept as they are, failed apps are queued again. Return the number of jobs added.
+        """
+        added = 0
+        jobs = iter(app_list)
+        while True:
+            chunk = [(url, str(app_id), rest[0] if rest else '')
+                     for url, app_id, *rest in (job for _, job in zip(range(1000), jobs))]
+            if not chunk:
+                return added
+            now = time.time()
+            with self._transaction() as connection:
+                before = connection.total_changes
+                connection.executemany('INSERT INTO jobs VALUES (?, ?, ?, \'queued\', 0, NULL, NULL, ?, NULL) '
+                                       'ON CONFLICT (app_id) DO UPDATE SET url = excluded.url, status = \'queued\', '
+                                       'attempts = 0, enqueued_at = excluded.enqueued_at WHERE status = \'failed\'',
+                                       [(app_id, url, app_name, now) for url, app_id, app_name in chunk])
+                added += connection.total_changes - before
+
+    def lease(self, worker_id, count=1):
+        """
+        Lease up to count jobs to worker_id: queued jobs in the order they were added, and jobs whose lease expired
+        (their worker is gone). Jobs that expired max_attempts times fail instead. Return a list of (url, app_id,
+        app_name) tuples.
+        """
+        now = time.time()
+        jobs = []
+        with self._transaction() as connection:
+            expired = connection.execute('SELECT app_id, url, app_name, attempts, worker_id FROM jobs '
+                                         'WHERE status = \'leased\' AND lease_expires < ?', (now,)).fetchall()
+            for app_id, url, app_name, attempts, previous_worker in expired:
+                if attempts >= self.max_attempts:
+                    result = {'url': url, 'app_id': app_id, 'is_policy_page': None, 'worker_id': previous_worker,
+                              'error': f'the lease expired {attempts} times, the last worker was {previous_worker}'}
+                    self._finish(connection, app_id, 'failed', result, now)
+                elif len(jobs) < count:
+                    jobs.append((url, app_id, app_name))
+            if len(jobs) < count:
+                jobs += connection.execute('SELECT url, app_id, app_name FROM jobs WHERE status = \'queued\' '
+                                           'ORDER BY rowid LIMIT ?', (count - len(jobs),)).fetchall()
+            connection.executemany('UPDATE jobs SET status = \'leased\', attempts = attempts + 1, worker_id = ?, '
+                                   'lease_expires = ? WHERE app_id = ?',
+                                   [(worker_id, now + self.lease_seconds, app_id) for _, app_id, _ in jobs])
+            self._touch_worker(connection, worker_id, now)
+        return [tuple(job) for job in jobs]
+
+    def heartbeat(self, worker_id, app_ids):
+        """
+        Extend the leases of worker_id on the jobs of app_ids, and record that the worker is alive.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            connection.executemany('UPDATE jobs SET lease_expires = ? WHERE app_id = ? AND worker_id = ? '
+                                   'AND status = \'leased\'',
+                                   [(now + self.lease_seconds, str(app_id), worker_id) for app_id in app_ids])
+            self._touch_worker(connection, worker_id, now)
+
+    def complete(self, worker_id, result):
+        """
+        Report the result of a job (a result of batch_runner._run_job). Return False if worker_id does not hold the
+        lease of the job anymore (it expired and the job was given to another worker); the result is dropped then.
+        """
+        now = time.time()
+        app_id = str(result['app_id'])
+        with self._transaction() as connection:
+            row = connection.execute('SELECT status, worker_id FROM jobs WHERE app_id = ?', (app_id,)).fetchone()
+            if row is None or row[0] != 'leased' or row[1] != worker_id:
+                return False
+            status = 'failed' if result['error'] is not None else 'done'
+            self._finish(connection, app_id, status, {**result, 'worker_id': worker_id}, now)
+            connection.execute('UPDATE workers SET jobs_done = jobs_done + ?, jobs_failed = jobs_failed + ?, '
+                               'busy_seconds = busy_seconds + ? WHERE worker_id = ?',
+                               (int(status == 'done'), int(status == 'failed'), result.get('elapsed_time', 0),
+                                worker_id))
+            self._touch_worker(connection, worker_id, now)
+        return True
+
+    def release(self, worker_id, app_ids, error):
+        """
+        Give the jobs of app_ids leased by worker_id back to the queue, e.g. because the process running them died.
+        Jobs that were leased max_attempts times fail with error instead.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            for app_id in app_ids:
+                row = connection.execute('SELECT url, attempts FROM jobs WHERE app_id = ? AND worker_id = ? '
+                                         'AND status = \'leased\'', (str(app_id), worker_id)).fetchone()
+                if row is None:
+                    continue
+                if row[1] >= self.max_attempts:
+                    result = {'url': row[0], 'app_id': str(app_id), 'is_policy_page': None, 'worker_id': worker_id,
+                              'error': error}
+                    self._finish(connection, str(app_id), 'failed', result, now)
+                else:
+                    connection.execute('UPDATE jobs SET status = \'queued\', worker_id = NULL, lease_expires = NULL '
+                                       'WHERE app_id = ?', (str(app_id),))
+            self._touch_worker(connection, worker_id, now)
+
+    def _finish(self, connection, app_id, status, result, now):
+        connection.execute('UPDATE jobs SET status = ?, lease_expires = NULL, finished_at = ? WHERE app_id = ?',
+                           (status, now, app_id))
+        connection.execute('INSERT INTO results (app_id, result) VALUES (?, ?)',
+                           (app_id, json.dumps(result, default=str)))
+
+    def _touch_worker(self, connection, worker_id, now):
+        connection.execute('INSERT INTO workers VALUES (?, ?, ?, 0, 0, 0) '
+                           'ON CONFLICT (worker_id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at',
+                           (worker_id, now, now))
+
+    def results_since(self, seq):
+        """
+        Return the (seq, result) of the results reported after seq, in the order they were reported.
+        """
+        with self._transaction() as connection:
+            rows = connection.execute('SELECT seq, result FROM results WHERE seq > ? ORDER BY seq',
+                                      (seq,)).fetchall()
+        return [(row_seq, json.loads(result)) for row_seq, result in rows]
+
+    def reserve_domain_slot(self, domain, min_interval):
+        """
+        Reserve the next request slot of domain, min_interval seconds after the previous one, and return its time.
+        """
+        with self._transaction() as connection:
+            now = time.time()
+            row = connection.execute('SELECT next_slot FROM domains WHERE domain = ?', (domain,)).fetchone()
+            slot = max(now, row[0] if row else 0)
+            connection.execute('INSERT OR REPLACE INTO domains VALUES (?, ?)', (domain, slot + min_interval))
+        return slot
+
+    def counts(self):
+        """
+        Return a dict with the number of jobs per status.
+        """
+        with self._transaction() as connection:
+            return dict(connection.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+
+    def is_finished(self):
+        counts = self.counts()
+        return not counts.get('queued') and not counts.get('leased')
+
+    def worker_stats(self):
+        """
+        Return a list of dicts with the metrics of every worker: worker_id, jobs_done, jobs_failed, busy_seconds,
+        seconds since its last heartbeat and jobs per minute since it started.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            rows = connection.execute('SELECT worker_id, started_at, heartbeat_at, jobs_done, jobs_failed, '
+                                      'busy_seconds FROM workers ORDER BY worker_id').fetchall()
+        return [{'worker_id': worker_id, 'jobs_done': done, 'jobs_failed': failed, 'busy_seconds': round(busy, 1),
+                 'heartbeat_age': round(now - heartbeat_at, 1),
+                 'jobs_per_minute': round((done + failed) * 60 / max(heartbeat_at - started_at, 1), 1)}
+                for worker_id, started_at, heartbeat_at, done, failed, busy in rows]
+
+    def close(self):
+        if getattr(self._local, 'pid', None) == os.getpid():
+            self._local.connection.close()
+        self._local = threading.local()
+
+
+QUEUE_BACKENDS = {'sqlite': SQLiteWorkQueue}
+
+
+def get_work_queue():
+    """
+    Return the work queue configured in config['distributed_queue'] and config['distributed_queue_path'].
+    """
+    return QUEUE_BACKENDS[config['distributed_queue']](config['distributed_queue_path'])
+
+
+class QueueDomainRateLimiter:
+    """
+    The politeness limit of batch_runner.DomainRateLimiter, with the slots reserved in the work queue, so that it
+    holds across all workers of all machines.
+    """
+
+    def __init__(self, queue, min_interval):
+        self.queue = queue
+        self.min_interval = min_interval
+
+    def wait(self, url):
+        if self.min_interval <= 0:
+            return
+        slot = self.queue.reserve_domain_slot(urlparse(url).netloc.lower(), self.min_interval)
+        delay = slot - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def default_worker_id():
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+def run_worker(queue, workers=None, worker_id=None, output_path_policy=None, output_path_nonpolicy=None):
+    """
+    Take jobs from queue and run them in a pool of worker processes (each with its own Chrome driver, like
+    run_batch) until the queue has no queued or leased jobs left. The leases of running jobs are extended every
+    config['distributed_heartbeat_interval'] seconds. If a worker process dies, the jobs of the pool are released (see
+    SQLiteWorkQueue.release) and a new pool is started. Return the number of jobs run.
+
+    The batch mode of the ChatGPT API (config['llm_batch_dir'], see batch_classify.py) is not supported: a deferred job
+    would be reported as done without its classification.
+    """
+    if config['llm_batch_dir'] is not None:
+        raise ValueError('run_worker does not support the batch mode, set config[\'llm_batch_dir\'] to None')
+    workers = workers or config['batch_workers']
+    worker_id = worker_id or default_worker_id()
+    output_path_policy = output_path_policy or config['output_path_policy']
+    output_path_nonpolicy = output_path_nonpolicy or config['output_path_nonpolicy']
+    limiter = QueueDomainRateLimiter(queue, config['domain_min_interval'])
+    heartbeat_interval = config['distributed_heartbeat_interval']
+    jobs_run = 0
+
+    def start_pool():
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker,
+            initargs=(limiter, openai.api_key, workers))
+
+    def restart_pool(app_ids):
+        # a worker process died (e.g. killed by the OOM killer) and broke the pool: its jobs go back to the queue
+        # and a new pool is started
+        print(f'A worker process died, releasing {len(app_ids)} jobs and starting a new pool')
+        queue.release(worker_id, app_ids, 'a worker process died while running the job')
+        in_flight.clear()
+        executor.shutdown(wait=False, cancel_futures=True)
+        return start_pool()
+
+    executor = start_pool()
+    in_flight = {}  # future -> app_id
+    last_heartbeat = time.monotonic()
+    try:
+        while True:
+            free = workers - len(in_flight)
+            if free > 0:
+                leased = queue.lease(worker_id, free)
+                for position, (url, app_id, app_name) in enumerate(leased):
+                    try:
+                        future = executor.submit(_run_job, jobs_run, url, app_id, output_path_policy,
+                                                 output_path_nonpolicy, app_name)
+                    except concurrent.futures.process.BrokenProcessPool:
+                        executor = restart_pool(list(in_flight.values()) + [job[1] for job in leased[position:]])
+                        break
+                    in_flight[future] = app_id
+                    jobs_run += 1
+            if not in_flight:
+                if queue.is_finished():
+                    return jobs_run
+                time.sleep(config['distributed_poll_interval'])  # jobs leased by others may come back
+                continue
+
+            done, _ = concurrent.futures.wait(in_flight, timeout=min(heartbeat_interval,
+                                                                     config['distributed_poll_interval']),
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            broken = []
+            for future in done:
+                app_id = in_flight.pop(future)
+                if isinstance(future.exception(), concurrent.futures.process.BrokenProcessPool):
+                    broken.append(app_id)
+                    continue
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {'app_id': app_id, 'url': None, 'is_policy_page': None, 'error': repr(e)}
+                if not queue.complete(worker_id, result):
+                    print(f'Dropped the result of app {app_id}: its lease expired and it was given to another worker')
+            if broken:
+                executor = restart_pool(broken + list(in_flight.values()))
+            if time.monotonic() - last_heartbeat >= heartbeat_interval:
+                queue.heartbeat(worker_id, in_flight.values())
+                last_heartbeat = time.monotonic()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def run_coordinator(app_list, queue, results_path=None, on_result=None):
+    """
+    Enqueue the (url, app_id) tuples of app_list and generate the results the workers report, in the order they
+    finish, until the queue has no queued or leased jobs left. Results of the jobs finished by an earlier run of the
+    same queue are generated as well.
+
+    Arguments:
+        app_list: an iterable of (url, app_id) tuples, e.g. from get_website_list
+        queue: the work queue, e.g. get_work_queue()
+        results_path: if given, every result is appended to this JSONL file
+        on_result: if given, called with every result
+    """
+    queue.enqueue(app_list)
+    results_file = open(results_path, 'a', encoding='utf-8') if results_path else None
+    seq = 0
+    try:
+        while True:
+            finished = queue.is_finished()  # before reading the results, so that no result is missed
+            for seq, result in queue.results_since(seq):
+                if results_file:
+                    results_file.write(json.dumps(result, default=str) + '\n')
+                    results_file.flush()
+                if on_result:
+                    on_result(result)
+                yield result
+            if finished:
+                return
+            time.sleep(config['distributed_poll_interval'])
+    finally:
+        if results_file:
+            results_file.close()
+
+
+def start_local_workers(queue, nodes, workers=None):
+    """
+    Start nodes worker nodes (processes running run_worker) on this machine, as a stand-in for separate machines.
+    Return the processes.
+    """
+    processes = []
+    for node in range(nodes):
+        process = multiprocessing.Process(target=run_worker, args=(queue, workers, f'local-{node}'))
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('role', choices=('coordinator', 'worker', 'local'))
+    parser.add_argument('--workers', type=int, default=config['batch_workers'], help='worker processes per node')
+    parser.add_argument('--worker-id', default=None, help='name of this worker (default: <host name>-<pid>)')
+    parser.add_argument('--nodes', type=int, default=2, help='worker nodes started by the local role')
+    args = parser.parse_args()
+
+    openai.api_key = config['openai_api_key']
+    queue = get_work_queue()
+    if args.role == 'worker':
+        print(f'Jobs run: {run_worker(queue, args.workers, args.worker_id)}')
+        return
+
+    app_list = iter_website_list(csv_file_path=config['link_csv_path'], policy_col_name=config['policy_col_name'],
+                                 appid_col_name=config['app_id_col_name'],
+                                 appname_col_name=config['app_name_col_name'])
+    queue.enqueue(app_list)
+    processes = start_local_workers(queue, args.nodes, args.workers) if args.role == 'local' else []
+    start_time = time.time()
+    for result in run_coordinator([], queue, results_path=config['results_path']):
+        if result['error'] is not None:
+            print(f'Error occurred when processing document {result["app_id"]}: {result["error"]}')
+        else:
+            print(f'Processing app:{result["app_id"]} on {result["worker_id"]}, '
+                  f'{"a policy page" if result["is_policy_page"] else "may NOT be a policy page"}')
+    for process in processes:
+        process.join()
+    print(f'Total time: {time.time() - start_time:.1f} seconds, jobs: {queue.counts()}')
+    for stats in queue.worker_stats():
+        print(f'Worker {stats}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,266 +1,351 @@
-import io
-import os
-import urllib
-from selenium import webdriver
-from bs4 import BeautifulSoup
-from selenium.webdriver.chrome.options import Options
-import re
-import time
-import chromedriver_binary
-import pdfminer.layout
-import pdfminer.high_level
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from chatgpt_utils import is_policy_page_cot, get_policy_page_anchor, get_link_with_anchor, get_pdf_text, is_404_cot
-from config import config
-
-
-def extract_ca_eu(links):
-    """
-    Given a bs4.element.ResultSet object containing links (obtained by calling find_all('a') to some BeautifulSoup
-    object), returns a list of links leading to CA/EU privacy statements using heuristics.
-    """
-    ca_eu_links = []
-    saved_hrefs = []
-    for link in links:
-        href = link.get('href')
-        text = link.get_text()
-        if href and text:
-            if 'http' not in href:  # it's an internal link
-                continue
-            if ("california" in text.lower() or "CA" in text) and (
-                    "notice" in text.lower() or "privacy" in text.lower()) or "CCPA" in text:
-                if href not in saved_hrefs:
-                    ca_eu_links.append(link)
-                    saved_hrefs.append(href)
-            if ("european union" in text.lower() or "EU" in text) and (
-                    "notice" in text.lower() or "privacy" in text.lower()):
-                if href not in saved_hrefs:
-                    ca_eu_links.append(link)
-                    saved_hrefs.append(href)
-
-    return ca_eu_links
-
-
-def reformat(text):
-    # remove zero width spaces, replace multiple whitespaces with one
-    result = text.replace('‍', '\n')
-    result = result.replace(' ', ' ')
-    result = re.sub(r'\n+', '\n', result)
-    result = re.sub(r'[ \t]+', ' ', result)
-    return result
-
-
-def get_all_policy_text(driver, url):
-    """
-    Given a Selenium driver, current URL and a blocklist, retrieve and return all texts on that page. This method also
-    retrieves contents in iframes. If this page has any links to additional information about CA/EU users, they will be
-    collected as well.
-    """
-    page_source = driver.page_source
-    soup = BeautifulSoup(page_source, 'html.parser')
-
-    # remove header and footer if any
-    header = soup.find('header')
-    head = soup.find('head')
-    footer = soup.find('footer')
-    foot = soup.find('foot')
-
-    if header:
-        header.extract()
-    if head:
-        head.extract()
-    if footer:
-        footer.extract()
-    if foot:
-        foot.extract()
-
-    text = reformat(soup.get_text())
-
-    # check if it is a pdf
-    if len(text) == 0:
-        pdf_result = get_pdf_text(url)
-        if pdf_result is not None:
-            text = pdf_result
-
-    # check iframe
-    if len(text) < 1000:  # probably contains an iframe with additional contents
-        iframe = soup.find('iframe')
-        if iframe:
-            try:
-                iframe_url = iframe['src']
-                driver.get(iframe_url)
-                driver.implicitly_wait(5)
-                iframe_source = driver.page_source
-                soup_iframe = BeautifulSoup(iframe_source, 'html.parser')
-                text += soup_iframe.get_text()
-            except Exception:
-                print("Error checking iframe for doc with URL:", url)
-
-    # check CA/EU notice
-    links = soup.find_all('a')
-    ca_eu_text = ""
-    ca_eu_links = extract_ca_eu(links)
-    appendix_num = 0
-    if len(ca_eu_links) > 0:
-        for link in ca_eu_links:
-            href = link.get('href')
-            title = link.get_text()
-            driver.get(href)
-            driver.implicitly_wait(8)
-            additional_src = driver.page_source
-            additional_soup = BeautifulSoup(additional_src, 'html.parser')
-
-            title_str = f'Appendix {appendix_num}: {title}\n'
-            ca_eu_text += title_str
-            ca_eu_text += additional_soup.get_text()
-            appendix_num += 1
-    text += ca_eu_text
-    return text
-
-
-def download_text_save(url, app_id, output_path_policy, output_path_nonpolicy, app_name=''):
-    """
-    Download all information related to privacy in a website. This method may navigate to other websites if the given
-    website does not contain a full privacy policy and have links to additional information.
-
-    Arguments:
-        url: the URL to go to initially
-        app_id: the ID or any name of the app, it will be used when saving the downloaded text
-        output_path_policy: if url is a privacy policy, all retrieved texts will be stored here
-        output_path_nonpolicy: if url is not a privacy policy, all retrieved texts will be stored here
-        app_name (optional): the name of the app that the desired privacy policy is for. It will be used when the provided
-        url does not lead to a privacy policy page.
-    Return:
-        A tuple: (policy_text, is_policy_page)
-        policy_text: the downloaded and saved full text
-        is_policy_page: True if GenAI believes the provided URL leads to a privacy policy page, False otherwise
-    """
-    policy_text, is_policy_page = download_text(url, app_name)
-    doc_name = app_id + ".txt"
-    if is_policy_page:
-        output_path = output_path_policy
-    else:
-        output_path = output_path_nonpolicy
-    output_path = os.path.join(output_path, doc_name)
-    with open(output_path, "w", encoding='utf-8') as f:
-        f.write(policy_text)
-    return policy_text, is_policy_page
-
-
-def download_text(url, app_name=''):
-    """
-    The behavior of this method is almost identical to that of the previous download_text_save method. The only
-    difference is that this method does not write the extracted privacy policy into a text file.
-    Arguments:
-        url: the URL to go to initially
-        app_name (optional): the name of the app that the desired privacy policy is for. It will be used when the provided
-        url does not lead to a privacy policy page.
-    Return:
-        A tuple: (policy_text, is_policy_page)
-        policy_text: the downloaded and saved full text
-        is_policy_page: True if GenAI believes the provided URL leads to a privacy policy page, False otherwise
-    """
-    options = Options()
-    options.add_argument("--enable-javascript")
-    options.add_argument("--lang=en")
-    if config['headless_driver']:
-        options.add_argument("--headless")
-    driver = webdriver.Chrome(options=options)
-    driver.implicitly_wait(8)
-    provided_url = url
-
-    try:
-        driver.get(url)
-        first_page_source = driver.page_source
-        soup_first = BeautifulSoup(first_page_source, 'html.parser')
-        first_text = soup_first.get_text()
-    except Exception:
-        # error in visiting the provided URL, do a search immediately
-        is_policy_page = False
-
-        if app_name == '' or app_name is None:
-            policy_text = 'An error occurred when visiting the provided URL.'
-        else:
-            search_query = app_name + " privacy policy English"
-
-            driver.get('https://www.google.com')
-            search_box = driver.find_element(By.NAME, 'q')
-            search_query = search_query
-            search_box.send_keys(search_query)
-            search_box.send_keys(Keys.RETURN)
-            time.sleep(2)
-            result_url = driver.find_elements(By.CSS_SELECTOR, 'div#search .g a')[0].get_attribute('href')
-
-            # get policy text from the top search result
-            driver.get(str(result_url))
-            policy_text = get_all_policy_text(driver, url)
-
-        driver.close()
-        return policy_text, is_policy_page
-
-    # For non-error cases, check if current site is policy page
-    is_policy_page = is_policy_page_cot(driver, url)
-    if 'Yes' in is_policy_page or 'yes' in is_policy_page:
-        is_policy_page = True
-    else:
-        is_policy_page = False
-
-    if is_policy_page:
-        # record all texts in this page
-        policy_text = get_all_policy_text(driver, url)
-    else:
-        # check if current page is a 404 page. If so, do a google search to find the privacy policy page
-        is_404_page = is_404_cot(driver, url)
-        if 'Yes' in is_404_page or 'yes' in is_404_page:
-            is_404_page = True
-        else:
-            is_404_page = False
-
-        if is_404_page:
-            # for 404 pages, do a google search
-            if app_name == '':
-                policy_text = first_text
-            else:
-                search_query = app_name + " privacy policy English"
-                driver.get('https://www.google.com')
-                search_box = driver.find_element(By.NAME, 'q')
-                search_query = search_query
-                search_box.send_keys(search_query)
-                search_box.send_keys(Keys.RETURN)
-                time.sleep(2)
-                result_url = driver.find_elements(By.CSS_SELECTOR, 'div#search .g a')[0].get_attribute('href')
-
-                # get policy text from the top search result
-                driver.get(str(result_url))
-                policy_text = get_all_policy_text(driver, url)
-
-        else:
-            # for other pages, let GenAI point a link to follow
-            page_source = driver.page_source
-            soup = BeautifulSoup(page_source, 'html.parser')
-            links = soup.find_all('a')
-            hrefs, anchor_texts = get_link_with_anchor(links)
-
-            for i in range(len(anchor_texts)):
-                anchor_texts[i] = anchor_texts[i].strip()
-
-            try:
-                anchor_to_follow = get_policy_page_anchor(page_source)
-                href_to_follow = hrefs[anchor_texts.index(anchor_to_follow)]
-
-                if 'http' in href_to_follow:
-                    driver.get(href_to_follow)
-                    policy_text = get_all_policy_text(driver, href_to_follow)
-                else:
-                    link = driver.find_element(By.XPATH, f"//a[@href='{href_to_follow}']")
-                    link.click()
-                    curr_url = driver.current_url
-                    policy_text = get_all_policy_text(driver, curr_url)
-
-            except Exception:
-                # an expected error occurred when finding the correct link to follow (there is no valid link)
-                policy_text = get_all_policy_text(driver, url)
-
-    driver.close()
-    return policy_text, is_policy_page
+import contextlib
+import hashlib
+from urllib.parse import urljoin, urlsplit, urldefrag
+from selenium.webdriver.common.by import By
+from chatgpt_utils import classify_page, get_policy_page_anchor, get_iframe_text, pre_classify_page, LLMRequestDeferred
+from pdf_extract import get_snapshot_pdf_text
+from page_snapshot import PageSnapshot, reformat
+from fetcher import PageLoader, as_loader
+from driver_pool import new_driver
+from tracing import span
+from page_readiness import wait_for_navigation
+from policy_resolver import get_policy_resolver
+from link_ranker import rank_links, match_anchor
+from incremental import get_crawl_state, find_unchanged, record_pages
+from output_store import get_output_store, read_text, output_exists
+from config import config
+
+
+def extract_ca_eu(links):
+    """
+    Given a bs4.element.ResultSet object containing links (obtained by calling find_all('a') to some BeautifulSoup
+    object), returns a list of links leading to CA/EU privacy statements using heuristics.
+    """
+    ca_eu_links = []
+    saved_hrefs = []
+    for link in links:
+        href = link.get('href')
+        text = link.get_text()
+        if href and text:
+            if 'http' not in href:  # it's an internal link
+                continue
+            if ("california" in text.lower() or "CA" in text) and (
+                    "notice" in text.lower() or "privacy" in text.lower()) or "CCPA" in text:
+                if href not in saved_hrefs:
+                    ca_eu_links.append(link)
+                    saved_hrefs.append(href)
+            if ("european union" in text.lower() or "EU" in text) and (
+                    "notice" in text.lower() or "privacy" in text.lower()):
+                if href not in saved_hrefs:
+                    ca_eu_links.append(link)
+                    saved_hrefs.append(href)
+
+    return ca_eu_links
+
+
+def get_all_policy_text(driver, url, snapshot=None, pages=None):
+    """
+    Given a Selenium driver, current URL and a blocklist, retrieve and return all texts on that page. This method also
+    retrieves contents in iframes. If this page has any links to additional information about CA/EU users, they will be
+    collected as well. If the caller already has a PageSnapshot of the page, it can be passed as snapshot; driver can
+    then also be the PageLoader that loaded it. If pages (a dict) is given, the PageSnapshots of the iframe and the
+    CA/EU notices whose text was collected are added to it by URL.
+    """
+    if snapshot is None:
+        snapshot = PageSnapshot.from_driver(driver, url)
+    loader = as_loader(driver)
+
+    text = snapshot.content_text
+
+    # check if it is a pdf
+    if len(text) == 0:
+        pdf_result = get_snapshot_pdf_text(snapshot)
+        if pdf_result is not None:
+            text = pdf_result
+
+    # CA/EU notices and the iframe (if needed) are loaded concurrently
+    ca_eu_links = extract_ca_eu(snapshot.content_links)
+    urls = [link.get('href') for link in ca_eu_links]
+    load_iframe = len(text) < 1000 and snapshot.iframe_url is not None and not snapshot.is_memoized('iframe_text')
+    if load_iframe:
+        urls.append(urljoin(snapshot.final_url, snapshot.iframe_url))
+    loaded = loader.load_many(urls, ready_timeout=config['appendix_timeout'], timeout=config['appendix_timeout'])
+    if load_iframe:
+        iframe_snapshot = loaded.pop()
+        if iframe_snapshot is None:
+            print("Error checking iframe for doc with URL:", url)
+        if iframe_snapshot is not None:
+            snapshot.memo('iframe_snapshot', lambda: iframe_snapshot)
+        snapshot.memo('iframe_text', lambda: iframe_snapshot.text if iframe_snapshot is not None else '')
+
+    # check iframe
+    if len(text) < 1000:  # probably contains an iframe with additional contents
+        text += get_iframe_text(loader, snapshot)
+        if pages is not None and snapshot.is_memoized('iframe_snapshot'):
+            iframe_snapshot = snapshot.memo('iframe_snapshot', lambda: None)
+            pages[iframe_snapshot.final_url] = iframe_snapshot
+
+    # check CA/EU notice, skipping notices that lead to the same document as an earlier one (or this page)
+    ca_eu_text = ""
+    appendix_num = 0
+    seen_documents = set(get_document_keys(snapshot))
+    for link, additional_snapshot in zip(ca_eu_links, loaded):
+        if additional_snapshot is None:
+            continue
+        document_keys = get_document_keys(additional_snapshot)
+        if seen_documents.intersection(document_keys):
+            continue
+        seen_documents.update(document_keys)
+        if pages is not None:
+            pages[additional_snapshot.final_url] = additional_snapshot
+
+        title = link.get_text()
+        title_str = f'Appendix {appendix_num}: {title}\n'
+        ca_eu_text += title_str
+        ca_eu_text += additional_snapshot.text
+        appendix_num += 1
+    text += ca_eu_text
+    return text
+
+
+def get_document_keys(snapshot):
+    """
+    Return what identifies the document of a snapshot: its final URL (without fragment) and a hash of its text.
+    """
+    return urldefrag(snapshot.final_url)[0], hashlib.sha1(snapshot.text.encode('utf-8')).hexdigest()
+
+
+def download_text_save(url, app_id, output_path_policy, output_path_nonpolicy, app_name='', pool=None, driver=None,
+                       report=None):
+    """
+    Download all information related to privacy in a website. This method may navigate to other websites if the given
+    website does not contain a full privacy policy and have links to additional information.
+
+    Arguments:
+        url: the URL to go to initially
+        app_id: the ID or any name of the app, it will be used when saving the downloaded text
+        output_path_policy: if url is a privacy policy, all retrieved texts will be stored here
+        output_path_nonpolicy: if url is not a privacy policy, all retrieved texts will be stored here
+        (both are not used with config['output_store'] 'sharded', see output_store.get_output_store)
+        app_name (optional): the name of the app that the desired privacy policy is for. It will be used when the provided
+        url does not lead to a privacy policy page.
+        pool (optional): a DriverPool to check a driver out from instead of starting a new Chrome instance
+        driver (optional): a webdriver to use instead of starting a new Chrome instance. It is not closed afterwards.
+        report (optional): a dict that is filled with details about the download, see download_text. output_path is
+        set to the location of the saved text (see output_store), and with config['incremental_crawl'], policy_change
+        to 'new', 'changed' or 'unchanged' (see incremental.CrawlState.compare). An unchanged text is not written
+        again, and an app whose pages did not change since the last crawl is not crawled at all (see
+        incremental.find_unchanged).
+    Return:
+        A tuple: (policy_text, is_policy_page)
+        policy_text: the downloaded and saved full text
+        is_policy_page: True if GenAI believes the provided URL leads to a privacy policy page, False otherwise
+    """
+    state = get_crawl_state()
+    if state is not None:
+        # incremental crawl: an app whose pages did not change keeps its saved text and classification
+        with span('incremental_check'):
+            previous = find_unchanged(state, app_id, url)
+        if previous is not None:
+            state.touch_app(app_id)
+            if report is not None:
+                report.update(tiers=[], final_url=previous['final_url'], classification=previous['classification'],
+                              output_path=previous['output_path'], policy_change='unchanged')
+            return read_text(previous['output_path']), previous['is_policy_page']
+
+    details = report if report is not None else {}
+    policy_text, is_policy_page = download_text(url, app_name, pool=pool, driver=driver, report=details)
+    pages = details.pop('pages', {})
+    output_path = None
+    change = None
+    if state is not None:
+        record_pages(state, pages)
+        change, previous = state.compare(app_id, is_policy_page, policy_text)
+        details['policy_change'] = change
+        if change == 'unchanged' and output_exists(previous['output_path']):
+            output_path = previous['output_path']
+    if output_path is None:
+        store = get_output_store(output_path_policy, output_path_nonpolicy)
+        with span('save'):
+            output_path = store.save(app_id, policy_text, is_policy_page, url=url, final_url=details.get('final_url'))
+    if state is not None:
+        state.record_app(app_id, url, details.get('final_url'), is_policy_page, details.get('classification'),
+                         output_path, list(pages), policy_text, change)
+    details['output_path'] = output_path
+    return policy_text, is_policy_page
+
+
+def download_text(url, app_name='', pool=None, driver=None, report=None):
+    """
+    The behavior of this method is almost identical to that of the previous download_text_save method. The only
+    difference is that this method does not write the extracted privacy policy into a text file.
+    Pages are fetched over plain HTTP first and only loaded in Chrome when needed (see fetcher.PageLoader), so Chrome
+    is only started (or checked out of the pool) if one of the pages needs it.
+    Arguments:
+        url: the URL to go to initially
+        app_name (optional): the name of the app that the desired privacy policy is for. It will be used when the provided
+        url does not lead to a privacy policy page.
+        pool (optional): a DriverPool to check a driver out from instead of starting a new Chrome instance
+        driver (optional): a webdriver to use instead of starting a new Chrome instance. It is not closed afterwards.
+        report (optional): a dict that is filled with details about the download:
+            tiers: a list of (url, tier) tuples telling if each loaded URL was served over 'http' or by the 'browser'
+            final_url: the URL (after redirects) of the page the policy text was taken from, if any
+            classification: the classification of the provided URL (see chatgpt_utils.classify_page), if it was loaded
+            pages: the PageSnapshots of the provided URL, of the page the policy text was taken from and of its iframe
+            and CA/EU notices (see get_all_policy_text), by URL
+    Return:
+        A tuple: (policy_text, is_policy_page)
+        policy_text: the downloaded and saved full text
+        is_policy_page: True if GenAI believes the provided URL leads to a privacy policy page, False otherwise
+    """
+    with contextlib.ExitStack() as stack:
+        def get_driver():
+            if driver is not None:
+                return driver
+            with span('driver_start'):
+                if pool is not None:
+                    return stack.enter_context(pool.checkout())
+                started_driver = new_driver()
+            stack.callback(started_driver.quit)
+            return started_driver
+
+        loader = PageLoader(get_driver)
+        details = report if report is not None else {}
+        try:
+            return _download_text(loader, url, app_name, details)
+        finally:
+            details['tiers'] = loader.tiers
+
+
+def _follow_policy_links(loader, url, snapshot, get_policy_text):
+    """
+    Find the policy among the links of a page that is neither a policy nor a 404 page, and return its text. The links
+    are ranked locally (see link_ranker); GenAI is asked to point the link to follow only if no link scores at least
+    config['link_confident_score'], and its answer is matched to a link fuzzily.
+
+    The config['link_follow_top_k'] best links are loaded in turn, and the text of the first page confirmed as a
+    policy is returned right away. Pages are confirmed by the local pre-classifier if it is confident, otherwise with
+    classify_page. Only the best link of a confident ranking is taken without asking GenAI again. Links of pages that
+    are not policies are ranked and the best of them tried next, up to config['link_follow_depth'] hops from the page.
+    No page is loaded twice. If no page is confirmed as a policy, the text of the best link is returned (or of the page
+    itself if no link could be loaded).
+    """
+    candidates = rank_links(snapshot)
+    trusted_url = candidates[0].url if candidates and candidates[0].score >= config['link_confident_score'] else None
+    if trusted_url is None:
+        hrefs, anchor_texts = snapshot.anchors
+        with span('anchor_analysis'):
+            anchor_to_follow = get_policy_page_anchor(snapshot)
+        index = match_anchor(anchor_to_follow, anchor_texts)
+        if index is not None:
+            href_to_follow = hrefs[index]
+            if urlsplit(urljoin(snapshot.final_url, href_to_follow)).scheme not in ('http', 'https'):
+                # e.g. a javascript: link, it has to be clicked in Chrome
+                if snapshot.tier != 'browser':
+                    loader.load_in_browser(url)
+                link = loader.driver.find_element(By.XPATH, f"//a[@href='{href_to_follow}']")
+                link.click()
+                wait_for_navigation(loader.driver, link)
+                curr_url = loader.driver.current_url
+                return get_policy_text(curr_url, loader.snapshot_from_browser(curr_url))
+            candidates = rank_links(snapshot, preferred_href=href_to_follow)
+
+    visited = {urldefrag(url)[0], urldefrag(snapshot.final_url)[0]}
+    best_page = None
+    level = candidates[:config['link_follow_top_k']]
+    for depth in range(config['link_follow_depth']):
+        next_level = []
+        for candidate in level:
+            if candidate.url in visited:
+                continue
+            visited.add(candidate.url)
+            with span('follow_link', depth=depth + 1):
+                try:
+                    page = loader.load(candidate.url)
+                except Exception:
+                    continue  # e.g. a broken link
+            if best_page is None:
+                best_page = (candidate.url, page)
+            # the decision is memoized on the page, classify_page does not make it again
+            if candidate.url == trusted_url and pre_classify_page(loader, candidate.url, page) is None:
+                return get_policy_text(candidate.url, page)
+            # following the few links of a 404 page is cheaper than asking ChatGPT whether it is one
+            page_classification = classify_page(loader, candidate.url, page, check_404=False)
+            if page_classification['is_policy']:
+                return get_policy_text(candidate.url, page)
+            if page_classification['is_link_hub']:
+                next_level.extend(rank_links(page))
+        next_level.sort(key=lambda candidate: candidate.score, reverse=True)
+        level = [candidate for candidate in next_level if candidate.url not in visited][:config['link_follow_top_k']]
+        if not level:
+            break
+
+    if best_page is not None:
+        return get_policy_text(*best_page)
+    return get_policy_text(url, snapshot)
+
+
+def _download_text(loader, url, app_name, report):
+    provided_url = url
+    report['pages'] = {}
+
+    def get_policy_text(page_url, page_snapshot):
+        report['final_url'] = page_snapshot.final_url
+        if page_snapshot not in report['pages'].values():
+            report['pages'][page_snapshot.final_url] = page_snapshot
+        with span('policy_text'):
+            # the iframe and CA/EU notices are recorded as well, an incremental re-crawl checks them for changes
+            return get_all_policy_text(loader, page_url, page_snapshot, pages=report['pages'])
+
+    try:
+        snapshot = loader.load(url)
+        report['pages'][url] = snapshot
+        first_text = snapshot.text
+    except Exception:
+        # error in visiting the provided URL, do a search immediately
+        is_policy_page = False
+
+        result_url = get_policy_resolver().resolve(app_name, loader) if app_name else None
+        if result_url is None:
+            policy_text = 'An error occurred when visiting the provided URL.'
+        else:
+            # get policy text from the top search result
+            policy_text = get_policy_text(url, loader.load(result_url))
+
+        return policy_text, is_policy_page
+
+    # For non-error cases, check if current site is policy page
+    classification = classify_page(loader, url, snapshot)
+    report['classification'] = classification
+    is_policy_page = classification['is_policy']
+
+    if is_policy_page:
+        # record all texts in this page
+        policy_text = get_policy_text(url, snapshot)
+    else:
+        # check if current page is a 404 page. If so, search for the privacy policy page
+        if classification['is_404']:
+            # for 404 pages, search for the privacy policy (see policy_resolver)
+            result_url = get_policy_resolver().resolve(app_name, loader) if app_name else None
+            if result_url is None:
+                report['final_url'] = snapshot.final_url
+                policy_text = first_text
+            else:
+                # get policy text from the top search result
+                policy_text = get_policy_text(url, loader.load(result_url))
+
+        elif classification['is_link_hub']:
+            # for other pages, follow the links most likely leading to the policy (see _follow_policy_links)
+            try:
+                policy_text = _follow_policy_links(loader, url, snapshot, get_policy_text)
+            except LLMRequestDeferred:
+                raise  # batch mode, the job is run again once the answer is there
+            except Exception:
+                # an expected error occurred when finding the correct link to follow (there is no valid link)
+                policy_text = get_policy_text(url, snapshot)
+
+        else:
+            # GenAI sees no link to the privacy policy on this page, keep its text
+            policy_text = get_policy_text(url, snapshot)
+
+    return policy_text, is_policy_page
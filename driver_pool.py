@@ -0,0 +1,206 @@
+import threading
+import contextlib
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.chrome.options import Options
+import chromedriver_binary
+from config import config
+
+# the lean profile (config['lean_browser']): only the text of pages is scraped, so Chrome does not need extensions,
+# the GPU, background traffic of its own, images or media
+LEAN_ARGUMENTS = ['--disable-extensions', '--disable-gpu', '--disable-background-networking',
+                  '--disable-component-update', '--disable-default-apps', '--disable-sync', '--no-first-run',
+                  '--mute-audio', '--blink-settings=imagesEnabled=false']
+LEAN_PREFS = {'profile.managed_default_content_settings.images': 2,
+              'profile.default_content_setting_values.notifications': 2,
+              'profile.managed_default_content_settings.media_stream': 2}
+
+
+def build_chrome_options():
+    """
+    Build the Chrome options used by every driver of the scraper. With config['lean_browser'], driver.get returns
+    as soon as the document is parsed (page load strategy "eager"), page_readiness waits for the rest.
+    """
+    options = Options()
+    options.add_argument("--enable-javascript")
+    options.add_argument("--lang=en")
+    if config['headless_driver']:
+        options.add_argument("--headless")
+    if config['lean_browser']:
+        for argument in LEAN_ARGUMENTS:
+            options.add_argument(argument)
+        options.add_experimental_option('prefs', LEAN_PREFS)
+        options.page_load_strategy = 'eager'
+    return options
+
+
+def block_resources(driver):
+    """
+    Make the current tab of driver fail every request to a URL matching config['lean_browser_blocked_urls'] (images,
+    fonts, media and trackers) without sending it. The block list belongs to the tab, so it has to be set again for
+    every new tab.
+    """
+    try:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': config['lean_browser_blocked_urls']})
+    except Exception:
+        pass  # the browser does not support the DevTools protocol, images are still blocked by the prefs
+
+
+def new_driver():
+    """
+    Start a new Chrome webdriver configured for scraping. The caller is responsible for calling quit() on it. It has no
+    implicit wait: pages are waited for with page_readiness.
+    """
+    driver = webdriver.Chrome(options=build_chrome_options())
+    if config['lean_browser']:
+        block_resources(driver)
+    return driver
+
+
+def is_driver_healthy(driver):
+    """
+    Return True if the browser behind the given driver still responds to commands.
+    """
+    try:
+        return driver.execute_script('return 1;') == 1
+    except Exception:
+        return False
+
+
+def reset_driver(driver):
+    """
+    Bring a used driver back to a clean state before it is handed to the next job: local/session storage and cookies
+    are cleared, and all open windows are replaced by a single new tab (with the resources of the lean profile
+    blocked). The HTTP cache is kept on purpose, since sharing it between jobs is one of the benefits of reusing a
+    browser.
+    """
+    try:
+        driver.execute_script('window.localStorage.clear(); window.sessionStorage.clear();')
+    except WebDriverException:
+        pass  # pages such as about:blank or PDF viewers have no storage
+    try:
+        driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+    except Exception:
+        driver.delete_all_cookies()  # only clears cookies of the current domain, but better than nothing
+
+    old_handles = driver.window_handles
+    driver.switch_to.new_window('tab')
+    new_handle = driver.current_window_handle
+    for handle in old_handles:
+        driver.switch_to.window(handle)
+        driver.close()
+    driver.switch_to.window(new_handle)
+    if config['lean_browser']:
+        block_resources(driver)
+
+
+class DriverPool:
+    """
+    A pool of long-lived Chrome webdrivers. Starting Chrome is much more expensive than loading a page, so drivers are
+    checked out per job and returned to the pool afterwards instead of being started and closed for every URL.
+
+    Returned drivers are health checked and reset (see reset_driver). A driver is recycled (quit and replaced by a new
+    one on the next checkout) when it has served max_uses jobs, when it does not respond anymore or when it cannot be
+    reset.
+
+    Usage:
+        with DriverPool(size=2) as pool:
+            with pool.checkout() as driver:
+                driver.get(url)
+    """
+
+    def __init__(self, size=None, max_uses=None, driver_factory=new_driver):
+        self.size = size if size is not None else config['driver_pool_size']
+        self.max_uses = max_uses if max_uses is not None else config['driver_max_uses']
+        self.driver_factory = driver_factory
+        self._idle = []
+        self._uses = {}  # driver -> number of jobs served
+        self._created = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout=None):
+        """
+        Take a driver out of the pool, starting a new one if the pool is not full yet. Blocks until a driver is
+        returned if all drivers are in use. Raises TimeoutError if no driver becomes available within timeout seconds.
+        """
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise RuntimeError('The driver pool is closed')
+                if self._idle:
+                    return self._idle.pop()
+                if self._created < self.size:
+                    self._created += 1
+                    break
+                if not self._condition.wait(timeout):
+                    raise TimeoutError('No driver became available in the pool')
+
+        # start the new driver outside of the lock, this takes seconds
+        try:
+            driver = self.driver_factory()
+        except Exception:
+            with self._condition:
+                self._created -= 1
+                self._condition.notify()
+            raise
+        self._uses[driver] = 0
+        return driver
+
+    def release(self, driver):
+        """
+        Give a driver back to the pool. It is reset for the next job, or recycled if it is worn out or crashed.
+        """
+        self._uses[driver] = self._uses.get(driver, 0) + 1
+        keep = not self._closed and self._uses[driver] < self.max_uses and is_driver_healthy(driver)
+        if keep:
+            try:
+                reset_driver(driver)
+            except Exception:
+                keep = False
+
+        if not keep:
+            self._discard(driver)
+        with self._condition:
+            if keep:
+                self._idle.append(driver)
+            else:
+                self._created -= 1
+            self._condition.notify()
+
+    @contextlib.contextmanager
+    def checkout(self, timeout=None):
+        """
+        Context manager version of acquire/release.
+        """
+        driver = self.acquire(timeout)
+        try:
+            yield driver
+        finally:
+            self.release(driver)
+
+    def _discard(self, driver):
+        self._uses.pop(driver, None)
+        try:
+            driver.quit()
+        except Exception:
+            pass  # the browser is already gone
+
+    def close(self):
+        """
+        Quit all idle drivers. Drivers that are still checked out are quit when they are released.
+        """
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+            self._condition.notify_all()
+        for driver in idle:
+            self._discard(driver)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,363 @@
+import os
+import re
+import zlib
+import gzip
+import threading
+import http.client
+import concurrent.futures
+from urllib.parse import urlsplit, urlunsplit, urljoin
+from page_snapshot import PageSnapshot
+from tracing import span
+from page_readiness import wait_until_ready
+from config import config
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+STREAM_CHUNK_SIZE = 64 * 1024
+# everything HttpClient.fetch raises for a page that cannot be fetched, including corrupt gzip/deflate bodies
+FETCH_ERRORS = (OSError, http.client.HTTPException, ValueError, zlib.error, EOFError)
+NOSCRIPT_JS_MARKER = re.compile(r'<noscript[^>]*>[^<]*(enable|turn on|requires?)[^<]*javascript', re.IGNORECASE)
+
+
+class FetchResult:
+    """
+    The response to an HTTP GET request, after following redirects.
+    """
+
+    def __init__(self, url, final_url, status, headers, content):
+        self.url = url
+        self.final_url = final_url
+        self.status = status
+        self.headers = headers  # lower-case header names
+        self.content = content  # decoded from gzip/deflate
+
+    @property
+    def content_type(self):
+        return self.headers.get('content-type', '').split(';')[0].strip().lower()
+
+    @property
+    def is_pdf(self):
+        return self.content_type == 'application/pdf' or self.content.startswith(b'%PDF-')
+
+    @property
+    def text(self):
+        charset = re.search(r'charset=([\w-]+)', self.headers.get('content-type', ''))
+        try:
+            return self.content.decode(charset.group(1) if charset else 'utf-8', errors='replace')
+        except LookupError:
+            return self.content.decode('utf-8', errors='replace')
+
+
+class HttpClient:
+    """
+    A small HTTP client for fetching pages without a browser. Connections are kept alive and reused per host (it is
+    thread-safe, a connection serves one request at a time), responses are decompressed and redirects are followed.
+    """
+
+    def __init__(self, timeout=None, max_redirects=10, max_idle_per_host=4):
+        self.timeout = timeout if timeout is not None else config['http_timeout']
+        self.max_redirects = max_redirects
+        self.max_idle_per_host = max_idle_per_host
+        self._idle = {}  # (scheme, host, port) -> idle connections
+        self._lock = threading.Lock()
+
+    def fetch(self, url, headers=None, timeout=None, method='GET', stream_to=None):
+        """
+        GET url and return a FetchResult. Raises OSError or http.client.HTTPException if the server cannot be reached
+        and ValueError for URLs that are not http(s) or for too many redirects, zlib.error or EOFError for a corrupt
+        compressed body (all in FETCH_ERRORS). timeout overrides the timeout of the client for this request. With
+        method='HEAD', only the headers are requested (e.g. to find where a URL redirects to). If stream_to (a binary file object) is given, the decoded body is written to it in chunks
+        instead of being kept in memory, and the content of the result is empty.
+        """
+        current_url = url
+        for _ in range(self.max_redirects + 1):
+            parts = urlsplit(current_url)
+            if parts.scheme not in ('http', 'https') or not parts.hostname:
+                raise ValueError(f'Cannot fetch {current_url} over HTTP')
+            key = (parts.scheme, parts.hostname, parts.port)
+            path = urlunsplit(('', '', parts.path or '/', parts.query, ''))
+            request_headers = {
+                'User-Agent': config['http_user_agent'],
+                'Accept': 'text/html,application/xhtml+xml,application/pdf;q=0.9,*/*;q=0.8',
+                'Accept-Encoding': 'gzip, deflate',
+                'Accept-Language': 'en',
+            }
+            request_headers.update(headers or {})
+
+            status, response_headers, content = self._request(key, method, path, request_headers,
+                                                              timeout or self.timeout, stream_to)
+            if status in REDIRECT_STATUSES and 'location' in response_headers:
+                current_url = urljoin(current_url, response_headers['location'])
+                continue
+            if stream_to is None:
+                content = _decode(content, response_headers)
+            return FetchResult(url, current_url, status, response_headers, content)
+        raise ValueError(f'Too many redirects for {url}')
+
+    def _request(self, key, method, path, headers, timeout, stream_to=None):
+        connection, reused = self._acquire(key)
+        try:
+            response, content = self._send(connection, method, path, headers, timeout, stream_to)
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            if not reused:
+                raise
+            # the server closed the idle keep-alive connection, try once more on a new one
+            connection = self._new_connection(key)
+            try:
+                response, content = self._send(connection, method, path, headers, timeout, stream_to)
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                raise
+
+        response_headers = {name.lower(): value for name, value in response.getheaders()}
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(key, connection)
+        return response.status, response_headers, content
+
+    @staticmethod
+    def _send(connection, method, path, headers, timeout, stream_to):
+        connection.timeout = timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(timeout)
+        connection.request(method, path, headers=headers)
+        response = connection.getresponse()
+        if stream_to is None or response.status in REDIRECT_STATUSES:
+            return response, response.read()
+
+        stream_to.seek(0)
+        stream_to.truncate()
+        encoding = response.getheader('content-encoding', '').lower()
+        # gzip (31) or zlib (15) header; raw deflate streams without a header are not streamed
+        decompressor = zlib.decompressobj(31 if encoding == 'gzip' else 15) if encoding in ('gzip', 'deflate') \
+            else None
+        while True:
+            chunk = response.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            stream_to.write(decompressor.decompress(chunk) if decompressor else chunk)
+        if decompressor:
+            stream_to.write(decompressor.flush())
+        stream_to.seek(0)
+        return response, b''
+
+    def _new_connection(self, key):
+        scheme, host, port = key
+        connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        return connection_class(host, port, timeout=self.timeout)
+
+    def _acquire(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        return self._new_connection(key), False
+
+    def _release(self, key, connection):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+def _decode(content, headers):
+    encoding = headers.get('content-encoding', '').lower()
+    if encoding == 'gzip':
+        return gzip.decompress(content)
+    if encoding == 'deflate':
+        try:
+            return zlib.decompress(content)
+        except zlib.error:
+            return zlib.decompress(content, -zlib.MAX_WBITS)  # raw deflate stream without zlib header
+    return content
+
+
+_http_client = None
+_http_client_pid = None
+
+
+def get_http_client():
+    """
+    Return the HttpClient shared by the current process.
+    """
+    global _http_client, _http_client_pid
+    if _http_client is None or _http_client_pid != os.getpid():
+        _http_client = HttpClient()
+        _http_client_pid = os.getpid()
+    return _http_client
+
+
+def needs_browser(result, snapshot):
+    """
+    Decide if a page fetched over plain HTTP has to be loaded in Chrome instead: when the server refused to serve it to
+    a non-browser client (403, 429, 5xx), or when it looks rendered by JavaScript (almost no text and no iframe to
+    follow, or a <noscript> message asking to enable JavaScript).
+    """
+    if result.status in (403, 429) or result.status >= 500:
+        return True
+    if result.is_pdf:
+        return False
+    text_length = len(snapshot.content_text.strip())
+    if text_length < config['fetch_min_text_length'] and snapshot.iframe_url is None:
+        return True
+    return text_length < 1000 and NOSCRIPT_JS_MARKER.search(snapshot.page_source) is not None
+
+
+_domain_limiter = None
+
+
+def set_domain_limiter(limiter):
+    """
+    Make the PageLoaders of the current process wait for limiter (an object with a wait(url) method, e.g.
+    batch_runner.DomainRateLimiter) before every page they request, over HTTP or in Chrome. None removes the limit.
+    """
+    global _domain_limiter
+    _domain_limiter = limiter
+
+
+class PageLoader:
+    """
+    Loads the pages of one download_text job and returns them as PageSnapshot objects. With
+    config['fetch_mode'] == 'tiered', every page is first fetched over plain HTTP, and only loaded in Chrome if the
+    HTTP response is unusable (see needs_browser). With 'browser', every page is loaded in Chrome. The Chrome driver
+    is only obtained (from driver_factory) when it is needed for the first time.
+
+    The tier that served each URL ('http' or 'browser') is recorded in self.tiers as (url, tier) tuples, and is also
+    available as snapshot.tier.
+
+    Every request waits for the per-domain politeness limit of limiter (default: the one set with
+    set_domain_limiter), if there is one.
+    """
+
+    def __init__(self, driver_factory, mode=None, http_client=None, limiter=None):
+        self._driver_factory = driver_factory
+        self._driver = None
+        self.mode = mode or config['fetch_mode']
+        self.http_client = http_client or get_http_client()
+        self.limiter = limiter or _domain_limiter
+        self.tiers = []
+
+    @classmethod
+    def for_driver(cls, driver):
+        """
+        A loader that loads every page in the given driver.
+        """
+        return cls(lambda: driver, mode='browser')
+
+    @property
+    def driver(self):
+        if self._driver is None:
+            self._driver = self._driver_factory()
+        return self._driver
+
+    def load(self, url, ready_timeout=None):
+        """
+        Load url and return its PageSnapshot. Raises an exception if the page cannot be loaded in any tier.
+
+        Arguments:
+            url: the URL to load
+            ready_timeout (optional): maximum number of seconds to wait for the page to become ready, if it is loaded
+            in Chrome (default: learned for the domain, see page_readiness.wait_until_ready)
+        """
+        if self.mode == 'tiered':
+            snapshot = self._fetch(url)
+            if snapshot is not None:
+                self.tiers.append((url, 'http'))
+                return snapshot
+        return self.load_in_browser(url, ready_timeout)
+
+    def load_many(self, urls, ready_timeout=None, timeout=None):
+        """
+        Load several pages. In 'tiered' mode they are fetched over HTTP concurrently (at most
+        config['parallel_fetch_workers'] at a time); pages that need Chrome are then loaded one after another, since a
+        driver can only load one page at a time.
+
+        Arguments:
+            urls: the URLs to load
+            ready_timeout (optional): maximum number of seconds to wait for a page loaded in Chrome to become ready
+            timeout (optional): seconds to wait for each HTTP response (default: config['http_timeout'])
+        Return:
+            a list with the PageSnapshot of each URL, in the same order, or None for pages that could not be loaded
+        """
+        snapshots = [None] * len(urls)
+        if self.mode == 'tiered' and urls:
+            with span('http_fetch_many', count=len(urls)), \
+                    concurrent.futures.ThreadPoolExecutor(max_workers=config['parallel_fetch_workers']) as executor:
+                snapshots = list(executor.map(lambda url: self._fetch(url, timeout), urls))
+            self.tiers.extend((url, 'http') for url, snapshot in zip(urls, snapshots) if snapshot is not None)
+
+        for i, url in enumerate(urls):
+            if snapshots[i] is None:
+                try:
+                    snapshots[i] = self.load_in_browser(url, ready_timeout)
+                except Exception:
+                    print("Error loading URL:", url)
+        return snapshots
+
+    def _wait_for_domain(self, url):
+        if self.limiter is not None:
+            with span('domain_wait'):
+                self.limiter.wait(url)
+
+    def _fetch(self, url, timeout=None):
+        # the snapshot of url fetched over HTTP, or None if it has to be loaded in Chrome
+        self._wait_for_domain(url)
+        try:
+            with span('http_fetch'):
+                result = self.http_client.fetch(url, timeout=timeout)
+        except FETCH_ERRORS:
+            return None
+        snapshot = snapshot_from_fetch_result(result)
+        return None if needs_browser(result, snapshot) else snapshot
+
+    def load_in_browser(self, url, ready_timeout=None):
+        driver = self.driver
+        self._wait_for_domain(url)
+        with span('browser_load'):
+            driver.get(url)
+        return self.snapshot_from_browser(url, ready_timeout)
+
+    def snapshot_from_browser(self, url, ready_timeout=None):
+        """
+        Capture the page currently loaded in Chrome (e.g. after clicking a link) once it is ready, or once
+        ready_timeout expired.
+        """
+        wait_until_ready(self.driver, url, timeout=ready_timeout)
+        with span('browser_capture'):
+            snapshot = PageSnapshot.from_driver(self.driver, url)
+        snapshot.tier = 'browser'
+        self.tiers.append((url, 'browser'))
+        return snapshot
+
+
+def as_loader(driver):
+    """
+    Return driver if it is a PageLoader, otherwise a PageLoader using the given webdriver for every page.
+    """
+    return driver if isinstance(driver, PageLoader) else PageLoader.for_driver(driver)
+
+
+def snapshot_from_fetch_result(result):
+    """
+    Build a PageSnapshot from an HTTP response. The content of a pdf document is kept in the snapshot (memo key
+    'pdf_content') so it does not have to be downloaded again.
+    """
+    if result.is_pdf:
+        snapshot = PageSnapshot('', result.url)
+        snapshot.memo('pdf_content', lambda: result.content)
+    else:
+        snapshot = PageSnapshot(result.text, result.url)
+    snapshot.final_url = result.final_url
+    snapshot.headers = result.headers
+    snapshot.tier = 'http'
+    return snapshot
@@ -0,0 +1,297 @@
+import os
+import csv
+import html
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class FixtureServer:
+    """
+    A local web server serving in-memory fixture pages, so that the scraper can be measured without depending on live
+    websites. Pages are registered with add_page() and served on 127.0.0.1 from a background thread.
+
+    Usage:
+        with FixtureServer() as server:
+            server.add_page('/privacy', '<html>...</html>')
+            url = server.url('/privacy')
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.pages = {}  # path -> (status, headers, body)
+        self.bytes_sent = 0
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _FixtureRequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.fixture = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def url(self, path):
+        return self.base_url + path
+
+    def add_page(self, path, body, content_type='text/html; charset=utf-8', status=200, headers=None):
+        """
+        Serve body (str or bytes) at path with the given content type, status code and additional headers. Pages
+        have an ETag (a hash of the body), and conditional requests with a matching If-None-Match get 304 Not Modified.
+        """
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        page_headers = {'Content-Type': content_type, 'ETag': f'"{hashlib.sha1(body).hexdigest()}"'}
+        page_headers.update(headers or {})
+        self.pages[path] = (status, page_headers, body)
+
+    def add_redirect(self, path, location, status=302):
+        self.add_page(path, b'', status=status, headers={'Location': location})
+
+    def record(self, num_bytes):
+        with self._lock:
+            self.request_count += 1
+            self.bytes_sent += num_bytes
+
+    def reset_counters(self):
+        with self._lock:
+            self.request_count = 0
+            self.bytes_sent = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+class _FixtureRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, every response has a Content-Length
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def _respond(self, send_body):
+        fixture = self.server.fixture
+        path = self.path.split('#')[0]
+        page = fixture.pages.get(path) or fixture.pages.get(path.split('?')[0])
+        if page is None:
+            page = (404, {'Content-Type': 'text/html; charset=utf-8'},
+                    b'<html><body><h1>404 Not Found</h1></body></html>')
+        status, headers, body = page
+        if status == 200 and 'ETag' in headers and self.headers.get('If-None-Match') == headers['ETag']:
+            status, body = 304, b''
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+        fixture.record(len(body) if send_body else 0)
+
+    def log_message(self, format, *args):
+        pass  # keep benchmark output readable
+
+
+def text_to_html(text, title=''):
+    """
+    Wrap plain text (e.g. a saved policy from sample_outputs) in a simple HTML page with a header and a footer, which
+    resembles the layout of the pages the scraper visits.
+    """
+    paragraphs = '\n'.join(f'<p>{html.escape(line)}</p>' for line in text.split('\n') if line.strip())
+    return (f'<!DOCTYPE html><html><head><title>{html.escape(title)}</title></head><body>'
+            f'<header><nav><a href="/">Home</a> <a href="/about">About</a></nav></header>'
+            f'<main>{paragraphs}</main>'
+            f'<footer><a href="/terms">Terms of Use</a> <a href="/contact">Contact</a></footer>'
+            f'</body></html>')
+
+
+def add_sample_pages(server, folder, prefix, limit=None):
+    """
+    Serve every text file of a sample_outputs folder as an HTML page at <prefix>/<app_id>. Return the list of paths.
+    """
+    paths = []
+    for file_name in sorted(os.listdir(folder))[:limit]:
+        if not file_name.endswith('.txt'):
+            continue
+        with open(os.path.join(folder, file_name), encoding='utf-8') as f:
+            text = f.read()
+        path = f'{prefix}/{file_name[:-len(".txt")]}'
+        server.add_page(path, text_to_html(text, title=file_name))
+        paths.append(path)
+    return paths
+
+
+def add_heavy_pages(server, folder, prefix, limit=None):
+    """
+    Serve the text files of a sample_outputs folder like add_sample_pages, with the resources of a typical website on
+    every page: images, a web font, a video and a tracker script. The resources are not cacheable and belong to the
+    page, so that every page load transfers them (unless they are blocked). The tracker is served at a path
+    containing www.google-analytics.com, so that the default config['lean_browser_blocked_urls'] match it. Return the
+    list of page paths.
+    """
+    paths = []
+    no_store = {'Cache-Control': 'no-store'}
+    for path in add_sample_pages(server, folder, prefix, limit=limit):
+        assets = f'/assets{path}'
+        for number in range(3):
+            server.add_page(f'{assets}/image-{number}.png', os.urandom(60 * 1024), 'image/png', headers=no_store)
+        server.add_page(f'{assets}/font.woff2', os.urandom(80 * 1024), 'font/woff2', headers=no_store)
+        server.add_page(f'{assets}/video.mp4', os.urandom(200 * 1024), 'video/mp4', headers=no_store)
+        tracker = f'/www.google-analytics.com{path}/analytics.js'
+        server.add_page(tracker, 'var tracked = true;' + ' ' * 30 * 1024, 'application/javascript', headers=no_store)
+        head = (f'<style>@font-face {{font-family: Site; src: url("{assets}/font.woff2")}} '
+                f'body {{font-family: Site}}</style><script src="{tracker}"></script></head><body>')
+        media = ''.join(f'<img src="{assets}/image-{number}.png" alt="">' for number in range(3)) \
+            + f'<video src="{assets}/video.mp4" preload="auto" autoplay muted></video>'
+        body = server.pages[path][2].decode('utf-8').replace('</head><body>', head + media, 1)
+        server.add_page(path, body, headers=no_store)
+        paths.append(path)
+    return paths
+
+
+def make_pdf(text, lines_per_page=50, line_width=90):
+    """
+    Return a minimal pdf document (one Helvetica text object per page) containing text. Characters that are not in
+    Latin-1 are replaced with '?'.
+    """
+    lines = []
+    for paragraph in text.split('\n'):
+        paragraph = paragraph.strip()
+        while len(paragraph) > line_width:
+            cut = paragraph.rfind(' ', 0, line_width)
+            cut = cut if cut > 0 else line_width
+            lines.append(paragraph[:cut])
+            paragraph = paragraph[cut:].strip()
+        if paragraph:
+            lines.append(paragraph)
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+
+    def escape(line):
+        line = line.encode('latin-1', errors='replace').decode('latin-1')
+        return line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+    # objects: 1 catalog, 2 page tree, 3 font, then a page and its content stream for every page
+    page_ids = [4 + 2 * i for i in range(len(pages))]
+    objects = ['<< /Type /Catalog /Pages 2 0 R >>',
+               f'<< /Type /Pages /Kids [{" ".join(f"{page_id} 0 R" for page_id in page_ids)}] /Count {len(pages)} >>',
+               '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>']
+    for page_id, page_lines in zip(page_ids, pages):
+        content = 'BT /F1 10 Tf 40 760 Td 14 TL ' + ' '.join(f'({escape(line)}) Tj T*' for line in page_lines) + ' ET'
+        objects.append(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {page_id + 1} 0 R '
+                       f'/Resources << /Font << /F1 3 0 R >> >> >>')
+        objects.append(f'<< /Length {len(content.encode("latin-1"))} >>\nstream\n{content}\nendstream')
+
+    pdf = b'%PDF-1.4\n'
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += f'{number} 0 obj\n{body}\nendobj\n'.encode('latin-1')
+    xref_offset = len(pdf)
+    pdf += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode('latin-1')
+    pdf += b''.join(f'{offset:010d} 00000 n \n'.encode('latin-1') for offset in offsets)
+    pdf += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n'.encode('latin-1')
+    return pdf
+
+
+FIXTURE_CASES = ('plain', 'redirect', 'iframe', 'pdf', 'ca_eu')
+
+CA_NOTICE_TEXT = ('California Privacy Notice. This notice supplements our privacy policy and applies to residents of '
+                  'California under the California Consumer Privacy Act (CCPA). You have the right to know which '
+                  'personal information we collect, the right to delete it and the right to opt out of its sale. '
+                  'We do not sell personal information. To exercise your rights, contact us.')
+NOT_FOUND_TEXT = ('404 Not Found. Sorry, the page you requested could not be found. It may have been moved or '
+                  'deleted, or the address may be misspelled. Please check the address or go back to the home page '
+                  'and use the navigation menu to find what you are looking for.')
+
+
+def document_marker(app_id):
+    """
+    A sentence placed at the top of the document of an app in the app fixtures, so that a mock LLM can tell which
+    document a prompt contains and a benchmark can check that the text was collected.
+    """
+    return f'Fixture document {app_id}.'
+
+
+def add_app_fixtures(server, csv_path='sample_inputs/popular_apps.csv', sample_folder='sample_outputs', limit=None,
+                     cases=FIXTURE_CASES, extra_cases=True):
+    """
+    Serve the saved document of every app of an annotated input file (e.g. popular_apps.csv) at /apps/<app_id>. The
+    apps are spread over the given cases in turn:
+        plain: the document as an HTML page
+        redirect: /apps/<app_id> redirects to the page
+        iframe: a page with little text embedding the document in an iframe
+        pdf: the document as a pdf file
+        ca_eu: the page links to a California privacy notice on another URL
+    With extra_cases, every fifth policy is also served as two additional apps: a page linking to the policy
+    (<app_id>_hub) and a 404 page (<app_id>_404).
+
+    Return:
+        a list of dicts with the keys app_id, url, case, is_policy (the expected is_policy_page of download_text) and
+        marker (document_marker of the document the downloaded text has to contain, or None)
+    """
+    with open(csv_path, newline='', encoding='utf-8-sig') as f:
+        rows = list(csv.DictReader(f))[:limit]
+
+    apps = []
+    for i, row in enumerate(rows):
+        app_id = row['app_id']
+        for folder in ('saved_policies', 'saved_non_policies'):
+            file_path = os.path.join(sample_folder, folder, f'{app_id}.txt')
+            if os.path.exists(file_path):
+                break
+        else:
+            continue
+        with open(file_path, encoding='utf-8') as f:
+            text = document_marker(app_id) + '\n' + f.read()
+        case = cases[i % len(cases)]
+        path = f'/apps/{app_id}'
+        is_policy = row['annotation_is_policy'] == 'Yes'
+
+        if case == 'redirect':
+            server.add_redirect(path, f'{path}/final', status=301)
+            server.add_page(f'{path}/final', text_to_html(text, title=app_id))
+        elif case == 'iframe':
+            server.add_page(path, f'<html><head><title>{app_id}</title></head><body><h1>Legal</h1>'
+                                  f'<iframe src="{path}/frame"></iframe></body></html>')
+            server.add_page(f'{path}/frame', text_to_html(text, title=app_id))
+        elif case == 'pdf':
+            server.add_page(path, make_pdf(text), content_type='application/pdf')
+        elif case == 'ca_eu':
+            notice_link = f'<p><a href="{server.url(path + "/california")}">California Privacy Notice</a></p>'
+            server.add_page(path, text_to_html(text, title=app_id).replace('</main>', notice_link + '</main>'))
+            server.add_page(f'{path}/california', text_to_html(CA_NOTICE_TEXT, title='California Privacy Notice'))
+        else:
+            server.add_page(path, text_to_html(text, title=app_id))
+        apps.append({'app_id': app_id, 'url': server.url(path), 'case': case, 'is_policy': is_policy,
+                     'marker': document_marker(app_id)})
+
+        if extra_cases and is_policy and i % 5 == 0:
+            hub_text = (f'Welcome to the website of {app_id}. Download the app, read the latest news about it and '
+                        f'contact our support team. We care about your privacy, learn more about it below. '
+                        f'Our team works hard every day to build the best experience for our users.')
+            server.add_page(f'{path}_hub', f'<html><body><main><p>{html.escape(hub_text)}</p>'
+                                           f'<a href="/news">News</a> <a href="/support">Support</a> '
+                                           f'<a href="{path}">Privacy Policy</a></main></body></html>')
+            apps.append({'app_id': f'{app_id}_hub', 'url': server.url(f'{path}_hub'), 'case': 'hub',
+                         'is_policy': False, 'marker': document_marker(app_id)})
+            server.add_page(f'{path}_404', text_to_html(NOT_FOUND_TEXT, title='Page not found'), status=404)
+            apps.append({'app_id': f'{app_id}_404', 'url': server.url(f'{path}_404'), 'case': '404',
+                         'is_policy': False, 'marker': None})
+    return apps
@@ -1,16 +1,84 @@
-import pandas as pd
-
-def get_website_list(csv_file_path, policy_col_name, appid_col_name):
-    """
-    Read the input csv file and convert it to a list for main function
-    Returned list is [(url_1, appid_1), (url_2, appid_2), ...]
-    """
-    df = pd.read_csv(csv_file_path)
-    result_list = []
-
-    for _, row in df.iterrows():
-        url = row[policy_col_name]
-        app_id = row[appid_col_name]
-        result_list.append((url, app_id))
-
-    return result_list
+import csv
+from urllib.parse import urlsplit, urlunsplit
+
+
+def normalize_url(url):
+    """
+    Clean up a URL read from the input file: surrounding whitespace is removed, 'http://' is added to URLs without a
+    scheme (e.g. 'www.example.com/privacy') and the scheme and host are lower-cased. Return None if it is not a valid
+    http(s) URL (e.g. an empty cell).
+    """
+    url = (url or '').strip()
+    if not url:
+        return None
+    if '://' not in url:
+        url = 'http://' + url.lstrip('/')
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return None
+    if parts.scheme.lower() not in ('http', 'https') or not parts.hostname or ' ' in parts.netloc:
+        return None
+    if '.' not in parts.hostname and ':' not in parts.hostname and parts.hostname != 'localhost':
+        return None  # e.g. 'nan' or 'mailto:someone@example'
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, parts.fragment))
+
+
+def iter_website_list(csv_file_path, policy_col_name, appid_col_name, dedupe=False, on_invalid=None,
+                      on_duplicate=None, appname_col_name=None):
+    """
+    Read the input csv file row by row and yield (url, app_id) tuples, so that crawling can start before the whole
+    file is read and memory use does not grow with the size of the file. Only the two columns are kept.
+
+    Arguments:
+        csv_file_path: the input csv file
+        policy_col_name, appid_col_name: the names of the URL and app ID columns
+        appname_col_name (optional): the name of a column with the app names. If given, (url, app_id, app_name)
+        tuples are yielded; the app name is used to search for the policy if the URL fails (see policy_resolver)
+        dedupe (optional): if True, a URL that was already yielded for an earlier app is skipped
+        on_invalid (optional): called with (url, app_id) for every row whose URL is not valid (see normalize_url).
+        These rows are skipped.
+        on_duplicate (optional): called with (url, app_id, first_app_id) for every row skipped by dedupe
+    """
+    seen_urls = {}  # url -> first app_id
+    with open(csv_file_path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        for col_name in (policy_col_name, appid_col_name, appname_col_name):
+            if col_name is not None and col_name not in header:
+                raise ValueError(f'Column {col_name} not found in {csv_file_path}')
+        url_index = header.index(policy_col_name)
+        app_id_index = header.index(appid_col_name)
+        app_name_index = header.index(appname_col_name) if appname_col_name is not None else None
+
+        for row in reader:
+            if len(row) <= max(url_index, app_id_index, app_name_index or 0):
+                continue  # empty or truncated line
+            raw_url, app_id = row[url_index], row[app_id_index].strip()
+            url = normalize_url(raw_url)
+            if url is None:
+                if on_invalid:
+                    on_invalid(raw_url, app_id)
+                continue
+            if dedupe:
+                if url in seen_urls:
+                    if on_duplicate:
+                        on_duplicate(url, app_id, seen_urls[url])
+                    continue
+                seen_urls[url] = app_id
+            if app_name_index is not None:
+                yield url, app_id, row[app_name_index].strip()
+            else:
+                yield url, app_id
+
+
+def get_website_list(csv_file_path, policy_col_name, appid_col_name):
+    """
+    Read the input csv file and convert it to a list for main function
+    Returned list is [(url_1, appid_1), (url_2, appid_2), ...]
+    Rows without a valid URL are skipped. Use iter_website_list to read large files lazily.
+    """
+    def print_invalid(url, app_id):
+        print(f'Skipping app {app_id}: invalid URL {url!r}')
+
+    return list(iter_website_list(csv_file_path, policy_col_name, appid_col_name, on_invalid=print_invalid))
@@ -0,0 +1,219 @@
+"""
+Incremental re-crawls. The HTTP validators (ETag, Last-Modified) and a fingerprint of the normalized text of the pages
+an app's policy came from are stored in a SQLite database. On the next crawl these pages are requested conditionally
+first, and if none of them changed, the app keeps its saved text and classification: no page is loaded in Chrome, no
+ChatGPT call is made and the file is not rewritten.
+"""
+import os
+import csv
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from page_snapshot import reformat
+from fetcher import FETCH_ERRORS, get_http_client, snapshot_from_fetch_result, needs_browser
+from output_store import output_exists
+from config import config
+
+CHANGE_REPORT_FIELDS = ['app_id', 'url', 'change', 'final_url', 'is_policy_page', 'output_path']
+
+
+def text_fingerprint(text):
+    """
+    Return a hash of a text after reformat, so that changes of whitespace only do not count as changes.
+    """
+    return hashlib.sha256(reformat(text).strip().encode('utf-8')).hexdigest()
+
+
+def page_fingerprint(snapshot):
+    """
+    Return the fingerprint of the content of a page (its text without header and footer, or the bytes of a pdf
+    document fetched over HTTP), or None if the page has no content to compare.
+    """
+    def compute():
+        content = snapshot.memo('pdf_content', lambda: None)
+        if content is not None:
+            return hashlib.sha256(content).hexdigest()
+        text = snapshot.content_text
+        return text_fingerprint(text) if text.strip() else None
+
+    return snapshot.memo('fingerprint', compute)
+
+
+class CrawlState:
+    """
+    What the last crawls found, stored in a SQLite database:
+        pages: validators and fingerprint of every page a policy was taken from, by URL
+        apps: URL, final URL, classification, output file, page URLs and text fingerprint of the last crawl of every
+        app
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS pages ('
+                                 'url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, fingerprint TEXT, '
+                                 'checked_at REAL)')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS apps ('
+                                 'app_id TEXT PRIMARY KEY, url TEXT, final_url TEXT, is_policy_page INTEGER, '
+                                 'classification TEXT, output_path TEXT, page_urls TEXT, text_fingerprint TEXT, '
+                                 'changed_at REAL, checked_at REAL)')
+
+    def get_page(self, url):
+        with self._lock:
+            row = self._connection.execute('SELECT etag, last_modified, fingerprint FROM pages WHERE url = ?',
+                                           (url,)).fetchone()
+        return None if row is None else {'etag': row[0], 'last_modified': row[1], 'fingerprint': row[2]}
+
+    def record_page(self, url, etag, last_modified, fingerprint):
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)',
+                                     (url, etag, last_modified, fingerprint, time.time()))
+
+    def get_app(self, app_id):
+        with self._lock:
+            row = self._connection.execute('SELECT url, final_url, is_policy_page, classification, output_path, '
+                                           'page_urls, text_fingerprint FROM apps WHERE app_id = ?',
+                                           (str(app_id),)).fetchone()
+        if row is None:
+            return None
+        return {'url': row[0], 'final_url': row[1], 'is_policy_page': bool(row[2]),
+                'classification': json.loads(row[3]) if row[3] else None, 'output_path': row[4],
+                'page_urls': json.loads(row[5]), 'text_fingerprint': row[6]}
+
+    def compare(self, app_id, is_policy_page, policy_text):
+        """
+        Return how the text of an app changed since its last crawl, 'new', 'changed' or 'unchanged', and the last crawl
+        (see get_app, None for a new app).
+        """
+        previous = self.get_app(app_id)
+        if previous is None:
+            return 'new', None
+        if previous['text_fingerprint'] != text_fingerprint(policy_text) \
+                or previous['is_policy_page'] != bool(is_policy_page):
+            return 'changed', previous
+        return 'unchanged', previous
+
+    def record_app(self, app_id, url, final_url, is_policy_page, classification, output_path, page_urls, policy_text,
+                   change):
+        """
+        Record the crawl of an app, whose text was taken from the pages at page_urls and saved at output_path (a
+        location, see output_store). change is the result of compare.
+        """
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute('INSERT INTO apps VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                                     'ON CONFLICT (app_id) DO UPDATE SET url = excluded.url, '
+                                     'final_url = excluded.final_url, is_policy_page = excluded.is_policy_page, '
+                                     'classification = excluded.classification, output_path = excluded.output_path, '
+                                     'page_urls = excluded.page_urls, text_fingerprint = excluded.text_fingerprint, '
+                                     'changed_at = CASE WHEN ? THEN changed_at ELSE excluded.changed_at END, '
+                                     'checked_at = excluded.checked_at',
+                                     (str(app_id), url, final_url, int(bool(is_policy_page)),
+                                      json.dumps(classification) if classification else None, output_path,
+                                      json.dumps(page_urls), text_fingerprint(policy_text), now, now,
+                                      change == 'unchanged'))
+
+    def touch_app(self, app_id):
+        with self._lock, self._connection:
+            self._connection.execute('UPDATE apps SET checked_at = ? WHERE app_id = ?', (time.time(), str(app_id)))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+_state = None
+_state_pid = None
+
+
+def get_crawl_state():
+    """
+    Return the CrawlState stored at config['incremental_state_path'], or None if config['incremental_crawl'] is
+    False. Every process opens its own connection.
+    """
+    global _state, _state_pid
+    if not config['incremental_crawl']:
+        return None
+    if _state is None or _state_pid != os.getpid():
+        _state = CrawlState(config['incremental_state_path'])
+        _state_pid = os.getpid()
+    return _state
+
+
+def validators_of(snapshot):
+    """
+    Return the (etag, last_modified) of a page fetched over HTTP, or (None, None) for pages loaded in Chrome.
+    """
+    return snapshot.headers.get('etag'), snapshot.headers.get('last-modified')
+
+
+def record_pages(state, snapshots):
+    """
+    Store the validators and fingerprints of the pages (a dict url -> PageSnapshot) the text of an app came from.
+    """
+    for url, snapshot in snapshots.items():
+        state.record_page(url, *validators_of(snapshot), page_fingerprint(snapshot))
+
+
+def is_page_unchanged(state, url, http_client=None):
+    """
+    Request url conditionally with its stored validators and return True if it did not change: the server answered
+    304 Not Modified, or the fingerprint of the page is still the same (its validators are updated then). Pages
+    without a stored fingerprint, that cannot be fetched over HTTP or that need Chrome count as changed.
+    """
+    page = state.get_page(url)
+    if page is None or page['fingerprint'] is None:
+        return False
+    headers = {}
+    if page['etag']:
+        headers['If-None-Match'] = page['etag']
+    if page['last_modified']:
+        headers['If-Modified-Since'] = page['last_modified']
+    http_client = http_client or get_http_client()
+    try:
+        result = http_client.fetch(url, headers=headers)
+    except FETCH_ERRORS:
+        return False
+    if result.status == 304:
+        return True
+    snapshot = snapshot_from_fetch_result(result)
+    if needs_browser(result, snapshot) or page_fingerprint(snapshot) != page['fingerprint']:
+        return False
+    record_pages(state, {url: snapshot})
+    return True
+
+
+def find_unchanged(state, app_id, url, http_client=None):
+    """
+    Return the last crawl of an app (see CrawlState.get_app) if it can be reused: the app still has the same URL,
+    its saved text exists, and none of the pages its text was taken from (including the page at its URL) changed.
+    Otherwise return None.
+    """
+    previous = state.get_app(app_id)
+    if previous is None or previous['url'] != url or url not in previous['page_urls'] \
+            or not output_exists(previous['output_path']):
+        return None
+    if all(is_page_unchanged(state, page_url, http_client) for page_url in previous['page_urls']):
+        return previous
+    return None
+
+
+def write_change_report(results, path):
+    """
+    Write the apps of a run whose policy text is new or changed since the last run (the results of
+    batch_runner.run_batch with policy_change 'new' or 'changed') to a CSV file. Return the number of apps
+    written.
+    """
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=CHANGE_REPORT_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for result in results:
+            if result.get('policy_change') in ('new', 'changed'):
+                writer.writerow({**result, 'change': result['policy_change']})
+                count += 1
+    return count
@@ -0,0 +1,124 @@
+"""
+Local ranking of the links of a page by how likely they lead to its privacy policy, so that download_text can try the
+best links itself and only asks ChatGPT (get_policy_page_anchor) when the ranking is not clear. Links are scored by
+keywords of their anchor text and URL, a preference for English pages and for links within the same site. The answer
+of ChatGPT is matched back to a link fuzzily, since it often does not repeat the anchor text exactly.
+"""
+import re
+import difflib
+from urllib.parse import urljoin, urlsplit, urldefrag
+from config import config
+
+# (keyword, score): the highest score of the keywords found counts
+ANCHOR_KEYWORDS = [('privacy policy', 10), ('privacy notice', 9), ('privacy statement', 9), ('data policy', 7),
+                   ('privacy', 6), ('data protection', 6), ('datenschutz', 5), ('confidentialité', 5),
+                   ('privacidad', 5), ('privacidade', 5), ('riservatezza', 5), ('legal', 2), ('terms', 1)]
+HREF_KEYWORDS = [('privacy-policy', 5), ('privacy_policy', 5), ('privacypolicy', 5), ('privacy', 4),
+                 ('datenschutz', 3), ('data-protection', 3), ('legal', 1), ('policy', 1)]
+# (keyword, penalty): every keyword found in the anchor text or URL counts
+NEGATIVE_KEYWORDS = [('do not sell', 4), ('opt out', 3), ('opt-out', 3), ('cookie', 3), ('choices', 2),
+                     ('settings', 2), ('california', 1), ('children', 1)]
+OTHER_LANGUAGES = ['de', 'fr', 'es', 'it', 'pt', 'nl', 'ru', 'ja', 'zh', 'ko', 'tr', 'pl', 'sv', 'ar']
+MATCHED_ANSWER_BONUS = 20  # the link ChatGPT pointed to is tried first
+
+
+class LinkCandidate:
+    """
+    A link of a page: its absolute URL (without fragment), anchor text and score.
+    """
+
+    def __init__(self, url, anchor_text, score):
+        self.url = url
+        self.anchor_text = anchor_text
+        self.score = score
+
+    def __repr__(self):
+        return f'LinkCandidate({self.url!r}, {self.anchor_text!r}, {self.score})'
+
+
+def _site(url):
+    # the last two labels of the host name of url, e.g. example.com for www.example.com
+    host = urlsplit(url).hostname or ''
+    return host if host.replace('.', '').isdigit() else '.'.join(host.split('.')[-2:])
+
+
+def _language_hint(url):
+    # 1 for URLs of English pages, -2 for pages in another language, 0 if the URL does not tell
+    parts = urlsplit(url)
+    segments = [segment.lower() for segment in parts.path.split('/') if segment]
+    query = parts.query.lower()
+    if any(segment in ('en', 'english') or segment.startswith(('en-', 'en_')) for segment in segments) \
+            or 'lang=en' in query or 'hl=en' in query:
+        return 1
+    if any(segment.split('-')[0].split('_')[0] in OTHER_LANGUAGES and len(segment) <= 5 for segment in segments):
+        return -2
+    return 0
+
+
+def score_link(href, anchor_text, page_url):
+    """
+    Return the score of a link (its href resolved against page_url) with the anchor text anchor_text. Links without
+    any policy keyword score 0 or less.
+    """
+    anchor = ' '.join(anchor_text.lower().split())
+    path = urlsplit(href).path.lower() + '?' + urlsplit(href).query.lower()
+    score = max([weight for keyword, weight in ANCHOR_KEYWORDS if keyword in anchor], default=0)
+    score += max([weight for keyword, weight in HREF_KEYWORDS if keyword in path], default=0)
+    if score <= 0:
+        return 0
+    score -= sum(penalty for keyword, penalty in NEGATIVE_KEYWORDS if keyword in anchor or keyword in path)
+    score += _language_hint(href)
+    if _site(href) == _site(page_url):
+        score += 2
+    return score
+
+
+def match_anchor(answer, anchor_texts):
+    """
+    Return the index in anchor_texts of the anchor text ChatGPT answered with, or None if it does not match any. The
+    answer (or a part of it in quotes) matches an anchor text that is equal to it, that contains it or is contained in
+    it (ignoring case), or that is similar to it (difflib ratio of at least config['link_match_cutoff']).
+    """
+    unquoted = answer.strip().strip('"\'').strip()
+    if not unquoted or unquoted.upper().startswith('NONE'):
+        return None
+    normalized = [' '.join(text.lower().split()) for text in anchor_texts]
+    for part in re.findall(r'"([^"]+)"', answer) + [unquoted]:
+        index = _match_normalized(' '.join(part.lower().split()), normalized)
+        if index is not None:
+            return index
+    return None
+
+
+def _match_normalized(answer, normalized):
+    if answer in normalized:
+        return normalized.index(answer)
+    # e.g. an answer cut short, or an answer quoting the anchor text in a sentence. The longest anchor text wins
+    contained = [i for i, text in enumerate(normalized)
+                 if (len(answer) >= 4 and answer in text) or (len(text) >= 8 and text in answer)]
+    if contained:
+        return max(contained, key=lambda i: len(normalized[i]))
+    matches = difflib.get_close_matches(answer, normalized, n=1, cutoff=config['link_match_cutoff'])
+    return normalized.index(matches[0]) if matches else None
+
+
+def rank_links(snapshot, preferred_href=None):
+    """
+    Return the links of a page (a PageSnapshot) that may lead to its privacy policy, best first, as LinkCandidates
+    with a score of at least config['link_min_score']. Links to the page itself, other fragments of it and links
+    that cannot be loaded (javascript:, mailto:, ...) are left out, and every URL is listed once. The link with
+    preferred_href (e.g. the one ChatGPT pointed to) is ranked first.
+    """
+    page_url = urldefrag(snapshot.final_url)[0]
+    hrefs, anchor_texts = snapshot.anchors
+    candidates = {}
+    for href, anchor_text in zip(hrefs, anchor_texts):
+        url = urldefrag(urljoin(snapshot.final_url, href.strip()))[0]
+        if urlsplit(url).scheme not in ('http', 'https') or url == page_url:
+            continue
+        score = score_link(url, anchor_text, page_url)
+        if preferred_href is not None and href == preferred_href:
+            score += MATCHED_ANSWER_BONUS
+        if score >= config['link_min_score'] and (url not in candidates or candidates[url].score < score):
+            candidates[url] = LinkCandidate(url, anchor_text.strip(), score)
+    return sorted(candidates.values(), key=lambda candidate: candidate.score, reverse=True)
@@ -0,0 +1,104 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from config import config
+
+
+def make_cache_key(model, prompt_template, text):
+    """
+    Content address of an LLM answer: hash of the model, the prompt template (any JSON-serializable value, usually the
+    list of fixed prompt parts) and the page text inserted into the template.
+    """
+    payload = json.dumps([model, prompt_template, text], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    """
+    Persistent cache of LLM answers stored in a SQLite database, so that pages which did not change since the last
+    crawl are not sent to the model again. Values are JSON-serializable objects.
+
+    The cache holds at most max_entries entries; the least recently used ones are evicted first. Entries older than
+    ttl seconds (if ttl is not None) are treated as missing. Hit, miss and eviction counters are stored in the database
+    as well, so they add up across the worker processes of a batch.
+    """
+
+    def __init__(self, path, max_entries=None, ttl=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS entries '
+                                 '(key TEXT PRIMARY KEY, value TEXT, created_at REAL, accessed_at REAL)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)')
+
+    def get(self, key):
+        """
+        Return the cached value of key, or None if it is not cached or expired.
+        """
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute('SELECT value, created_at FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is not None and self.ttl is not None and row[1] < now - self.ttl:
+                self._connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+                row = None
+            if row is None:
+                self._increment('misses')
+                return None
+            self._connection.execute('UPDATE entries SET accessed_at = ? WHERE key = ?', (now, key))
+            self._increment('hits')
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                                     (key, json.dumps(value, ensure_ascii=False), now, now))
+            if self.max_entries is not None:
+                count = self._connection.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+                if count > self.max_entries:
+                    self._connection.execute('DELETE FROM entries WHERE key IN '
+                                             '(SELECT key FROM entries ORDER BY accessed_at LIMIT ?)',
+                                             (count - self.max_entries,))
+                    self._increment('evictions', count - self.max_entries)
+
+    def _increment(self, name, amount=1):
+        self._connection.execute('INSERT INTO counters VALUES (?, ?) '
+                                 'ON CONFLICT (name) DO UPDATE SET value = value + excluded.value', (name, amount))
+
+    def stats(self):
+        """
+        Return a dict with the number of entries and the hits, misses and evictions since the cache was created.
+        """
+        with self._lock:
+            result = {'hits': 0, 'misses': 0, 'evictions': 0}
+            result.update(self._connection.execute('SELECT name, value FROM counters').fetchall())
+            result['entries'] = self._connection.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        return result
+
+    def close(self):
+        self._connection.close()
+
+
+_cache = None
+_cache_pid = None
+
+
+def get_llm_cache():
+    """
+    Return the LLM cache configured in config, or None if caching is disabled (config['llm_cache_path'] is None).
+    Every process opens its own connection.
+    """
+    global _cache, _cache_pid
+    if config['llm_cache_path'] is None:
+        return None
+    if _cache is None or _cache_pid != os.getpid():
+        _cache = LLMCache(config['llm_cache_path'], config['llm_cache_max_entries'], config['llm_cache_ttl'])
+        _cache_pid = os.getpid()
+    return _cache
@@ -1,37 +1,79 @@
-import time
-from config import config
-from get_websites import get_website_list
-from download_text_genai import download_text
-import openai
-
-policy_col_name = config['policy_col_name']
-appid_col_name = config['app_id_col_name']
-csv_path = config['link_csv_path']
-openai.api_key = config['openai_api_key']
-
-start_time = time.time()
-results = []
-app_list = get_website_list(csv_file_path=csv_path, policy_col_name=policy_col_name, appid_col_name=appid_col_name)
-print(f'Using the following opanai api key: {config["openai_api_key"]}')
-
-for app in app_list:
-    policy_url = app[0]
-    app_id = app[1]
-    output_path_policy = config['output_path_policy']
-    output_path_nonpolicy = config['output_path_nonpolicy']
-
-    try:
-        result = download_text(policy_url, app_id, output_path_policy, output_path_nonpolicy)
-        if result:
-            print(f'Processing app:{app_id}, its url {policy_url} is a policy page')
-        else:
-            print(f'Processing app:{app_id}, its url {policy_url} may NOT be a policy page')
-        results.append(result)
-    except Exception as e:
-        print("Error occurred when processing document", app_id)
-        print("The error is: ", e)
-
-end_time = time.time()
-elapsed_time = end_time - start_time
-print(f'Total time:{elapsed_time} seconds')
-print(results)
+import json
+import time
+from config import config
+from get_websites import iter_website_list
+from batch_runner import run_batch
+from crawl_journal import CrawlJournal
+from url_dedup import UrlDeduplicator
+from llm_cache import get_llm_cache
+from incremental import write_change_report
+import tracing
+import openai
+
+
+def print_result(result):
+    if result['error'] is not None:
+        print("Error occurred when processing document", result['app_id'])
+        print("The error is: ", result['error'])
+    elif result['is_policy_page']:
+        print(f'Processing app:{result["app_id"]}, its url {result["url"]} is a policy page')
+    else:
+        print(f'Processing app:{result["app_id"]}, its url {result["url"]} may NOT be a policy page')
+
+
+if __name__ == '__main__':
+    policy_col_name = config['policy_col_name']
+    appid_col_name = config['app_id_col_name']
+    csv_path = config['link_csv_path']
+    openai.api_key = config['openai_api_key']
+
+    start_time = time.time()
+    # the CSV file is read lazily while the first apps are crawled
+    app_list = iter_website_list(csv_file_path=csv_path, policy_col_name=policy_col_name,
+                                 appid_col_name=appid_col_name, appname_col_name=config['app_name_col_name'],
+                                 on_invalid=lambda url, app_id: print(f'Skipping app {app_id}: invalid URL {url!r}'))
+    print(f'Using the following opanai api key: {config["openai_api_key"]}')
+
+    # results are printed and written to config['results_path'] as soon as they finish. With config['journal_path'],
+    # apps finished by an earlier, interrupted run with the same journal are skipped
+    journal = CrawlJournal(config['journal_path']) if config['journal_path'] else None
+    # with config['dedupe_urls'], apps whose URLs lead to the same page share one crawl
+    deduplicator = UrlDeduplicator() if config['dedupe_urls'] else None
+    batch = deduplicator.run_batch if deduplicator else run_batch
+    # with config['tracing_enabled'], the trace of every app is written to config['trace_path']
+    trace_file = open(config['trace_path'], 'a', encoding='utf-8') if config['tracing_enabled'] else None
+    trace_records = []
+
+    def on_result(result):
+        print_result(result)
+        if trace_file and result.get('trace'):
+            tracing.write_record(trace_file, result['trace'])
+            trace_records.append(result['trace'])
+
+    batch_results = list(batch(app_list, workers=config['batch_workers'], results_path=config['results_path'],
+                               on_result=on_result, journal=journal))
+    results = [result['is_policy_page'] for result in batch_results]
+
+    end_time = time.time()
+    elapsed_time = end_time - start_time
+    print(f'Total time:{elapsed_time} seconds')
+    print(results)
+    print(f'ChatGPT calls avoided by the local pre-classifier: '
+          f'{sum(result.get("llm_calls_avoided", 0) for result in batch_results)}')
+    print(f'Prompt tokens saved by compaction: '
+          f'{sum(result.get("prompt_tokens_saved", 0) for result in batch_results)}')
+    if config['incremental_crawl']:
+        # apps whose policy text is new or changed since the last run
+        changed = write_change_report(batch_results, config['change_report_path'])
+        print(f'Policies new or changed since the last run: {changed} (see {config["change_report_path"]}), '
+              f'unchanged: {sum(result.get("policy_change") == "unchanged" for result in batch_results)}')
+    if deduplicator:
+        print(f'URL deduplication: {deduplicator.stats()}')
+    if journal:
+        print(f'Crawl journal: {journal.status_counts()}')
+        journal.close()
+    if trace_file:
+        trace_file.close()
+        print(f'Trace summary: {json.dumps(tracing.summarize(trace_records), indent=2)}')
+    if get_llm_cache():
+        print(f'LLM cache: {get_llm_cache().stats()}')
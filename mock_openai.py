@@ -0,0 +1,117 @@
+"""
+A local HTTP server that stands in for the OpenAI chat completions endpoint, so that the ChatGPT client can be
+exercised without network access or API cost. Point the client to it with config['openai_api_base'] = server.api_base.
+"""
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+def echo_responder(messages):
+    """
+    Default responder: answer "Yes" to every request.
+    """
+    return 'Yes'
+
+
+class MockOpenAIServer:
+    """
+    Serves POST /v1/chat/completions on 127.0.0.1 from a background thread.
+
+    Arguments:
+        responder: function receiving the list of messages of a request and returning the answer text
+        latency: seconds to wait before answering each request
+        rate_limit_first: number of initial requests answered with HTTP 429 and a Retry-After header
+        retry_after: value of the Retry-After header of those 429 responses
+    """
+
+    def __init__(self, responder=echo_responder, latency=0.0, rate_limit_first=0, retry_after='0.1'):
+        self.responder = responder
+        self.latency = latency
+        self.rate_limit_first = rate_limit_first
+        self.retry_after = retry_after
+        self.request_count = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = []  # messages of every request, in arrival order
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), _MockOpenAIRequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.mock = self
+        self._thread = None
+
+    @property
+    def api_base(self):
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+class _MockOpenAIRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        mock = self.server.mock
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': f'Unknown path {self.path}', 'type': 'invalid_request_error'}})
+            return
+
+        with mock._lock:
+            mock.request_count += 1
+            request_number = mock.request_count
+            mock.requests.append(body.get('messages', []))
+            mock.in_flight += 1
+            mock.max_in_flight = max(mock.max_in_flight, mock.in_flight)
+        try:
+            if request_number <= mock.rate_limit_first:
+                self._send_json(429, {'error': {'message': 'Rate limit reached', 'type': 'requests'}},
+                                headers={'Retry-After': mock.retry_after})
+                return
+
+            time.sleep(mock.latency)
+            messages = body.get('messages', [])
+            answer = mock.responder(messages)
+            prompt_tokens = sum(len(message.get('content', '')) for message in messages) // 4
+            completion_tokens = len(answer) // 4 + 1
+            self._send_json(200, {
+                'id': f'chatcmpl-mock-{request_number}',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': body.get('model', ''),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': answer},
+                             'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                          'total_tokens': prompt_tokens + completion_tokens},
+            })
+        finally:
+            with mock._lock:
+                mock.in_flight -= 1
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
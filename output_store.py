@@ -0,0 +1,262 @@
+"""
+Where download_text_save saves the downloaded texts. The default TextFileStore writes one <app_id>.txt file per app
+into the policy or non-policy folder. ShardedStore appends the texts with their metadata to a few large compressed
+shard files instead, with a SQLite index from app_id to the position of its record, so that hundreds of thousands of
+apps do not become hundreds of thousands of small files.
+
+Every saved text has a location: the path of its text file, or '<shard path>#<offset>' in a ShardedStore.
+read_text(), output_exists() and link_output() work with both kinds of locations.
+"""
+import os
+import re
+import gzip
+import json
+import time
+import shutil
+import socket
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from config import config
+
+SHARD_LOCATION = re.compile(r'(.*\.jsonl\.gz)#(\d+)')
+
+
+def link_or_copy(source, destination):
+    """
+    Make destination a hard link to source, or a copy of it if hard links are not possible (e.g. across file systems).
+    """
+    if os.path.abspath(source) == os.path.abspath(destination):
+        return
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+def _read_record(f, offset, app_id=None):
+    # the record at offset of an open shard. It is a gzip member of its own, the rest of the shard is not read
+    f.seek(offset)
+    with gzip.GzipFile(fileobj=f) as member:
+        record = json.loads(member.readline())
+    if app_id is not None:
+        record['app_id'] = app_id  # an app linked to the record of another app
+    return record
+
+
+class TextFileStore:
+    """
+    Saves every text to <app_id>.txt in output_path_policy or output_path_nonpolicy.
+    """
+
+    def __init__(self, output_path_policy, output_path_nonpolicy):
+        self.output_path_policy = output_path_policy
+        self.output_path_nonpolicy = output_path_nonpolicy
+
+    def save(self, app_id, text, is_policy_page, url=None, final_url=None):
+        """
+        Save the text of an app and return its location.
+        """
+        output_path = self.output_path_policy if is_policy_page else self.output_path_nonpolicy
+        output_path = os.path.join(output_path, f'{app_id}.txt')
+        # written to a new file that replaces the old one, so that apps hard-linked to it (see link_output) keep
+        # their text
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(output_path) or '.', prefix=f'.{app_id}-', suffix='.txt')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.chmod(temp_path, 0o644)  # mkstemp creates the file readable by its owner only
+            os.replace(temp_path, output_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        return output_path
+
+
+class ShardedStore:
+    """
+    Append-only store of texts in gzip-compressed JSONL shards in the folder path, with an index (index.sqlite3) from
+    app_id to the shard and offset of its latest record. Every record is a separate gzip member, so it can be read on
+    its own, and holds app_id, url, final_url, is_policy_page, fetched_at, sha256 (of the text) and text.
+
+    Each process appends to its own shard (shard-<host>-<pid>-<n>.jsonl.gz, a new one after shard_max_bytes), so the
+    worker processes of a batch can write concurrently. Saving an app again appends a new record and points the index
+    to it. The index is a SQLite database in WAL mode, which is not safe on network file systems (NFS, SMB): the
+    folder must be on a local disk, so machines crawling together (see distributed.py) each use their own folder.
+
+    Usage:
+        store = ShardedStore('crawler_output')
+        location = store.save(app_id, text, is_policy_page, url=url)
+        record = store.get(app_id)
+        for record in store.iter_records(is_policy_page=True):
+            ...
+    """
+
+    def __init__(self, path, shard_max_bytes=None):
+        self.path = path
+        self.shard_max_bytes = shard_max_bytes or config['output_shard_max_bytes']
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._shard = None
+        self._shard_number = 0
+        self._connection = sqlite3.connect(os.path.join(path, 'index.sqlite3'), timeout=30, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS records ('
+                                 'app_id TEXT PRIMARY KEY, shard TEXT, offset INTEGER, length INTEGER, url TEXT, '
+                                 'final_url TEXT, is_policy_page INTEGER, fetched_at REAL, sha256 TEXT)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS records_position ON records (shard, offset)')
+
+    def _open_shard(self):
+        # the shard of this process, a new one when it is full
+        if self._shard is not None and self._shard.tell() >= self.shard_max_bytes:
+            self._shard.close()
+            self._shard = None
+            self._shard_number += 1
+        if self._shard is None:
+            name = f'shard-{socket.gethostname()}-{os.getpid()}-{self._shard_number:04d}.jsonl.gz'
+            self._shard = open(os.path.join(self.path, name), 'ab')
+        return self._shard
+
+    def save(self, app_id, text, is_policy_page, url=None, final_url=None):
+        """
+        Append the text of an app with its metadata and return its location.
+        """
+        record = {'app_id': str(app_id), 'url': url, 'final_url': final_url, 'is_policy_page': bool(is_policy_page),
+                  'fetched_at': time.time(), 'sha256': hashlib.sha256(text.encode('utf-8')).hexdigest(),
+                  'text': text}
+        data = gzip.compress((json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8'))
+        with self._lock:
+            shard = self._open_shard()
+            offset = shard.tell()
+            shard.write(data)
+            shard.flush()
+            shard_name = os.path.basename(shard.name)
+            with self._connection:
+                self._connection.execute('INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                         (record['app_id'], shard_name, offset, len(data), url, final_url,
+                                          int(record['is_policy_page']), record['fetched_at'], record['sha256']))
+        return f'{os.path.join(self.path, shard_name)}#{offset}'
+
+    def link(self, source_app_id, app_id):
+        """
+        Point the index entry of app_id to the record of source_app_id (e.g. an app that shares its policy with
+        another app), without storing the text again. Return the location, or None if source_app_id is not stored.
+        """
+        with self._lock, self._connection:
+            row = self._connection.execute('SELECT shard, offset FROM records WHERE app_id = ?',
+                                           (str(source_app_id),)).fetchone()
+            if row is None:
+                return None
+            self._connection.execute('INSERT OR REPLACE INTO records SELECT ?, shard, offset, length, url, final_url, '
+                                     'is_policy_page, fetched_at, sha256 FROM records WHERE app_id = ?',
+                                     (str(app_id), str(source_app_id)))
+        return f'{os.path.join(self.path, row[0])}#{row[1]}'
+
+    def get(self, app_id):
+        """
+        Return the latest record of an app (a dict with its metadata and text), or None if it is not stored.
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT shard, offset FROM records WHERE app_id = ?',
+                                           (str(app_id),)).fetchone()
+        if row is None:
+            return None
+        with open(os.path.join(self.path, row[0]), 'rb') as f:
+            return _read_record(f, row[1], str(app_id))
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+
+    def iter_records(self, is_policy_page=None):
+        """
+        Generate the latest record of every stored app (only policies or non-policies if is_policy_page is True or
+        False), shard by shard in the order of their offsets, with one shard open at a time.
+        """
+        query = 'SELECT app_id, shard, offset FROM records'
+        parameters = ()
+        if is_policy_page is not None:
+            query += ' WHERE is_policy_page = ?'
+            parameters = (int(is_policy_page),)
+        # a connection of its own, so the index is streamed as well and saving is not blocked meanwhile
+        connection = sqlite3.connect(os.path.join(self.path, 'index.sqlite3'), timeout=30)
+        f, shard = None, None
+        try:
+            for app_id, row_shard, offset in connection.execute(query + ' ORDER BY shard, offset', parameters):
+                if row_shard != shard:
+                    if f is not None:
+                        f.close()
+                    shard = row_shard
+                    f = open(os.path.join(self.path, shard), 'rb')
+                yield _read_record(f, offset, app_id)
+        finally:
+            if f is not None:
+                f.close()
+            connection.close()
+
+    def close(self):
+        with self._lock:
+            if self._shard is not None:
+                self._shard.close()
+                self._shard = None
+            self._connection.close()
+
+
+_stores = {}  # (pid, path) -> ShardedStore
+_stores_lock = threading.Lock()
+
+
+def get_sharded_store(path):
+    """
+    Return the ShardedStore in the folder path opened by the current process.
+    """
+    key = (os.getpid(), os.path.abspath(path))
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = ShardedStore(path)
+        return _stores[key]
+
+
+def get_output_store(output_path_policy, output_path_nonpolicy):
+    """
+    Return the store configured in config['output_store']: a TextFileStore writing to the given folders ('text'), or
+    the ShardedStore in config['output_store_path'] ('sharded').
+    """
+    if config['output_store'] == 'sharded':
+        return get_sharded_store(config['output_store_path'])
+    return TextFileStore(output_path_policy, output_path_nonpolicy)
+
+
+def read_text(location):
+    """
+    Return the text saved at a location.
+    """
+    match = SHARD_LOCATION.fullmatch(location)
+    if match is None:
+        with open(location, encoding='utf-8') as f:
+            return f.read()
+    shard_path, offset = match.groups()
+    with open(shard_path, 'rb') as f:
+        return _read_record(f, int(offset))['text']
+
+
+def output_exists(location):
+    match = SHARD_LOCATION.fullmatch(location or '')
+    return os.path.exists(match.group(1) if match else location or '')
+
+
+def link_output(location, source_app_id, app_id):
+    """
+    Make the text saved at location (for source_app_id) the text of app_id as well: a hard link (or copy) named
+    <app_id>.txt next to a text file, or an index entry pointing to the same record in a ShardedStore. Return the
+    location of the text of app_id.
+    """
+    match = SHARD_LOCATION.fullmatch(location)
+    if match is None:
+        destination = os.path.join(os.path.dirname(location), f'{app_id}.txt')
+        link_or_copy(location, destination)
+        return destination
+    return get_sharded_store(os.path.dirname(match.group(1))).link(source_app_id, app_id)
@@ -0,0 +1,136 @@
+"""
+Waiting for pages loaded in Chrome to be ready, based on what the page does instead of fixed delays: a page is ready
+when its document has loaded and its text has stopped changing for config['page_ready_stable_time'] seconds (and,
+optionally, when an element is present). Resources that keep loading afterwards (trackers, ads, polling) do not
+delay it. How long to wait at most is
+learned per domain from the pages loaded before (see DomainTimeouts), so static pages come back as soon as they are
+stable and slow domains get more time.
+"""
+import time
+import threading
+from urllib.parse import urlsplit
+from selenium.common.exceptions import WebDriverException, TimeoutException
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions
+from tracing import span
+from config import config
+
+# document state and text length of the page, in one round trip
+PAGE_STATE_SCRIPT = "return [document.readyState, document.body ? document.body.innerText.length : 0];"
+
+
+class DomainTimeouts:
+    """
+    Readiness timeouts per domain, learned from the time the last pages of the domain took to become ready: twice the
+    longest of the last history_size durations, between minimum and maximum seconds. Domains without history get
+    default seconds. Only pages that became ready are recorded: a page that never becomes stable (e.g. with live
+    text) would otherwise raise the timeout of every later page of its domain.
+    """
+
+    def __init__(self, default=None, minimum=None, maximum=None, history_size=20):
+        self.default = default if default is not None else config['page_ready_timeout']
+        self.minimum = minimum if minimum is not None else config['page_ready_min_timeout']
+        self.maximum = maximum if maximum is not None else config['page_ready_max_timeout']
+        self.history_size = history_size
+        self._history = {}  # domain -> durations of the last pages
+        self._lock = threading.Lock()
+
+    def timeout(self, url):
+        with self._lock:
+            durations = self._history.get(_domain(url))
+            if not durations:
+                return self.default
+            return min(self.maximum, max(self.minimum, 2 * max(durations)))
+
+    def record(self, url, duration):
+        with self._lock:
+            durations = self._history.setdefault(_domain(url), [])
+            durations.append(duration)
+            del durations[:-self.history_size]
+
+
+def _domain(url):
+    return urlsplit(url or '').netloc.lower()
+
+
+_domain_timeouts = None
+
+
+def get_domain_timeouts():
+    """
+    Return the DomainTimeouts shared by the current process.
+    """
+    global _domain_timeouts
+    if _domain_timeouts is None:
+        _domain_timeouts = DomainTimeouts()
+    return _domain_timeouts
+
+
+def wait_until_ready(driver, url=None, timeout=None, selector=None):
+    """
+    Wait until the page loaded in driver is ready (see the module docstring).
+
+    Arguments:
+        driver: a Selenium webdriver
+        url (optional): the URL of the page, whose domain the timeout is learned for (default: driver.current_url)
+        timeout (optional): maximum number of seconds to wait (default: learned for the domain). A learned timeout
+        longer than this is not used.
+        selector (optional): a CSS selector of an element that has to be present as well
+    Return:
+        True if the page became ready, False if the timeout expired first
+    """
+    url = url or driver.current_url
+    domain_timeouts = get_domain_timeouts()
+    learned_timeout = domain_timeouts.timeout(url)
+    timeout = min(timeout, learned_timeout) if timeout is not None else learned_timeout
+    stable_time = config['page_ready_stable_time']
+    poll_interval = config['page_ready_poll_interval']
+
+    with span('page_ready'):
+        start = time.monotonic()
+        last_state = None
+        stable_since = start
+        while True:
+            now = time.monotonic()
+            try:
+                state = tuple(driver.execute_script(PAGE_STATE_SCRIPT))
+                if selector and not driver.execute_script('return document.querySelector(arguments[0]) !== null;',
+                                                          selector):
+                    state = None  # not ready before the element is present
+            except WebDriverException:
+                state = None  # e.g. a pdf viewer or a page that is being replaced
+            if state != last_state:
+                last_state = state
+                stable_since = now
+            elif state is not None and state[0] == 'complete' and now - stable_since >= stable_time:
+                domain_timeouts.record(url, now - start)
+                return True
+            if now - start >= timeout:
+                return False
+            time.sleep(poll_interval)
+
+
+def wait_for_element(driver, by, value, timeout=None):
+    """
+    Return the first element matching (by, value) as soon as it is present, waiting at most timeout seconds (default:
+    the learned timeout of the current domain). Raises selenium's TimeoutException if it does not appear.
+    """
+    timeout = timeout if timeout is not None else get_domain_timeouts().timeout(driver.current_url)
+    with span('wait_for_element'):
+        return WebDriverWait(driver, timeout, poll_frequency=config['page_ready_poll_interval']).until(
+            expected_conditions.presence_of_element_located((by, value)))
+
+
+def wait_for_navigation(driver, element, timeout=None):
+    """
+    After clicking element, wait until the page it was on has been replaced (the element is detached), so that
+    wait_until_ready does not see the old page as ready. Return False if the page did not change within timeout
+    seconds (default: the learned timeout of the current domain), e.g. for a link handled by JavaScript.
+    """
+    timeout = timeout if timeout is not None else get_domain_timeouts().timeout(driver.current_url)
+    try:
+        WebDriverWait(driver, timeout, poll_frequency=config['page_ready_poll_interval']).until(
+            expected_conditions.staleness_of(element))
+        return True
+    except TimeoutException:
+        return False
@@ -0,0 +1,141 @@
+import re
+from bs4 import BeautifulSoup
+from tracing import span
+from config import config
+
+
+def reformat(text):
+    # remove zero width spaces, replace multiple whitespaces with one
+    result = text.replace('‍', '\n')
+    result = result.replace(' ', ' ')
+    result = re.sub(r'\n+', '\n', result)
+    result = re.sub(r'[ \t]+', ' ', result)
+    return result
+
+
+def get_link_with_anchor(links):
+    """
+    Given a bs4.element.ResultSet object containing links (obtained by calling find_all('a') to some BeautifulSoup
+    object), returns two lists: a list of links, and a list of anchor texts associated with the corresponding link.
+    """
+    links_list = []
+    anchor_texts_list = []
+    for link in links:
+        href = link.get('href')
+        text = link.get_text()
+        if href and text:
+            links_list.append(href)
+            anchor_texts_list.append(text.replace('\n', '').replace('\t', ''))
+    return links_list, anchor_texts_list
+
+
+def get_html_parser():
+    """
+    Return the BeautifulSoup parser backend to use: config['html_parser'], where 'auto' means lxml if it is installed
+    (it is several times faster on large pages) and Python's html.parser otherwise.
+    """
+    if config['html_parser'] != 'auto':
+        return config['html_parser']
+    try:
+        import lxml
+        return 'lxml'
+    except ImportError:
+        return 'html.parser'
+
+
+class PageSnapshot:
+    """
+    The source of a page, captured once, and everything the scraper derives from it. The source is parsed only once
+    and every derived value is computed lazily on first use, so the policy check, the 404 check, the anchor analysis and
+    the text collection of the same page do not parse it again.
+
+    Derived values:
+        text: all text of the page
+        links: all <a> elements of the page
+        anchors: (hrefs, anchor_texts) of the links with an href and a text, see get_link_with_anchor
+        content_text: text without page header and footer (the first header, head, footer and foot elements)
+        content_links: <a> elements outside of the page header and footer
+        iframe_url: src of the first iframe outside of the page header and footer, or None
+    Values that need a webdriver or the network (iframe or pdf text) can be cached with memo().
+    """
+
+    def __init__(self, page_source, url=''):
+        self.page_source = page_source
+        self.url = url
+        self.final_url = url  # the URL after redirects, base of relative links
+        self.tier = None  # how the page was loaded, see fetcher.PageLoader
+        self.headers = {}  # response headers (lower-case names) of a page fetched over HTTP
+        self._soup = None
+        self._stripped = False
+        self._memo = {}
+
+    @classmethod
+    def from_driver(cls, driver, url=None):
+        """
+        Capture the page currently loaded in a webdriver. url defaults to driver.current_url.
+        """
+        snapshot = cls(driver.page_source, url if url is not None else driver.current_url)
+        snapshot.final_url = driver.current_url
+        return snapshot
+
+    def memo(self, key, compute):
+        """
+        Return the value cached under key, computing it with compute() on first use.
+        """
+        if key not in self._memo:
+            self._memo[key] = compute()
+        return self._memo[key]
+
+    def is_memoized(self, key):
+        return key in self._memo
+
+    @property
+    def soup(self):
+        if self._soup is None:
+            with span('parse', size=len(self.page_source)):
+                self._soup = BeautifulSoup(self.page_source, get_html_parser())
+        return self._soup
+
+    @property
+    def text(self):
+        return self.memo('text', self.soup.get_text)
+
+    @property
+    def links(self):
+        return self.memo('links', lambda: self.soup.find_all('a'))
+
+    @property
+    def anchors(self):
+        return self.memo('anchors', lambda: get_link_with_anchor(self.links))
+
+    @property
+    def content_text(self):
+        self._strip_header_footer()
+        return self.memo('content_text', lambda: reformat(self.soup.get_text()))
+
+    @property
+    def content_links(self):
+        self._strip_header_footer()
+        return self.memo('content_links', lambda: self.soup.find_all('a'))
+
+    @property
+    def iframe_url(self):
+        def find_iframe_url():
+            iframe = self.soup.find('iframe')
+            return iframe.get('src') if iframe else None
+
+        self._strip_header_footer()
+        return self.memo('iframe_url', find_iframe_url)
+
+    def _strip_header_footer(self):
+        # the header and footer are removed from the parsed tree itself, so everything derived from the whole page
+        # is computed before
+        if self._stripped:
+            return
+        self.text
+        self.links
+        for name in ('header', 'head', 'footer', 'foot'):
+            element = self.soup.find(name)
+            if element:
+                element.extract()
+        self._stripped = True
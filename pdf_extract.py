@@ -0,0 +1,219 @@
+"""
+Text extraction from pdf documents. Documents are downloaded in chunks into a temporary file instead of memory, and
+their text is extracted in a pool of worker processes (config['pdf_workers'] of them), so that a slow or broken
+document can be stopped after config['pdf_timeout'] seconds without stopping the crawler. At most
+config['pdf_max_pages'] pages are read, and extraction stops early once max_chars characters were extracted (e.g. for
+classifying a document, which only needs its beginning). PyMuPDF is used instead of pdfminer if it is installed and
+config['pdf_backend'] allows it.
+"""
+import io
+import os
+import weakref
+import tempfile
+import threading
+import multiprocessing
+from tracing import span
+from config import config
+
+
+def is_pdf_content(content_type, head):
+    """
+    Return True if a response with this content type (lower-cased, without parameters) whose content starts with head
+    (bytes) is a pdf document.
+    """
+    return content_type == 'application/pdf' or b'%PDF-' in head[:1024]
+
+
+def get_backend(backend=None):
+    """
+    Return the backend extracting pdf text: 'pymupdf' or 'pdfminer'. backend (default: config['pdf_backend']) 'auto'
+    selects PyMuPDF if it is installed.
+    """
+    backend = backend or config['pdf_backend']
+    if backend == 'auto':
+        try:
+            import fitz  # noqa: F401
+            return 'pymupdf'
+        except ImportError:
+            return 'pdfminer'
+    return backend
+
+
+def _extract_with_pdfminer(source, max_pages, max_chars):
+    from pdfminer.converter import TextConverter
+    from pdfminer.layout import LAParams
+    from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
+    from pdfminer.pdfpage import PDFPage
+
+    truncated = False
+    with (open(source, 'rb') if isinstance(source, str) else io.BytesIO(source)) as data, io.StringIO() as outfp:
+        resource_manager = PDFResourceManager()
+        device = TextConverter(resource_manager, outfp, laparams=LAParams())
+        interpreter = PDFPageInterpreter(resource_manager, device)
+        for page in PDFPage.get_pages(data, maxpages=max_pages or 0):
+            if max_chars and outfp.tell() >= max_chars:
+                truncated = True
+                break
+            interpreter.process_page(page)
+        device.close()
+        return outfp.getvalue(), truncated
+
+
+def _extract_with_pymupdf(source, max_pages, max_chars):
+    import fitz
+
+    parts, length, truncated = [], 0, False
+    document = fitz.open(source) if isinstance(source, str) else fitz.open(stream=source, filetype='pdf')
+    with document:
+        for page_number, page in enumerate(document):
+            if max_pages and page_number >= max_pages:
+                break
+            if max_chars and length >= max_chars:
+                truncated = True
+                break
+            parts.append(page.get_text() + '\f')
+            length += len(parts[-1])
+    return ''.join(parts), truncated
+
+
+def extract_text_in_process(source, backend='pdfminer', max_pages=None, max_chars=None):
+    """
+    Extract the text of a pdf document (a file path or bytes) in the current process. Return (text, truncated),
+    where truncated is True if pages were left out because max_chars characters were already extracted. A document
+    that cannot be read gives an empty text.
+    """
+    extract = _extract_with_pymupdf if backend == 'pymupdf' else _extract_with_pdfminer
+    try:
+        return extract(source, max_pages, max_chars)
+    except Exception:
+        return '', False
+
+
+POOL_START_TIMEOUT = 20  # seconds the worker processes of a new pool may take to answer a first task
+
+_pool = None
+_pool_pid = None
+_pool_failed_pid = None
+_pool_lock = threading.Lock()
+
+
+def _start_pool():
+    # the spawned workers import the __main__ module of the crawler again; if it starts a crawl without an
+    # "if __name__ == '__main__'" guard, they fail to start and the pool never answers
+    pool = multiprocessing.get_context('spawn').Pool(config['pdf_workers'])
+    try:
+        pool.apply_async(os.getpid).get(timeout=POOL_START_TIMEOUT)
+    except Exception:
+        pool.terminate()
+        raise
+    return pool
+
+
+def _get_pool():
+    # one pool per process: a pool inherited from a parent process (or a batch worker) cannot be used. None if the
+    # pool of this process could not be started
+    global _pool, _pool_pid, _pool_failed_pid
+    with _pool_lock:
+        if _pool_failed_pid == os.getpid():
+            return None
+        if _pool is None or _pool_pid != os.getpid():
+            try:
+                _pool = _start_pool()
+            except Exception as e:
+                print(f'Could not start the pdf extraction processes ({e!r}), extracting pdf text in the crawler')
+                _pool, _pool_failed_pid = None, os.getpid()
+                return None
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _reset_pool(pool):
+    # stop the workers of a pool that has a stuck extraction, a new pool is started on the next use
+    global _pool
+    with _pool_lock:
+        pool.terminate()
+        if _pool is pool:
+            _pool = None
+
+
+def extract_text(source, max_chars=None):
+    """
+    Extract the text of a pdf document (a file path or bytes) in the worker pool, reading at most
+    config['pdf_max_pages'] pages and stopping after max_chars characters (default: no limit). Return (text,
+    truncated), see extract_text_in_process. If the extraction takes longer than config['pdf_timeout'] seconds, it is
+    stopped and the text is empty. With config['pdf_workers'] 0 or None, or if the pool cannot be started, the text is
+    extracted in the calling thread, without a timeout.
+    """
+    arguments = (source, get_backend(), config['pdf_max_pages'], max_chars)
+    size = os.path.getsize(source) if isinstance(source, str) else len(source)
+    with span('pdf_extract', size=size, max_chars=max_chars):
+        pool = _get_pool() if config['pdf_workers'] else None
+        if pool is None:
+            return extract_text_in_process(*arguments)
+        try:
+            return pool.apply_async(extract_text_in_process, arguments).get(timeout=config['pdf_timeout'])
+        except multiprocessing.TimeoutError:
+            print(f'Extracting pdf text took more than {config["pdf_timeout"]} seconds, stopped')
+            _reset_pool(pool)
+            return '', False
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def download_pdf(url, http_client=None):
+    """
+    Download the pdf document at url into a temporary file, streaming it instead of keeping it in memory. Return the
+    path of the file, which the caller has to remove, or None if url cannot be downloaded or is not a pdf document.
+    """
+    from fetcher import FETCH_ERRORS, get_http_client  # not imported by the worker processes, which only extract text
+
+    http_client = http_client or get_http_client()
+    f = tempfile.NamedTemporaryFile(suffix='.pdf', delete=False)
+    try:
+        with span('pdf_download'), f:
+            result = http_client.fetch(url, stream_to=f)
+            head = f.read(1024)
+        if result.status < 400 and is_pdf_content(result.content_type, head):
+            return f.name
+    except FETCH_ERRORS:
+        pass
+    _remove(f.name)
+    return None
+
+
+def get_snapshot_pdf_text(snapshot, max_chars=None):
+    """
+    Return the text of the pdf document at the URL of a snapshot, or only about its first max_chars characters. The
+    document is downloaded at most once per snapshot (a snapshot fetched over HTTP already has its content, memo key
+    'pdf_content') and each text is extracted only once; the full text reuses the beginning if that was the whole
+    document.
+    """
+    def source():
+        content = snapshot.memo('pdf_content', lambda: None)
+        if content is not None:
+            return content
+        path = snapshot.memo('pdf_file', lambda: download_pdf(snapshot.url))
+        if path is not None and not snapshot.is_memoized('pdf_file_finalizer'):
+            snapshot.memo('pdf_file_finalizer', lambda: weakref.finalize(snapshot, _remove, path))
+        return path
+
+    def extract(limit):
+        document = source()
+        return extract_text(document, limit) if document is not None else ('', False)
+
+    if max_chars is not None:
+        return snapshot.memo('pdf_text_head', lambda: extract(max_chars))[0]
+
+    def extract_all():
+        if snapshot.is_memoized('pdf_text_head'):
+            head, truncated = snapshot.memo('pdf_text_head', None)
+            if not truncated:
+                return head
+        return extract(None)[0]
+
+    return snapshot.memo('pdf_text', extract_all)
@@ -0,0 +1,223 @@
+"""
+Finding the privacy policy of an app by its name with a web search, when its URL cannot be loaded or is a 404 page.
+A PolicyResolver asks its search backends in turn and caches the URLs it found by app name:
+    HttpSearchBackend: fetches a search results page over plain HTTP (DuckDuckGo's HTML page by default)
+    BrowserSearchBackend: searches Google in the Chrome driver of the current job
+    StubSearchBackend: returns fixed URLs, for tests and offline benchmarks
+The backends are selected by name in config['search_backends'].
+"""
+import os
+import time
+import sqlite3
+import threading
+import concurrent.futures
+from urllib.parse import quote_plus, urljoin, urlsplit, parse_qs
+from bs4 import BeautifulSoup
+from selenium.webdriver.common.by import By
+from selenium.webdriver.common.keys import Keys
+from fetcher import FETCH_ERRORS, get_http_client
+from page_snapshot import get_html_parser
+from page_readiness import wait_for_element
+from tracing import span
+from config import config
+
+SEARCH_QUERY = '{app_name} privacy policy English'
+
+
+def _site(host):
+    # the last two labels of a host name, e.g. duckduckgo.com for html.duckduckgo.com, or the whole IP address
+    host = host or ''
+    return host if host.replace('.', '').isdigit() else '.'.join(host.split('.')[-2:])
+
+
+class HttpSearchBackend:
+    """
+    Search over plain HTTP: fetch url_template (with {query} replaced by the URL-encoded query) and return the links
+    matching result_selector, in order. Redirect links of the search engine (e.g. //duckduckgo.com/l/?uddg=<url>)
+    are resolved to the URL they point to.
+    """
+    needs_browser = False
+
+    def __init__(self, url_template=None, result_selector=None, http_client=None):
+        self.url_template = url_template or config['search_http_url']
+        self.result_selector = result_selector or config['search_http_result_selector']
+        self.http_client = http_client
+
+    def search(self, query, loader=None):
+        search_url = self.url_template.format(query=quote_plus(query))
+        http_client = self.http_client or get_http_client()
+        try:
+            result = http_client.fetch(search_url)
+        except FETCH_ERRORS:
+            return []
+        if result.status >= 400:
+            return []
+        soup = BeautifulSoup(result.text, get_html_parser())
+        search_site = _site(urlsplit(result.final_url).hostname)
+        urls = []
+        for link in soup.select(self.result_selector):
+            href = urljoin(result.final_url, link.get('href', ''))
+            parts = urlsplit(href)
+            redirect_target = parse_qs(parts.query).get('uddg')
+            if redirect_target:
+                href = redirect_target[0]
+            elif _site(parts.hostname) == search_site:
+                continue  # a link within the search engine, e.g. an ad
+            if urlsplit(href).scheme in ('http', 'https'):
+                urls.append(href)
+        return urls
+
+
+class BrowserSearchBackend:
+    """
+    Search Google in Chrome, with the driver of the PageLoader of the current job.
+    """
+    needs_browser = True
+
+    def search(self, query, loader=None):
+        if loader is None:
+            return []
+        driver = loader.driver
+        driver.get('https://www.google.com')
+        search_box = wait_for_element(driver, By.NAME, 'q')
+        search_box.send_keys(query)
+        search_box.send_keys(Keys.RETURN)
+        return [wait_for_element(driver, By.CSS_SELECTOR, 'div#search .g a').get_attribute('href')]
+
+
+class StubSearchBackend:
+    """
+    Return fixed results: results (default: config['search_stub_results']) maps app names to the URL of their policy.
+    Apps not in results are not found.
+    """
+    needs_browser = False
+
+    def __init__(self, results=None):
+        self.results = results if results is not None else config['search_stub_results']
+        self.queries = []
+
+    def search(self, query, loader=None):
+        self.queries.append(query)
+        for app_name, url in self.results.items():
+            if query == SEARCH_QUERY.format(app_name=app_name):
+                return [url]
+        return []
+
+
+class SearchCache:
+    """
+    URLs found for app names, kept in memory and, if path is not None, in a SQLite database. Entries older than ttl
+    seconds (if ttl is not None) are treated as missing.
+    """
+
+    def __init__(self, path=None, ttl=None):
+        self.ttl = ttl
+        self._memory = {}
+        self._lock = threading.Lock()
+        self._connection = None
+        if path is not None:
+            self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS results '
+                                     '(app_name TEXT PRIMARY KEY, url TEXT, resolved_at REAL)')
+
+    def get(self, app_name):
+        with self._lock:
+            entry = self._memory.get(app_name)
+            if entry is None and self._connection is not None:
+                entry = self._connection.execute('SELECT url, resolved_at FROM results WHERE app_name = ?',
+                                                 (app_name,)).fetchone()
+            if entry is None or (self.ttl is not None and entry[1] < time.time() - self.ttl):
+                return None
+            self._memory[app_name] = entry
+            return entry[0]
+
+    def set(self, app_name, url):
+        entry = (url, time.time())
+        with self._lock:
+            self._memory[app_name] = entry
+            if self._connection is not None:
+                with self._connection:
+                    self._connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?)', (app_name, *entry))
+
+
+class SearchDeferred(Exception):
+    """
+    Raised by PolicyResolver.resolve instead of searching when defer_searches is set and the app name is not cached.
+    run_batch collects the app names of these jobs, resolves them together with resolve_many and runs the jobs again.
+    """
+
+
+class PolicyResolver:
+    """
+    Finds the policy URL of apps by name with the search backends, in turn, until one of them has a result. Found
+    URLs are cached by app name (apps without a result are searched again next time). With defer_searches set,
+    resolve only looks up the cache and raises SearchDeferred on a miss.
+
+    Usage:
+        resolver = get_policy_resolver()
+        url = resolver.resolve('Some App', loader)
+        urls = resolver.resolve_many(['Some App', 'Other App'])
+    """
+
+    def __init__(self, backends, cache=None):
+        self.backends = backends
+        self.cache = cache if cache is not None else SearchCache()
+        self.defer_searches = False
+
+    def resolve(self, app_name, loader=None):
+        """
+        Return the URL of the top search result for the policy of app_name, or None if nothing was found. loader is
+        the PageLoader of the current job, whose driver backends that need Chrome use; without it they are skipped.
+        """
+        key = app_name.strip().lower()
+        with span('search') as current_span:
+            url = self.cache.get(key)
+            if url is not None:
+                if current_span is not None:
+                    current_span.attributes['cached'] = True
+                return url
+            if self.defer_searches:
+                raise SearchDeferred(app_name)
+            query = SEARCH_QUERY.format(app_name=app_name.strip())
+            for backend in self.backends:
+                if backend.needs_browser and loader is None:
+                    continue
+                try:
+                    urls = backend.search(query, loader)
+                except Exception:
+                    urls = []
+                if urls:
+                    if current_span is not None:
+                        current_span.attributes['backend'] = type(backend).__name__
+                    self.cache.set(key, urls[0])
+                    return urls[0]
+            return None
+
+    def resolve_many(self, app_names, workers=None):
+        """
+        Resolve several apps concurrently (at most workers, default config['search_workers'], at a time), without a
+        browser. Return a dict mapping every app name to its URL or None. The results are cached, so crawling the
+        apps afterwards does not search again.
+        """
+        app_names = list(dict.fromkeys(app_names))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers or config['search_workers']) as executor:
+            return dict(zip(app_names, executor.map(self.resolve, app_names)))
+
+
+SEARCH_BACKENDS = {'http': HttpSearchBackend, 'browser': BrowserSearchBackend, 'stub': StubSearchBackend}
+_resolver = None
+_resolver_pid = None
+
+
+def get_policy_resolver():
+    """
+    Return the PolicyResolver of the current process, with the backends named in config['search_backends'] and the
+    cache in config['search_cache_path'] (in memory only if it is None).
+    """
+    global _resolver, _resolver_pid
+    if _resolver is None or _resolver_pid != os.getpid():
+        backends = [SEARCH_BACKENDS[name]() for name in config['search_backends']]
+        _resolver = PolicyResolver(backends, SearchCache(config['search_cache_path'], config['search_cache_ttl']))
+        _resolver_pid = os.getpid()
+    return _resolver
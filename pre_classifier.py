@@ -0,0 +1,186 @@
+"""
+A cheap local classifier deciding if a page text is a privacy policy before ChatGPT is asked. It combines keyword
+features with a small logistic regression model trained on sample_outputs/saved_policies and
+sample_outputs/saved_non_policies (next to this file). Only pages with a confident decision skip ChatGPT; pages in the
+uncertain band between the thresholds in config are still classified by ChatGPT.
+
+Train the model with `python pre_classifier.py`. It is also trained automatically the first time it is needed.
+"""
+import os
+import re
+import json
+import math
+import tempfile
+import threading
+from config import config
+
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_OUTPUTS = os.path.join(MODULE_DIR, 'sample_outputs')
+
+POLICY_HEADINGS = re.compile(r'privacy (policy|notice|statement)|data protection (policy|notice)|datenschutz')
+TERMS_HEADINGS = re.compile(r'terms (of (use|service)|and conditions)|end user license|eula')
+ERROR_MARKERS = re.compile(r'\b404\b|page not found|not be found|does not exist|no longer available')
+POLICY_TERMS = ['personal information', 'personal data', 'third part', 'cookie', 'gdpr', 'ccpa', 'california',
+                'data protection', 'opt out', 'opt-out', 'retention', 'retain', 'disclose', 'collect', 'consent',
+                'children', 'processing', 'controller', 'your rights', 'privacy', 'advertis', 'analytics',
+                'ip address', 'device identifier', 'we share', 'we use', 'unsubscribe', 'data subject',
+                'legitimate interest', 'security']
+
+# privacy policies are long documents, shorter pages are never confidently classified as policies
+MIN_POLICY_WORDS = 150
+
+FEATURE_NAMES = ['bias', 'policy_heading', 'terms_heading', 'error_marker', 'policy_term_density',
+                 'distinct_policy_terms', 'privacy_density', 'log_length']
+
+_model = None
+_model_lock = threading.Lock()
+_stats = {'policy': 0, 'non_policy': 0, 'uncertain': 0, 'llm_calls_avoided': 0}
+
+
+def extract_features(text):
+    """
+    Return the feature vector (see FEATURE_NAMES) of a page text.
+    """
+    lowered = text.lower()
+    beginning = lowered[:500]
+    words = max(1, len(re.findall(r'\w+', lowered)))
+    term_counts = [lowered.count(term) for term in POLICY_TERMS]
+    return [
+        1.0,
+        1.0 if POLICY_HEADINGS.search(beginning) else 0.0,
+        1.0 if TERMS_HEADINGS.search(beginning) else 0.0,
+        1.0 if ERROR_MARKERS.search(beginning) else 0.0,
+        min(1.0, 10 * sum(term_counts) / words),
+        sum(1 for count in term_counts if count) / len(POLICY_TERMS),
+        min(1.0, 50 * lowered.count('privacy') / words),
+        math.log(words + 1) / 10,
+    ]
+
+
+def _sigmoid(x):
+    return 1 / (1 + math.exp(-max(-30.0, min(30.0, x))))
+
+
+def train(policy_folder=None, non_policy_folder=None, iterations=6000, learning_rate=1.0, l2=0.0001):
+    """
+    Train the logistic regression model on the text files of the two folders (default: saved_policies and
+    saved_non_policies in sample_outputs next to this file) with batch gradient descent. Non-policies are weighted so
+    that both classes contribute equally. Return the model as a dict.
+    """
+    policy_folder = policy_folder or os.path.join(SAMPLE_OUTPUTS, 'saved_policies')
+    non_policy_folder = non_policy_folder or os.path.join(SAMPLE_OUTPUTS, 'saved_non_policies')
+    samples = []
+    for folder, label in ((policy_folder, 1), (non_policy_folder, 0)):
+        for file_name in sorted(os.listdir(folder)):
+            with open(os.path.join(folder, file_name), encoding='utf-8') as f:
+                # the classifier sees the beginning of long texts, see collect_page_text
+                text = f.read()[:15000]
+            if text.strip():
+                samples.append((extract_features(text), label))
+
+    positives = sum(label for _, label in samples)
+    class_weight = {1: len(samples) / (2 * positives), 0: len(samples) / (2 * (len(samples) - positives))}
+    weights = [0.0] * len(FEATURE_NAMES)
+    for _ in range(iterations):
+        gradient = [0.0] * len(weights)
+        for features, label in samples:
+            error = (_sigmoid(sum(w * x for w, x in zip(weights, features))) - label) * class_weight[label]
+            for i, x in enumerate(features):
+                gradient[i] += error * x
+        weights = [w - learning_rate * (g / len(samples) + l2 * w) for w, g in zip(weights, gradient)]
+
+    correct = sum((_sigmoid(sum(w * x for w, x in zip(weights, features))) >= 0.5) == bool(label)
+                  for features, label in samples)
+    return {'features': FEATURE_NAMES, 'weights': weights, 'training_samples': len(samples),
+            'training_accuracy': correct / len(samples)}
+
+
+def model_path():
+    """
+    Return the path of the model file, config['preclassifier_model_path'] (relative to the folder of this file).
+    """
+    return os.path.join(MODULE_DIR, config['preclassifier_model_path'])
+
+
+def save_model(model, path=None):
+    """
+    Write a model to path (default: model_path()) through a temporary file, so that other processes never read a
+    partly written model.
+    """
+    path = path or model_path()
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.preclassifier-', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(model, f, indent=2)
+        os.chmod(temp_path, 0o644)  # mkstemp creates the file readable by its owner only
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def load_model():
+    """
+    Load the model from model_path(), training and saving it first if the file does not exist.
+    """
+    global _model
+    with _model_lock:
+        if _model is None:
+            path = model_path()
+            if os.path.exists(path):
+                with open(path, encoding='utf-8') as f:
+                    _model = json.load(f)
+            else:
+                _model = train()
+                save_model(_model, path)
+    return _model
+
+
+def policy_probability(text):
+    """
+    Return the probability that a page text is a privacy policy according to the local model.
+    """
+    weights = load_model()['weights']
+    return _sigmoid(sum(w * x for w, x in zip(weights, extract_features(text))))
+
+
+def pre_classify(text):
+    """
+    Decide locally if a page text is a privacy policy.
+
+    Return:
+        True or False if the model is confident (probability at least config['preclassifier_policy_threshold'], or at
+        most config['preclassifier_non_policy_threshold']), None if ChatGPT should decide
+    """
+    if not text.strip():
+        decision = None  # e.g. a PDF that could not be read
+    else:
+        probability = policy_probability(text)
+        long_enough = len(re.findall(r'\w+', text)) >= MIN_POLICY_WORDS
+        if probability >= config['preclassifier_policy_threshold'] and long_enough:
+            decision = True
+        elif probability <= config['preclassifier_non_policy_threshold']:
+            decision = False
+        else:
+            decision = None
+    _stats[{True: 'policy', False: 'non_policy', None: 'uncertain'}[decision]] += 1
+    return decision
+
+
+def record_llm_calls_avoided(count):
+    _stats['llm_calls_avoided'] += count
+
+
+def get_stats():
+    """
+    Return the decisions made in this process and the number of ChatGPT calls they avoided.
+    """
+    return dict(_stats)
+
+
+if __name__ == '__main__':
+    model = train()
+    save_model(model)
+    print(f'Trained on {model["training_samples"]} samples, training accuracy {model["training_accuracy"]:.3f}')
+    for name, weight in zip(model['features'], model['weights']):
+        print(f'{name}: {weight:.3f}')
@@ -0,0 +1,176 @@
+"""
+Builds the parts of the prompts that come from a page: the page text GenAI classifies and the anchor texts it picks a
+link from. Both are fitted into a token budget (counted for config['chatgpt_model']) by keeping what is informative
+and dropping what is not, instead of cutting the text at a fixed length.
+"""
+import re
+import threading
+from pre_classifier import POLICY_TERMS
+from tracing import span
+from config import config
+
+# anchors that only navigate the website (matched against the whole, lower-cased anchor text). Language selectors
+# such as "English" are kept, they may lead to the English version of a policy
+NAVIGATIONAL_ANCHOR = re.compile(r'(home( page)?|about( us)?|blog|news|press|careers?|jobs|contact( us)?|help|support|'
+                                 r'faq|log ?in|sign ?in|sign ?up|register|log ?out|search|menu|cart|shop|store|'
+                                 r'download|more|read more|next|prev(ious)?|back|back to top|skip to (main )?content|'
+                                 r'facebook|twitter|x|instagram|linkedin|youtube|tiktok|pinterest|[\W\d_]*)')
+# anchors that may lead to a privacy policy are never dropped
+POLICY_ANCHOR = re.compile(r'privacy|policy|policies|legal|terms|notice|gdpr|ccpa|cookie|data|datenschutz|'
+                           r'confidential', re.IGNORECASE)
+MAX_ANCHOR_LENGTH = 150
+WINDOW_CHARS = 800
+
+_encoding = None
+_encoding_model = None
+_stats = {'compactions': 0, 'tokens_before': 0, 'tokens_after': 0}
+_stats_lock = threading.Lock()
+
+
+def _get_encoding(model):
+    global _encoding, _encoding_model
+    if _encoding_model != model:
+        try:
+            import tiktoken
+            try:
+                _encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encoding = tiktoken.get_encoding('cl100k_base')
+        except ImportError:
+            _encoding = None
+        _encoding_model = model
+    return _encoding
+
+
+def count_tokens(text, model=None):
+    """
+    Return the number of tokens of text for the model (default: config['chatgpt_model']), counted with tiktoken if it
+    is installed, otherwise estimated as one token per 4 characters.
+    """
+    encoding = _get_encoding(model or config['chatgpt_model'])
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _record(current_span, tokens_before, tokens_after):
+    with _stats_lock:
+        _stats['compactions'] += 1
+        _stats['tokens_before'] += tokens_before
+        _stats['tokens_after'] += tokens_after
+    if current_span is not None:
+        current_span.attributes.update(tokens_before=tokens_before, tokens_after=tokens_after)
+
+
+def get_stats():
+    """
+    Return the number of compacted texts and their tokens before and after compaction in this process.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['tokens_saved'] = stats['tokens_before'] - stats['tokens_after']
+    return stats
+
+
+def compact_anchors(anchor_texts, budget=None):
+    """
+    Return the anchor texts worth showing GenAI, in their original order: stripped, without empty and duplicated
+    (case-insensitive) ones and without navigational ones (see NAVIGATIONAL_ANCHOR) or very long ones, unless they
+    mention privacy, policies or legal terms. If they do not fit into budget tokens (default:
+    config['anchor_token_budget']), the anchors mentioning privacy are kept first. The texts are not changed otherwise,
+    so the answer of GenAI can still be looked up in the anchor texts of the page.
+    """
+    budget = budget or config['anchor_token_budget']
+    with span('compact_prompt', kind='anchors') as current_span:
+        kept = []
+        seen = set()
+        for anchor_text in anchor_texts:
+            anchor_text = anchor_text.strip()
+            key = anchor_text.lower()
+            if not anchor_text or key in seen:
+                continue
+            seen.add(key)
+            if not POLICY_ANCHOR.search(anchor_text) and (NAVIGATIONAL_ANCHOR.fullmatch(key)
+                                                          or len(anchor_text) > MAX_ANCHOR_LENGTH):
+                continue
+            kept.append(anchor_text)
+
+        costs = [count_tokens(anchor_text) + 1 for anchor_text in kept]  # + the newline joining them
+        if sum(costs) > budget:
+            order = sorted(range(len(kept)), key=lambda i: (POLICY_ANCHOR.search(kept[i]) is None, i))
+            selected, used = set(), 0
+            for i in order:
+                if used + costs[i] <= budget:
+                    selected.add(i)
+                    used += costs[i]
+            kept = [anchor_text for i, anchor_text in enumerate(kept) if i in selected]
+
+        _record(current_span, count_tokens('\n'.join(anchor_texts)), count_tokens('\n'.join(kept)))
+    return kept
+
+
+def _split_windows(text):
+    # consecutive lines grouped into windows of about WINDOW_CHARS characters, longer lines are cut
+    windows = []
+    current = ''
+    for line in text.split('\n'):
+        if not line.strip():
+            continue
+        while len(line) > WINDOW_CHARS:
+            cut = line.rfind(' ', 0, WINDOW_CHARS)
+            cut = cut if cut > 0 else WINDOW_CHARS
+            if current:
+                windows.append(current)
+                current = ''
+            windows.append(line[:cut])
+            line = line[cut:]
+        if current and len(current) + len(line) > WINDOW_CHARS:
+            windows.append(current)
+            current = ''
+        current = current + '\n' + line if current else line
+    if current:
+        windows.append(current)
+    return windows
+
+
+def _keyword_density(window):
+    lowered = window.lower()
+    return sum(lowered.count(term) for term in POLICY_TERMS) / max(1, len(window))
+
+
+def compact_page_text(text, budget=None):
+    """
+    Fit a page text into budget tokens (default: config['page_text_token_budget']). A text that fits is returned
+    unchanged. Otherwise the text is cut into windows of consecutive lines, and the windows at the beginning of the
+    text (config['page_text_beginning_share'] of the budget) and then the windows with the most privacy keywords are
+    kept, in their original order, with '...' where windows were left out.
+    """
+    budget = budget or config['page_text_token_budget']
+    with span('compact_prompt', kind='page_text') as current_span:
+        tokens = count_tokens(text)
+        if tokens <= budget:
+            _record(current_span, tokens, tokens)
+            return text
+
+        windows = _split_windows(text)
+        costs = [count_tokens(window) + 2 for window in windows]  # + the separator
+        selected, used = set(), 0
+        beginning_budget = budget * config['page_text_beginning_share']
+        for i, cost in enumerate(costs):
+            if used + cost > beginning_budget:
+                break
+            selected.add(i)
+            used += cost
+        for i in sorted(range(len(windows)), key=lambda i: -_keyword_density(windows[i])):
+            if i not in selected and used + costs[i] <= budget:
+                selected.add(i)
+                used += costs[i]
+
+        parts = []
+        for i in sorted(selected):
+            if parts and i - 1 not in selected:
+                parts.append('...')
+            parts.append(windows[i])
+        compacted = '\n'.join(parts)
+        _record(current_span, tokens, count_tokens(compacted))
+    return compacted
@@ -0,0 +1,163 @@
+import json
+import time
+import threading
+import contextlib
+from config import config
+
+_local = threading.local()
+
+
+class Trace:
+    """
+    Timings of the stages of one job (e.g. downloading the policy of one app) and the ChatGPT calls it made. A trace
+    is started with start_trace() and collects the spans opened with span() in the same thread.
+    """
+
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.start = time.time()
+        self.duration = None
+        self.spans = []  # dicts with name, start (seconds since the start of the trace), duration, depth, attributes
+        self.llm_calls = []
+        self._depth = 0
+
+    def stage_totals(self):
+        """
+        Return the total duration of each stage (spans with the same name) in this trace.
+        """
+        totals = {}
+        for span_record in self.spans:
+            totals[span_record['name']] = totals.get(span_record['name'], 0.0) + span_record['duration']
+        return totals
+
+    def to_record(self):
+        return {'name': self.name, **self.attributes, 'duration': self.duration, 'stages': self.stage_totals(),
+                'spans': self.spans, 'llm_calls': self.llm_calls}
+
+
+class _Span:
+    def __init__(self, trace, name, attributes):
+        self.trace = trace
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.trace._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        duration = time.perf_counter() - self.start
+        self.trace._depth -= 1
+        record = {'name': self.name, 'start': time.time() - duration - self.trace.start, 'duration': duration,
+                  'depth': self.trace._depth}
+        record.update(self.attributes)
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        self.trace.spans.append(record)
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def current_trace():
+    """
+    Return the trace of the current thread, or None if tracing is off or no trace was started.
+    """
+    return getattr(_local, 'trace', None)
+
+
+@contextlib.contextmanager
+def start_trace(name, **attributes):
+    """
+    Collect the spans and ChatGPT calls of the current thread in a new Trace, which is yielded (None if
+    config['tracing_enabled'] is False).
+    """
+    if not config['tracing_enabled']:
+        yield None
+        return
+    trace = Trace(name, **attributes)
+    previous, _local.trace = current_trace(), trace
+    try:
+        yield trace
+    finally:
+        trace.duration = time.time() - trace.start
+        _local.trace = previous
+
+
+def span(name, **attributes):
+    """
+    Time a stage of the current trace:
+        with span('browser_load', url=url):
+            driver.get(url)
+    Without a trace this returns a shared context manager that does nothing.
+    """
+    trace = current_trace()
+    if trace is None:
+        return _NOOP_SPAN
+    return _Span(trace, name, attributes)
+
+
+def record_llm_call(purpose, prompt_chars, prompt_tokens=None, completion_tokens=None, attempts=1, duration=None,
+                    cached=False):
+    """
+    Record a ChatGPT call (or an answer found in the LLM cache) in the current trace, if there is one.
+    """
+    trace = current_trace()
+    if trace is not None:
+        trace.llm_calls.append({'purpose': purpose, 'prompt_chars': prompt_chars, 'prompt_tokens': prompt_tokens,
+                                'completion_tokens': completion_tokens, 'attempts': attempts, 'duration': duration,
+                                'cached': cached})
+
+
+def percentile(values, p):
+    """
+    Return the p-th percentile (0-100) of a list of numbers with the nearest-rank method.
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(1, -(-len(ordered) * p // 100))  # ceil without floats
+    return ordered[int(rank) - 1]
+
+
+def summarize(records):
+    """
+    Summarize trace records (see Trace.to_record) of a run: p50, p95, p99 and total of each stage over the jobs that
+    went through it, of the whole jobs, and the totals of the ChatGPT calls.
+    """
+    stage_durations = {}
+    for record in records:
+        for name, duration in record['stages'].items():
+            stage_durations.setdefault(name, []).append(duration)
+    job_durations = [record['duration'] for record in records if record['duration'] is not None]
+    stage_durations['total'] = job_durations
+
+    llm_calls = [call for record in records for call in record['llm_calls']]
+    sent_calls = [call for call in llm_calls if not call['cached']]
+    return {
+        'jobs': len(records),
+        'stages': {name: {'count': len(durations), 'p50': percentile(durations, 50),
+                          'p95': percentile(durations, 95), 'p99': percentile(durations, 99),
+                          'total': sum(durations)}
+                   for name, durations in stage_durations.items()},
+        'llm': {'calls': len(sent_calls), 'cached': len(llm_calls) - len(sent_calls),
+                'attempts': sum(call['attempts'] for call in sent_calls),
+                'prompt_chars': sum(call['prompt_chars'] for call in sent_calls),
+                'prompt_tokens': sum(call['prompt_tokens'] or 0 for call in sent_calls),
+                'completion_tokens': sum(call['completion_tokens'] or 0 for call in sent_calls)},
+    }
+
+
+def write_record(f, record):
+    f.write(json.dumps(record, default=str) + '\n')
+    f.flush()
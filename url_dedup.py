@@ -0,0 +1,183 @@
+import json
+import sqlite3
+import itertools
+import http.client
+import concurrent.futures
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from fetcher import get_http_client
+from batch_runner import run_batch
+from output_store import link_output
+from config import config
+
+TRACKING_PARAMS = {'fbclid', 'gclid', 'dclid', 'msclkid', 'mc_cid', 'mc_eid', 'igshid', '_ga', '_gl', 'ref', 'ref_src'}
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def canonicalize_url(url):
+    """
+    Return a key that is equal for URLs which lead to the same page: the scheme is ignored (http and https), the
+    host is lower-cased, default ports, the fragment, tracking parameters (utm_*, fbclid, ...) and trailing slashes
+    are removed and the remaining query parameters are sorted.
+    """
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(parts.scheme.lower()):
+        host += f':{parts.port}'
+    path = parts.path.rstrip('/') or '/'
+    query = sorted((name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if not name.lower().startswith('utm_') and name.lower() not in TRACKING_PARAMS)
+    return urlunsplit(('', host, path, urlencode(query), ''))
+
+
+def resolve_final_url(url, http_client=None, timeout=None):
+    """
+    Follow the redirects of url with HEAD requests and return the URL they end at, or url itself if the server cannot
+    be reached.
+    """
+    http_client = http_client or get_http_client()
+    try:
+        return http_client.fetch(url, timeout=timeout, method='HEAD').final_url
+    except (OSError, http.client.HTTPException, ValueError):
+        return url
+
+
+class UrlDeduplicator:
+    """
+    Crawls apps that share a privacy policy only once. Apps are grouped by the canonical form of their URL (see
+    canonicalize_url) and then by the canonical form of the URL it redirects to, the first app of each group is
+    crawled by run_batch, and its saved text is linked to every other app of the group (see output_store.link_output).
+
+    Usage:
+        deduplicator = UrlDeduplicator()
+        for result in deduplicator.run_batch(app_list):
+            ...
+        print(deduplicator.stats())
+    """
+
+    def __init__(self, resolve_redirects=None, http_client=None):
+        self.resolve_redirects = (resolve_redirects if resolve_redirects is not None
+                                  else config['dedupe_resolve_redirects'])
+        self.http_client = http_client
+        self.app_count = 0
+        self._keys = {}  # canonical URL -> key of its group (canonical final URL)
+        self._groups = {}  # key -> result of the crawled app, or a list of the apps waiting for it
+
+    def keys_of(self, urls):
+        """
+        Return the group key of each URL. Redirects of URLs not seen before are resolved concurrently.
+        """
+        canonical_urls = [canonicalize_url(url) for url in urls]
+        new_urls = {canonical_url: url for canonical_url, url in zip(canonical_urls, urls)
+                    if canonical_url not in self._keys}
+        if self.resolve_redirects and new_urls:
+            http_client = self.http_client or get_http_client()
+            with concurrent.futures.ThreadPoolExecutor(max_workers=config['parallel_fetch_workers']) as executor:
+                final_urls = executor.map(lambda url: resolve_final_url(url, http_client), new_urls.values())
+                for canonical_url, final_url in zip(new_urls, final_urls):
+                    self._keys[canonical_url] = canonicalize_url(final_url)
+        else:
+            self._keys.update((canonical_url, canonical_url) for canonical_url in new_urls)
+        return [self._keys[canonical_url] for canonical_url in canonical_urls]
+
+    def stats(self):
+        """
+        Return the number of apps, the number of distinct pages crawled for them and the share of apps that did not
+        need their own crawl.
+        """
+        targets = len(self._groups)
+        return {'apps': self.app_count, 'targets': targets,
+                'dedup_ratio': 1 - targets / self.app_count if self.app_count else 0.0}
+
+    def run_batch(self, app_list, journal=None, on_result=None, results_path=None, chunk_size=64, **kwargs):
+        """
+        Like batch_runner.run_batch (the other keyword arguments are passed on), but every distinct page is crawled
+        only once. All results are generated in the order of app_list. The result of an app that shares the page of
+        an earlier app has the key duplicate_of set to the app_id of the crawled app and index set to None. The app
+        list is consumed lazily, chunk_size apps at a time.
+        """
+        results_file = open(results_path, 'a', encoding='utf-8') if results_path else None
+        positions = {}  # app_id of a crawled app -> its position in app_list
+        finished = {}  # position in app_list -> result, waiting for earlier results
+        next_position = 0
+        counter = itertools.count()
+
+        def emit(result):
+            if journal is not None and result.get('duplicate_of') is not None:
+                journal.mark_pending(result['app_id'], result['url'])
+                journal.record_result(result)
+            if results_file:
+                results_file.write(json.dumps(result, default=str) + '\n')
+                results_file.flush()
+            if on_result:
+                on_result(result)
+
+        def fan_out(crawled_result, app, position):
+            result = self._fan_out(crawled_result, *app)
+            emit(result)
+            finished[position] = result
+
+        def crawled_apps():
+            apps = iter(app_list)
+            if journal is not None:
+                apps = (app for app in apps if not journal.is_done(app[1]))
+            while True:
+                chunk = list(itertools.islice(apps, chunk_size))
+                if not chunk:
+                    return
+                for app, key in zip(chunk, self.keys_of([app[0] for app in chunk])):
+                    app_id = app[1]
+                    position = next(counter)
+                    self.app_count += 1
+                    group = self._groups.get(key)
+                    if group is None:
+                        self._groups[key] = []
+                        positions[app_id] = position
+                        yield app, key
+                    elif isinstance(group, list):
+                        group.append((app, position))
+                    else:
+                        fan_out(group, app, position)
+
+        keys = {}  # app_id of a crawled app -> key of its group
+
+        def submitted_apps():
+            for app, key in crawled_apps():
+                keys[app[1]] = key
+                yield app
+
+        def on_crawled(result):
+            emit(result)
+            finished[positions.pop(result['app_id'])] = result
+            key = keys.pop(result['app_id'], None)
+            waiting = self._groups.get(key)
+            self._groups[key] = result
+            for app, position in waiting or []:
+                fan_out(result, app, position)
+
+        try:
+            # the results of run_batch are taken from finished, where they are in order with the deduplicated apps
+            for _ in run_batch(submitted_apps(), journal=journal, on_result=on_crawled, **kwargs):
+                while next_position in finished:
+                    yield finished.pop(next_position)
+                    next_position += 1
+            while next_position in finished:
+                yield finished.pop(next_position)
+                next_position += 1
+        finally:
+            if results_file:
+                results_file.close()
+
+    def _fan_out(self, crawled_result, url, app_id, app_name=''):
+        # the result of an app whose page was crawled for another app, with the saved text linked to it
+        # the work of the crawl (its trace, ChatGPT calls avoided and tokens saved) is only counted for the crawled app
+        result = dict(crawled_result, index=None, url=url, app_id=app_id, app_name=app_name, elapsed_time=0.0,
+                      llm_calls_avoided=0, prompt_tokens_saved=0, tiers=[], duplicate_of=crawled_result['app_id'])
+        result.pop('trace', None)
+        source = crawled_result.get('output_path')
+        if source and crawled_result['error'] is None:
+            try:
+                result['output_path'] = link_output(source, crawled_result['app_id'], app_id)
+            except (OSError, sqlite3.Error) as e:
+                result['error'] = repr(e)
+                result['is_policy_page'] = None
+        return result